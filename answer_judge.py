@@ -0,0 +1,257 @@
+#回答の判定（ラウンド中に裏で進める）
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import disk_cache
+import logic
+
+# --- 設定 ---
+JUDGE_MODE = "per_answer"   # "per_answer": 入力ごとに裏で判定 / "batch": 結果画面でまとめて判定
+JUDGE_WORKERS = 8
+VERDICT_DB = "verdict_cache.db"    # 以前の判定の保存先（あれば最初に永続キャッシュへ移す）
+# 「〇〇県」と「〇〇」を同じ答えとみなすために外す接尾辞。
+# 府・都・市・区・町・村は外さない（「大阪府」と「大阪市」、「京都府」と「京都市」が同じになってしまう）
+STRIP_SUFFIXES = ("県",)
+VERDICT_KEY_VERSION = 2     # 正規化のしかたを変えたら上げる（古い正規化で保存した判定を使わないように）
+
+_executor = ThreadPoolExecutor(max_workers=JUDGE_WORKERS, thread_name_prefix="judge")
+
+# 比較用の集計（プロセス全体）
+_stats_lock = threading.Lock()
+_stats = {
+    "rounds": 0, "llm_calls": 0, "result_wait_total": 0.0,
+    "answers": 0, "example_hits": 0, "cache_hits": 0, "llm_judged": 0,
+}
+
+
+def judge_stats():
+    with _stats_lock:
+        rounds = _stats["rounds"]
+        answers = _stats["answers"]
+        avoided = _stats["example_hits"] + _stats["cache_hits"]
+        return {
+            "mode": get_judge_mode(),
+            "rounds": rounds,
+            "llm_calls": _stats["llm_calls"],
+            "llm_calls_per_round": (_stats["llm_calls"] / rounds) if rounds else 0.0,
+            "avg_result_wait": (_stats["result_wait_total"] / rounds) if rounds else 0.0,
+            "answers": answers,
+            "example_hits": _stats["example_hits"],
+            "cache_hits": _stats["cache_hits"],
+            "llm_judged": _stats["llm_judged"],
+            "llm_avoided_rate": (avoided / answers) if answers else 0.0,
+        }
+
+
+def get_judge_mode():
+    mode = logic.get_setting("JUDGE_MODE", JUDGE_MODE)
+    return mode if mode in ("per_answer", "batch") else JUDGE_MODE
+
+
+def _count(**counts):
+    with _stats_lock:
+        for name, n in counts.items():
+            _stats[name] += n
+
+
+def _to_hiragana(text):
+    # カタカナ(ァ～ヶ)をひらがなにずらす
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in text)
+
+
+def normalize_answer(text):
+    """表記ゆれを吸収した比較用の文字列を返す（NFKC・カナ→ひらがな・記号/空白除去・接尾辞除去）"""
+    text = unicodedata.normalize("NFKC", str(text)).strip().lower()
+    text = _to_hiragana(text)
+    text = re.sub(r"[\s・･、。,.!?！？「」『』（）()]", "", text)
+    for suffix in STRIP_SUFFIXES:
+        if len(text) > 2 and text.endswith(suffix):
+            text = text[:-len(suffix)]
+            break
+    return text
+
+
+class VerdictCache:
+    """過去の判定結果を (お題, 正規化した回答) で永続キャッシュの "judge" 名前空間に保存する"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    @staticmethod
+    def _key(question, answer):
+        return disk_cache.make_key(VERDICT_KEY_VERSION, question, normalize_answer(answer))
+
+    def get(self, question, answer):
+        row = self.cache.get("judge", self._key(question, answer))
+        if row is None:
+            return None
+        return {"answer": answer, "is_correct": bool(row["is_correct"]), "reason": row.get("reason") or ""}
+
+    def put(self, question, verdict, replace=True):
+        self.cache.set("judge", self._key(question, verdict["answer"]),
+                       {"is_correct": bool(verdict["is_correct"]), "reason": verdict.get("reason", "")},
+                       replace=replace)
+
+    def import_db(self, path=VERDICT_DB):
+        """以前の verdict_cache.db の判定を取り込む（既にあるものは上書きしない）。取り込んだ件数を返す"""
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT question, answer, is_correct, reason FROM verdicts").fetchall()
+        except sqlite3.Error:
+            rows = []
+        finally:
+            conn.close()
+        for question, answer, is_correct, reason in rows:
+            # answer は以前の正規化（府・市なども外していた）のまま入る。その形で入力されたときだけ使われる
+            self.put(question, {"answer": answer, "is_correct": is_correct, "reason": reason}, replace=False)
+        return len(rows)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_verdict_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            cache = logic.get_disk_cache()
+            _cache = VerdictCache(cache)
+            # ★サーバープロセスが同時に起動しても、取り込むのは印を取れた1つだけ
+            if os.path.exists(VERDICT_DB) and cache.claim("meta", "import:" + VERDICT_DB, ttl=0):
+                n = _cache.import_db(VERDICT_DB)
+                try:
+                    os.replace(VERDICT_DB, VERDICT_DB + ".imported")
+                except OSError as e:
+                    print(f"{VERDICT_DB} の名前を変えられませんでした: {e}")
+                print(f"{VERDICT_DB} から判定を {n} 件取り込みました")
+        return _cache
+
+
+def make_comment(score):
+    """1問ずつ判定したときは総評が無いので、スコアから短い総評を作る"""
+    if score == 5:
+        return "全問正解！お見事です！"
+    if score >= 3:
+        return "なかなかの好成績！あと少しで満点でした。"
+    if score >= 1:
+        return "惜しい！次は満点を目指しましょう。"
+    return "残念…次の問題でリベンジしましょう！"
+
+
+def _resolved(verdict):
+    future = Future()
+    future.set_result(verdict)
+    return future
+
+
+class RoundJudge:
+    """1ラウンド分の回答判定をまとめて管理する"""
+
+    def __init__(self, api_key, question, example_answers=None, mode=None):
+        self.api_key = api_key
+        self.question = question
+        self.mode = mode or get_judge_mode()
+        self._examples = {normalize_answer(a) for a in (example_answers or [])}
+        self._answers = []
+        self._futures = []
+        self._result = None
+
+    def _judge_locally(self, answer):
+        """AIに聞かずに決められるなら判定を返す（正解例と一致 → 過去の判定）"""
+        if normalize_answer(answer) in self._examples:
+            _count(example_hits=1)
+            return {"answer": answer, "is_correct": True, "reason": "正解例と一致"}
+        cached = get_verdict_cache().get(self.question, answer)
+        if cached:
+            _count(cache_hits=1)
+        return cached
+
+    def submit(self, answer):
+        """回答が入力されたら呼ぶ。手元で決まらず per_answer モードならすぐに裏で判定を始める"""
+        _count(answers=1)
+        self._answers.append(answer)
+        verdict = self._judge_locally(answer)
+        if verdict:
+            self._futures.append(_resolved(verdict))
+        elif self.mode == "per_answer":
+            self._futures.append(_executor.submit(self._judge_one, answer))
+        else:
+            self._futures.append(None) # 結果画面でまとめて判定
+
+    def _judge_one(self, answer):
+        _count(llm_calls=1, llm_judged=1)
+        res = logic.evaluate_answers(self.api_key, self.question, [answer])
+        if not res or not res.get("results"):
+            return None
+        item = res["results"][0]
+        verdict = {"answer": answer, "is_correct": bool(item.get("is_correct")), "reason": item.get("reason", "")}
+        # オフラインの代用品の判定（正解例との一致だけ）は、API が戻ったら判定し直せるよう保存しない
+        if not res.get("offline"):
+            get_verdict_cache().put(self.question, verdict)
+        return verdict
+
+    def pending(self):
+        """まだ判定中の回答数"""
+        return sum(1 for f in self._futures if f is not None and not f.done())
+
+    def collect(self, answers):
+        """結果画面用に判定結果を組み立てる。判定中のものだけ待つ"""
+        if self._result is not None:
+            return self._result
+
+        waited_from = time.time()
+        for answer in answers[len(self._answers):]:
+            self.submit(answer)
+        answers = self._answers
+
+        running = [f for f in self._futures if f is not None]
+        wait(running)
+        verdicts = [f.result() if f is not None else None for f in self._futures]
+
+        # まだ決まっていないもの（batch モード・裏の判定に失敗したもの）だけをまとめて判定する
+        comment = None
+        unresolved = [i for i, v in enumerate(verdicts) if v is None]
+        if unresolved:
+            # ★同じ回答は1回だけ聞く（2つ目への「重複」の判定を、その回答の判定として保存しないように）
+            unique = {}
+            for i in unresolved:
+                unique.setdefault(normalize_answer(answers[i]), answers[i])
+            _count(llm_calls=1, llm_judged=len(unique))
+            res = logic.evaluate_answers(self.api_key, self.question, list(unique.values())) or {}
+            if len(unresolved) == len(answers) and len(unique) == len(answers):
+                comment = res.get("comment")
+            judged = {}
+            for key, item in zip(unique, res.get("results", [])):
+                verdict = {"answer": unique[key], "is_correct": bool(item.get("is_correct")),
+                           "reason": item.get("reason", "")}
+                judged[key] = verdict
+                # 結果の回答が聞いたものと違う（並びがずれた）ときは保存しない
+                if not res.get("offline") and normalize_answer(item.get("answer", "")) == key:
+                    get_verdict_cache().put(self.question, verdict)
+            for i in unresolved:
+                verdict = judged.get(normalize_answer(answers[i]))
+                if verdict is None:
+                    # 判定できなかったものは保存しない（次に同じ回答が来たら判定し直す）
+                    verdicts[i] = {"answer": answers[i], "is_correct": False, "reason": "判定できませんでした"}
+                    continue
+                verdicts[i] = dict(verdict, answer=answers[i])
+
+        # 1問ずつ判定すると重複に気付けないので、ここで2回目以降を不正解にする
+        seen = set()
+        for i, v in enumerate(verdicts):
+            key = normalize_answer(v["answer"])
+            if key in seen and v["is_correct"]:
+                verdicts[i] = {"answer": v["answer"], "is_correct": False, "reason": "同じ回答が重複しています"}
+            seen.add(key)
+
+        score = sum(1 for v in verdicts if v["is_correct"])
+        self._result = {"score": score, "results": verdicts, "comment": comment or make_comment(score)}
+
+        _count(rounds=1, result_wait_total=time.time() - waited_from)
+        return self._result
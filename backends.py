@@ -0,0 +1,84 @@
+#バックエンド（LLM・音声合成・評価の保存先）の切り替えと遅延 import
+import importlib
+import subprocess
+import sys
+import threading
+import time
+
+import metrics
+
+# 種類 -> 名前 -> ("モジュール:属性", [初回に読み込まれる重いライブラリ])
+# ここに書いたものは、実際に使われるまで import されない
+BACKENDS = {
+    "llm": {
+        "gemini": ("llm_gateway:gemini_client", ["google.genai"]),
+        "local": ("local_llm:LocalLLMClient", []),
+    },
+    "tts": {
+        "gtts": ("tts_cache:GTTSBackend", ["gtts"]),
+        "local": ("tts_cache:LocalTTSBackend", []),
+    },
+    "feedback": {
+        "gspread": ("feedback_sink:open_gspread_worksheet", ["gspread", "oauth2client.service_account"]),
+        "local": ("feedback_sink:LocalWorksheet", []),
+    },
+}
+DEFAULTS = {"llm": "gemini", "tts": "gtts", "feedback": "gspread"}
+
+# 起動の重さを見るためによく使う重いライブラリ
+HEAVY_MODULES = ["streamlit", "google.genai", "gtts", "gspread", "oauth2client.service_account", "PIL.Image"]
+
+_lock = threading.Lock()
+_loaded = {}
+_import_times = {}
+
+
+def _timed_import(module_name):
+    """import にかかった時間を記録しながら読み込む（読み込み済みなら 0 秒）"""
+    already = module_name in sys.modules
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if not already:
+        elapsed = time.perf_counter() - started
+        _import_times[module_name] = elapsed
+        metrics.registry.observe_duration(f"import.{module_name}", elapsed)
+    return module
+
+
+def load(kind, name=None):
+    """指定したバックエンドの実体（クラスや関数）を返す。初回だけ import する"""
+    name = name or DEFAULTS[kind]
+    if name not in BACKENDS[kind]:
+        raise ValueError(f"不明なバックエンドです: {kind}={name}（候補: {', '.join(BACKENDS[kind])}）")
+
+    key = (kind, name)
+    with _lock:
+        if key not in _loaded:
+            target, deps = BACKENDS[kind][name]
+            for dep in deps:
+                _timed_import(dep)
+            module_name, attr = target.split(":")
+            _loaded[key] = getattr(_timed_import(module_name), attr)
+        return _loaded[key]
+
+
+def import_times():
+    """このプロセスで遅延 import したモジュールと、その時間（秒）"""
+    with _lock:
+        return dict(_import_times)
+
+
+def measure_cold_imports(modules=HEAVY_MODULES):
+    """別プロセスで1つずつ import して、何もキャッシュされていない状態の時間（秒）を測る"""
+    results = {}
+    for module in modules:
+        code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        results[module] = float(out.stdout.strip()) if out.returncode == 0 else None
+    return results
+
+
+if __name__ == "__main__":
+    # 使い方: python backends.py  （起動時に import するとどれくらい重いかを表示）
+    for module, sec in measure_cold_imports().items():
+        print(f"{module:32s} {'失敗' if sec is None else f'{sec * 1000:8.1f} ms'}")
@@ -0,0 +1,55 @@
+#お題をまとめて生成するときのバッチサイズ比較
+#
+# 使い方（リポジトリ直下で）:
+#   python bench/batch_sizes.py --sizes 1 2 3 5 --repeat 3            # 偽の Gemini で
+#   GEMINI_API_KEY=... python bench/batch_sizes.py --real --sizes 1 3 # 本物の Gemini で
+#
+# バッチサイズごとに、1お題あたりの時間・トークン数と、検証を通ったお題の割合を表示する。
+import argparse
+import json
+import os
+import sys
+import tempfile
+import shutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="お題まとめて生成のバッチサイズ比較")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 3, 5])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--genre", default="ノンジャンル")
+    parser.add_argument("--difficulty", default="中級")
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--real", action="store_true", help="本物の Gemini を使う（GEMINI_API_KEY が必要）")
+    args = parser.parse_args()
+
+    # 履歴DBや重複検知の索引は作業ディレクトリに作る（手元のDBを汚さない）
+    workdir = tempfile.mkdtemp(prefix="quiz_bomber_batch_")
+    shutil.copy(os.path.join(ROOT, "quiz_history.json"), workdir)
+    os.chdir(workdir)
+
+    import llm_gateway
+    import logic
+
+    api_key = os.environ.get("GEMINI_API_KEY", "fake-key")
+    if not args.real:
+        import fake_backends
+        llm_gateway.set_client_factory(fake_backends.fake_client_factory(args.llm_latency))
+
+    for size in args.sizes:
+        for _ in range(args.repeat):
+            if size == 1:
+                logic.get_ai_question(api_key, args.genre, args.difficulty)
+            else:
+                logic.get_ai_questions(api_key, size, args.genre, args.difficulty)
+
+    print(json.dumps(logic.generation_stats(), indent=2, ensure_ascii=False))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#負荷試験用の偽バックエンド（Gemini / gTTS / gspread）。遅延を指定できる
+import ast
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import types
+
+import tts_cache
+import feedback_sink
+
+_counter = itertools.count(1)
+_counter_lock = threading.Lock()
+# お題の文面をばらけさせる（連番だけだと重複検知で似たお題として弾かれる）
+_KANA = [chr(c) for c in range(0x30A2, 0x30F3)]
+
+
+def _next_id():
+    with _counter_lock:
+        return next(_counter)
+
+
+def _fake_judgment(answers):
+    results = [{"answer": a, "is_correct": i % 2 == 0, "reason": "偽の判定"} for i, a in enumerate(answers)]
+    return {"score": sum(r["is_correct"] for r in results), "results": results, "comment": "偽の総評"}
+
+
+class FakeModels:
+    """
+    client.models の代わり。プロンプトの中身を見て、お題か判定結果を返す。
+    error_rate の割合でエラーに、slow_rate の割合で slow_latency 秒かかる遅い応答にする（どちらも一定間隔）
+    （属性を書き換えれば途中から障害を起こしたり直したりできる）
+    """
+
+    def __init__(self, latency=0.5, error_rate=0.0, slow_rate=0.0, slow_latency=5.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _respond(self, contents, latency=None):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        slow = self.slow_rate and (calls % max(1, round(1 / self.slow_rate))) == 0
+        time.sleep(self.slow_latency if slow else (self.latency if latency is None else latency))
+        if self.error_rate and (calls % max(1, round(1 / self.error_rate))) == 0:
+            raise ConnectionError("FakeModels: 疑似エラー")
+
+        batch_judge = re.search(r"判定リスト:\s*(\[.*\])\s*\n", contents)
+        match = re.search(r"回答リスト:\s*(\[.*?\])\s*\n", contents)
+        if batch_judge:
+            jobs = json.loads(batch_judge.group(1))
+            text = json.dumps({"judgments": [dict(_fake_judgment(job["answers"]), id=job["id"]) for job in jobs]},
+                              ensure_ascii=False)
+        elif match:
+            text = json.dumps(_fake_judgment(ast.literal_eval(match.group(1))), ensure_ascii=False)
+        else:
+            batch = re.search(r"お題を(\d+)個作成", contents)
+            count = int(batch.group(1)) if batch else 1
+            # 出力が長くなる分だけ遅くなる（プロンプトの処理は1回分）
+            time.sleep((self.latency if latency is None else latency) * 0.6 * (count - 1))
+            questions = []
+            for _ in range(count):
+                n = _next_id()
+                questions.append({
+                    "question": f"負荷試験{n}「{''.join(random.Random(n).choices(_KANA, k=12))}」を5つ答えろ",
+                    "items": [{"answer": f"正解例{n}-{i}", "hint": f"ヒント{i}"} for i in range(5)],
+                })
+            text = json.dumps({"questions": questions} if batch else questions[0], ensure_ascii=False)
+        usage = types.SimpleNamespace(prompt_token_count=len(contents), candidates_token_count=len(text))
+        return types.SimpleNamespace(text=text, usage_metadata=usage)
+
+    def generate_content(self, model, contents, config=None):
+        return self._respond(contents)
+
+    def generate_content_stream(self, model, contents, config=None):
+        """遅延を各チャンクに分けて、本物のストリーミングのように少しずつ返す"""
+        response = self._respond(contents, latency=0)
+        pieces = [response.text[i:i + 40] for i in range(0, len(response.text), 40)]
+        for i, piece in enumerate(pieces):
+            time.sleep(self.latency / len(pieces))
+            last = i == len(pieces) - 1
+            yield types.SimpleNamespace(text=piece, usage_metadata=response.usage_metadata if last else None)
+
+
+class FakeGenaiClient:
+    def __init__(self, latency=0.5, error_rate=0.0, **options):
+        self.models = FakeModels(latency, error_rate, **options)
+
+
+def fake_client_factory(latency=0.5, error_rate=0.0, **options):
+    """llm_gateway.set_client_factory に渡す関数を作る（options は FakeModels に渡す）"""
+    return lambda api_key: FakeGenaiClient(latency, error_rate, **options)
+
+
+class FakeTTSBackend(tts_cache.LocalTTSBackend):
+    """無音MP3を書き出す前に、gTTS の通信時間ぶん待つ"""
+
+    def __init__(self, latency=0.3):
+        super().__init__()
+        self.latency = latency
+
+    def synthesize(self, text, lang, path):
+        time.sleep(self.latency)
+        super().synthesize(text, lang, path)
+
+
+def fake_worksheet_factory(latency=0.2):
+    worksheet = feedback_sink.LocalWorksheet(delay=latency)
+    return lambda: worksheet
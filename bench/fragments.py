@@ -0,0 +1,110 @@
+#ゲーム画面の fragment 化の効果（1回の操作あたりのサーバー時間と送るデータ量）
+#
+# 使い方（リポジトリ直下で）:
+#   python bench/fragments.py --interactions 20
+#
+# AppTest は fragment だけの再実行をしないので、画面全体の再実行の中で
+# 各 fragment の処理時間（metrics の render.game.*）と、その fragment から出た差分のバイト数を数える。
+#   full:     以前の作り。操作のたびに main() 全体が2回（クリック + st.rerun()）走り、画面全体の差分を送る
+#   fragment: 今の作り。操作した fragment だけが1回走り、その中の差分だけを送る
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class DeltaCounter:
+    """ScriptRunContext.enqueue を横取りして、差分のバイト数を fragment ごとに数える"""
+
+    def __init__(self):
+        from streamlit.runtime.scriptrunner_utils.script_run_context import ScriptRunContext
+        self.by_fragment = defaultdict(int)
+        self.order = []
+        original = ScriptRunContext.enqueue
+
+        def enqueue(ctx, msg):
+            if msg.WhichOneof("type") == "delta":
+                fragment_id = msg.delta.fragment_id
+                if fragment_id not in self.by_fragment:
+                    self.order.append(fragment_id)
+                self.by_fragment[fragment_id] += msg.ByteSize()
+            return original(ctx, msg)
+
+        ScriptRunContext.enqueue = enqueue
+
+    def reset(self):
+        self.by_fragment.clear()
+        self.order.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ゲーム画面の fragment 化の効果")
+    parser.add_argument("--interactions", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="quiz_bomber_fragments_")
+    for name in os.listdir(ROOT):
+        if name.endswith((".mp3", ".png", ".css")) or name == "quiz_history.json":
+            shutil.copy(os.path.join(ROOT, name), workdir)
+    os.chdir(workdir)
+    os.environ["TTS_BACKEND"] = "local"
+    os.environ["LLM_BACKEND"] = "local"
+
+    from streamlit.testing.v1 import AppTest
+    import metrics
+
+    counter = DeltaCounter()
+    at = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=60)
+    at.run()
+    next(b for b in at.button if b.label == "ゲームスタート").click().run()
+    at.session_state.read_until = time.time()
+    at.run()
+
+    # ゲーム画面を描き直すだけの再実行を繰り返して、時間と差分を集める
+    full_bytes, fragment_bytes = [], defaultdict(list)
+    for _ in range(args.interactions):
+        counter.reset()
+        at.run()
+        if at.session_state.page != "game":
+            raise RuntimeError(f"ゲーム画面ではありません: {at.session_state.page}")
+        full_bytes.append(sum(counter.by_fragment.values()))
+        # 出てくる順は timer → answers → hints（hints は answers の中）
+        timer_id, answers_id, hints_id = [f for f in counter.order if f][:3]
+        fragment_bytes["timer"].append(counter.by_fragment[timer_id])
+        fragment_bytes["answers"].append(counter.by_fragment[answers_id] + counter.by_fragment[hints_id])
+        fragment_bytes["hints"].append(counter.by_fragment[hints_id])
+
+    durations = metrics.registry.snapshot()["durations"]
+    avg = lambda samples: sum(samples) / len(samples)
+    full_sec = durations["render.game"]["avg"]
+    report = {
+        "full_rerun": {"server_sec": full_sec, "bytes": avg(full_bytes)},
+        "per_interaction": {
+            "answer_submit": {
+                "before": {"server_sec": 2 * full_sec, "bytes": 2 * avg(full_bytes)},
+                "after": {"server_sec": durations["render.game.answers"]["avg"],
+                          "bytes": avg(fragment_bytes["answers"])},
+            },
+            "hint": {
+                "before": {"server_sec": 2 * full_sec, "bytes": 2 * avg(full_bytes)},
+                "after": {"server_sec": durations["render.game.hints"]["avg"],
+                          "bytes": avg(fragment_bytes["hints"])},
+            },
+        },
+        "timer_fragment": {"server_sec": durations["render.game.timer"]["avg"],
+                           "bytes": avg(fragment_bytes["timer"])},
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#同時プレイの負荷試験
+#
+# 使い方（リポジトリ直下で）:
+#   python bench/loadtest.py --sessions 8 --llm-latency 0.5 --tts-latency 0.3
+#
+# Streamlit の AppTest で main.py を N セッション同時に動かし、
+# スタート → ゲーム → 回答5つ → 結果 → 評価送信 までを1ラウンドとして計測する。
+# 結果は bench/results/ に保存し、前回の結果との差を表示する。
+#
+# AppTest はプロセス全体で1つの Runtime を差し替えながら動くので、スクリプトの実行自体は
+# ロックで1つずつ順番に行う（プール・判定・評価送信などの裏の処理は並行して動く）。
+# 再実行の時間はロック待ちを除いて計る。
+import argparse
+import datetime
+import glob
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+# 作業ディレクトリに用意するファイル（DBや音声キャッシュはそちらに作られる）
+ASSETS = ["*.mp3", "*.png", "style.css", "quiz_history.json"]
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+_run_lock = threading.Lock()
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def rss_mb():
+    """現在の常駐メモリ (MB)"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Session:
+    """1人分のプレイヤー"""
+
+    def __init__(self, index, rounds):
+        from streamlit.testing.v1 import AppTest
+        self.index = index
+        self.rounds = rounds
+        self.at = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=120)
+        self.at.secrets["GEMINI_API_KEY"] = "fake-key"
+        self.rerun_times = []
+        self.ttfq = []
+        self.error = None
+
+    def _run(self, action=None):
+        with _run_lock:
+            started = time.perf_counter()
+            (action or self.at).run()
+            self.rerun_times.append(time.perf_counter() - started)
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].message)
+
+    def _button(self, label):
+        return next(b for b in self.at.button if b.label == label)
+
+    def play(self):
+        try:
+            self._run()
+            for _ in range(self.rounds):
+                self._play_round()
+        except Exception as e:
+            self.error = repr(e)
+
+    def _play_round(self):
+        at = self.at
+        self._run(self._button("ゲームスタート").click())
+        self.ttfq.append(self.rerun_times[-1])
+
+        # 読み上げが終わった時刻まで進めたことにする
+        if at.session_state.page == "game" and at.session_state.need_play_question:
+            at.session_state.read_until = time.time()
+            self._run()
+            self._run()
+
+        for i in range(5):
+            at.text_input[0].input(f"回答{self.index}-{i}")
+            self._run(next(b for b in at.button if b.label == "送信").click())
+
+        # 結果画面（判定待ちを含む）
+        if at.session_state.page != "result":
+            raise RuntimeError(f"結果画面に進めませんでした: {at.session_state.page}")
+        self._run(self._button("評価を送信").click())
+        self._run(self._button("次の問題へ").click())
+
+
+def compare(report, previous):
+    """前回の結果と主要な指標を比べる"""
+    lines = []
+    for key in ("ttfq_p50", "ttfq_p95", "rerun_p50", "rerun_p95", "rerun_p99", "cpu_sec_per_session", "rss_mb_per_session"):
+        old, new = previous["summary"].get(key), report["summary"].get(key)
+        if old:
+            lines.append(f"  {key:22s} {old:9.4f} -> {new:9.4f} ({(new - old) / old * 100:+.1f}%)")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AIクイズボンバー 同時プレイ負荷試験")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--tts-latency", type=float, default=0.3)
+    parser.add_argument("--sheet-latency", type=float, default=0.2)
+    parser.add_argument("--label", default="", help="結果ファイルに残すメモ（バージョン名など）")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="quiz_bomber_bench_")
+    for pattern in ASSETS:
+        for path in glob.glob(os.path.join(ROOT, pattern)):
+            shutil.copy(path, workdir)
+    os.chdir(workdir)
+    os.environ["TTS_BACKEND"] = "local"
+    os.environ["FEEDBACK_BACKEND"] = "local"
+
+    import fake_backends
+    import eval_batcher
+    import feedback_sink
+    import llm_gateway
+    import logic
+    import model_router
+    import tts_cache
+
+    # 偽バックエンドを先に登録しておく（各モジュールの共有インスタンスとして使われる）
+    llm_gateway.set_client_factory(fake_backends.fake_client_factory(args.llm_latency))
+    tts_cache.get_audio_cache(fake_backends.FakeTTSBackend(args.tts_latency))
+    feedback_sink.get_feedback_sink(fake_backends.fake_worksheet_factory(args.sheet_latency))
+
+    rss_before = rss_mb()
+    cpu_before = time.process_time()
+    wall_before = time.perf_counter()
+
+    sessions = [Session(i, args.rounds) for i in range(args.sessions)]
+    threads = [threading.Thread(target=s.play, name=f"session-{s.index}") for s in sessions]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    wall = time.perf_counter() - wall_before
+    cpu = time.process_time() - cpu_before
+    rss_after = rss_mb()
+
+    reruns = [x for s in sessions for x in s.rerun_times]
+    ttfq = [x for s in sessions for x in s.ttfq]
+    errors = [f"session-{s.index}: {s.error}" for s in sessions if s.error]
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "label": args.label,
+        "config": vars(args),
+        "summary": {
+            "sessions": args.sessions,
+            "rounds_completed": sum(len(s.ttfq) for s in sessions),
+            "errors": len(errors),
+            "wall_sec": wall,
+            "ttfq_p50": percentile(ttfq, 50),
+            "ttfq_p95": percentile(ttfq, 95),
+            "rerun_count": len(reruns),
+            "rerun_p50": percentile(reruns, 50),
+            "rerun_p95": percentile(reruns, 95),
+            "rerun_p99": percentile(reruns, 99),
+            "cpu_sec_per_session": cpu / args.sessions,
+            "rss_mb_per_session": max(0.0, rss_after - rss_before) / args.sessions,
+        },
+        "errors": errors,
+        "gateway": llm_gateway.get_gateway("fake-key").stats(),
+        "generation": logic.generation_stats(),
+        "eval_batcher": eval_batcher.batcher_stats(),
+        "model_router": model_router.router_stats(),
+    }
+
+    print(json.dumps(report["summary"], indent=2, ensure_ascii=False))
+    for e in errors:
+        print("ERROR", e)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        previous = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))
+        if previous:
+            with open(previous[-1], encoding="utf-8") as f:
+                print(f"前回 ({os.path.basename(previous[-1])}) との比較:")
+                print(compare(report, json.load(f)))
+        out = os.path.join(RESULTS_DIR, datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"保存しました: {out}")
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    os._exit(1 if errors else 0) # 裏のスレッド（プール・シンク）を待たずに終了する
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#Gemini 呼び出しの耐障害性の確認（偽バックエンドで遅延・エラーを起こす）
+#
+# 使い方（リポジトリ直下で）:
+#   python bench/resilience.py
+#
+# 1. 遅い応答が混ざるとき: ヘッジあり・なしで判定呼び出しの p50 / p95 / p99 を比べる
+# 2. 障害のとき: 回路が開いてすぐに失敗し、ローカルの代用品に切り替わること、
+#    復旧後に半開 → 閉 に戻ることを確かめる
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def tail_latency(args, fake_backends, llm_gateway):
+    """遅い応答が slow_rate の割合で混ざるときの、ヘッジあり・なしの比較"""
+    report = {}
+    for label, percentile_setting in (("no_hedge", 0), ("hedge_p95", 0.95)):
+        client = fake_backends.fake_client_factory(
+            args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+        gateway = llm_gateway.LLMGateway("fake-key", rate_per_sec=1000, burst=1000,
+                                         client_factory=client, hedge_percentile=percentile_setting)
+        samples = []
+        for _ in range(args.calls):
+            started = time.monotonic()
+            gateway.generate_content(model="fake", contents="お題: x\n回答リスト: ['a']\n")
+            samples.append(time.monotonic() - started)
+        stats = gateway.stats()
+        report[label] = {
+            "p50": percentile(samples, 50), "p95": percentile(samples, 95), "p99": percentile(samples, 99),
+            "hedges": stats["hedges"], "hedge_wins": stats["hedge_wins"], "llm_calls": stats["calls"],
+        }
+    return report
+
+
+def breaker_states(gateway):
+    return {model: s["state"] for model, s in gateway.stats()["breakers"].items()}
+
+
+def outage(args, fake_backends, llm_gateway, logic):
+    """全部失敗する障害 → 回路が開く → 復旧 の流れ"""
+    os.environ["LLM_BREAKER_RESET_SEC"] = str(args.reset_sec)
+    llm_gateway.set_client_factory(fake_backends.fake_client_factory(args.latency, error_rate=1.0))
+    gateway = logic.get_llm_gateway("fake-key")
+    models = gateway.client.models
+
+    phases = []
+    for i in range(args.outage_calls):
+        started = time.monotonic()
+        q = logic.get_ai_question("fake-key", "ノンジャンル", "中級")
+        phases.append({"call": i, "sec": round(time.monotonic() - started, 3), "ok": bool(q),
+                       "breakers": breaker_states(gateway)})
+
+    # 復旧させ、回路が半開になるまで待ってから呼ぶ
+    models.error_rate = 0.0
+    time.sleep(args.reset_sec)
+    started = time.monotonic()
+    q = logic.get_ai_question("fake-key", "ノンジャンル", "中級")
+    phases.append({"call": "recovered", "sec": round(time.monotonic() - started, 3), "ok": bool(q),
+                   "breakers": breaker_states(gateway)})
+    return {"calls": phases, "gateway": gateway.stats(),
+            "fallback_used": logic.metrics.registry.snapshot()["counters"].get("get_ai_question.fallback", 0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemini 呼び出しの耐障害性の確認")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-latency", type=float, default=1.5)
+    parser.add_argument("--outage-calls", type=int, default=4)
+    parser.add_argument("--reset-sec", type=float, default=1.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="quiz_bomber_resilience_")
+    shutil.copy(os.path.join(ROOT, "quiz_history.json"), workdir)
+    os.chdir(workdir)
+    os.environ["LLM_STREAMING"] = "false"
+
+    import fake_backends
+    import llm_gateway
+    import logic
+
+    report = {
+        "tail_latency": tail_latency(args, fake_backends, llm_gateway),
+        "outage": outage(args, fake_backends, llm_gateway, logic),
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
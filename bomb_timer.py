@@ -0,0 +1,61 @@
+#ブラウザ側で動くカウントダウン（爆弾画像・バー・残り秒数）
+import os
+import threading
+
+import streamlit.components.v1 as components
+
+import logic
+
+# --- 設定 ---
+URGENT_SEC = 15     # この秒数を切ったら赤くなり、爆弾画像が変わる
+
+_component = components.declare_component(
+    "bomb_timer",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "bomb_timer"),
+)
+
+# 1ラウンドあたりの再実行回数（st_autorefresh のときは制限時間の秒数ぶんあった）
+_stats_lock = threading.Lock()
+_stats = {"rounds": 0, "reruns": 0}
+
+
+def bomb_timer(part, round_id, remaining_sec, limit_sec, key,
+               normal_img="bomb_normal.png", danger_img="bomb_danger2.png"):
+    """
+    part="bomb": 爆弾画像 / part="timer": 残り時間バーと秒数。
+    時計はブラウザで進むので、サーバーの再実行は回答送信・ヒント・時間切れのときだけ。
+    時間切れになると {"event": "expired", "round": round_id} を返す（timer のみ）。
+    """
+    args = {
+        "part": part,
+        "round": round_id,
+        "remaining_sec": max(0.0, remaining_sec),
+        "limit_sec": limit_sec,
+        "urgent_sec": URGENT_SEC,
+        "report": part == "timer",
+    }
+    if part == "bomb":
+        # 列の幅に合わせて縮小・再圧縮した画像を使う
+        images = logic.get_image_assets()
+        args["normal_img"] = images.src(normal_img, "bomb")
+        args["danger_img"] = images.src(danger_img, "bomb")
+        images.record_send(normal_img, "bomb")
+        images.record_send(danger_img, "bomb")
+    return _component(key=key, default=None, **args)
+
+
+def record_round(reruns):
+    """ラウンド終了時に、そのラウンドのゲーム画面の再実行回数を記録する"""
+    with _stats_lock:
+        _stats["rounds"] += 1
+        _stats["reruns"] += reruns
+
+
+def rerun_stats():
+    with _stats_lock:
+        rounds = _stats["rounds"]
+        return {
+            "rounds": rounds,
+            "reruns": _stats["reruns"],
+            "reruns_per_round": (_stats["reruns"] / rounds) if rounds else 0.0,
+        }
@@ -0,0 +1,125 @@
+#よく似たお題を見つける索引（文字 n-gram の MinHash + LSH）
+# 全件と比べるのではなく、バンドのハッシュが一致した候補だけを調べるので、数万件でも一瞬で判定できる
+import re
+import threading
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+
+import history_store
+
+# --- 設定 ---
+NGRAM = 3
+NUM_PERM = 64
+BANDS = 16               # 1バンド4行。Jaccard 0.5 前後から候補に上がる
+THRESHOLD = 0.6          # 候補のうち、実際の Jaccard 係数がこれ以上なら「ほぼ同じ」
+
+_PRIME = (1 << 61) - 1
+_rng = np.random.default_rng(20240601)   # プロセスが変わっても同じハッシュになるよう固定
+_A = _rng.integers(1, 1 << 31, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 31, NUM_PERM, dtype=np.uint64)
+
+# どのお題にも付く決まり文句は似ている度合いを水増しするので外す
+_TAIL = re.compile(r"[をは]?[5５五]つ(?:答え|挙げ)\w*$")
+_PUNCT = re.compile(r"[\s・･、。,.!?！？「」『』（）()【】〜～~]")
+
+
+def normalize_question(text):
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _PUNCT.sub("", text)
+    return _TAIL.sub("", text)
+
+
+def shingles(text):
+    text = normalize_question(text)
+    if len(text) <= NGRAM:
+        return {text}
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+
+def signature(grams):
+    """MinHash 署名（NUM_PERM 個の最小ハッシュ値）"""
+    h = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+    # (a * h + b) mod p を全ての置換についてまとめて計算する
+    return ((_A[:, None] * h[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class DuplicateIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._texts = []
+        self._grams = []
+        self._buckets = [{} for _ in range(BANDS)]
+        self._rows = NUM_PERM // BANDS
+        self._checks = 0
+        self._rejects = 0
+        self._check_time = 0.0
+
+    def __len__(self):
+        return len(self._texts)
+
+    def _band_keys(self, sig):
+        r = self._rows
+        return [sig[i * r:(i + 1) * r].tobytes() for i in range(BANDS)]
+
+    def add(self, text):
+        grams = shingles(text)
+        keys = self._band_keys(signature(grams))
+        with self._lock:
+            doc_id = len(self._texts)
+            self._texts.append(text)
+            self._grams.append(grams)
+            for bucket, key in zip(self._buckets, keys):
+                bucket.setdefault(key, []).append(doc_id)
+        return doc_id
+
+    def find(self, text, threshold=THRESHOLD):
+        """よく似たお題があれば (お題, 類似度) を返す。無ければ None"""
+        start = time.perf_counter()
+        grams = shingles(text)
+        keys = self._band_keys(signature(grams))
+        best = None
+        with self._lock:
+            candidates = set()
+            for bucket, key in zip(self._buckets, keys):
+                candidates.update(bucket.get(key, ()))
+            for doc_id in candidates:
+                sim = jaccard(grams, self._grams[doc_id])
+                if sim >= threshold and (best is None or sim > best[1]):
+                    best = (self._texts[doc_id], sim)
+            self._checks += 1
+            self._rejects += best is not None
+            self._check_time += time.perf_counter() - start
+        return best
+
+    def stats(self):
+        with self._lock:
+            return {
+                "questions": len(self._texts),
+                "checks": self._checks,
+                "rejects": self._rejects,
+                "avg_check_ms": round(self._check_time / self._checks * 1000, 3) if self._checks else None,
+            }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_duplicate_index():
+    """履歴ストアの全お題を読み込んだ索引（プロセスで1つ）"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            index = DuplicateIndex()
+            store = history_store.get_history_store()
+            for question in store.all_questions():
+                index.add(question)
+            _index = index
+        return _index
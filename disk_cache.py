@@ -0,0 +1,248 @@
+#再起動しても残るキャッシュ（お題・読み上げ音声・判定をまとめて1つの SQLite に置く）
+#
+# 複数のサーバープロセスから同じファイルを開いてよい（WAL + busy_timeout、書き込みは BEGIN IMMEDIATE）。
+# 名前空間ごとに有効期限があり、全体の容量を超えたら最後に使われたのが古いものから消す（LRU）。
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+
+# --- 設定 ---
+CACHE_DB = "cache.db"
+MAX_BYTES = 200 * 1024 * 1024
+# 名前空間ごとの有効期限（秒）
+NAMESPACE_TTL = {
+    "questions": 7 * 24 * 3600,     # すぐ出せるお題（起動時に履歴から補充する）
+    "served": 90 * 24 * 3600,       # 出題済みのお題（補充で同じものを何度も出さないため）
+    "tts": 30 * 24 * 3600,          # 読み上げ音声（mp3 のバイト列）
+    "judge": 30 * 24 * 3600,        # 回答1つ分の判定
+    "meta": 24 * 3600,
+}
+TOUCH_INTERVAL = 60         # 同じ行の最終利用時刻を書き直す最短間隔（読むたびに書き込まないように）
+EVICT_CHECK_EVERY = 50      # 何回書き込むごとに容量を確かめるか
+WARM_PER_BUCKET = 2         # 起動時に (ジャンル, 難易度) ごとに用意しておくお題の数
+WARM_MIN_RATING = 4
+
+
+def make_key(*parts):
+    return hashlib.sha256("\0".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """名前空間・有効期限・容量上限つきの永続キャッシュ。値は JSON にできるものか bytes"""
+
+    def __init__(self, path=CACHE_DB, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=10000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                is_bytes INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                expires REAL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed);
+            CREATE INDEX IF NOT EXISTS idx_entries_expires ON entries(expires);
+        """)
+        self._writes = 0
+        self._stats = {}    # 名前空間 -> {"hits", "misses", "sets", "evictions"}
+
+    def _count(self, namespace, name, n=1):
+        s = self._stats.setdefault(namespace, {"hits": 0, "misses": 0, "sets": 0, "evictions": 0})
+        s[name] += n
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, (bytes, bytearray)):
+            return bytes(value), 1
+        return json.dumps(value, ensure_ascii=False).encode("utf-8"), 0
+
+    @staticmethod
+    def _decode(value, is_bytes):
+        return bytes(value) if is_bytes else json.loads(value)
+
+    def get(self, namespace, key, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, is_bytes, expires, accessed FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+            if row is None or (row[2] is not None and row[2] < now):
+                self._count(namespace, "misses")
+                return default
+            if now - row[3] > TOUCH_INTERVAL:
+                self._conn.execute("UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?",
+                                   (now, namespace, key))
+            self._count(namespace, "hits")
+        return self._decode(row[0], row[1])
+
+    def set(self, namespace, key, value, ttl=None, replace=True):
+        """保存する。replace=False なら既にあるときは何もしない（複数プロセスで同じものを温めるとき用）"""
+        data, is_bytes = self._encode(value)
+        ttl = NAMESPACE_TTL.get(namespace) if ttl is None else ttl
+        now = time.time()
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        with self._lock:
+            self._conn.execute(
+                f"{verb} INTO entries (namespace, key, value, is_bytes, size, expires, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (namespace, key, data, is_bytes, len(data), now + ttl if ttl else None, now)
+            )
+            self._count(namespace, "sets")
+            self._writes += 1
+            if self._writes % EVICT_CHECK_EVERY == 0:
+                self._evict()
+
+    def claim(self, namespace, key, ttl=None):
+        """
+        まだ無ければ印を入れて True を返す。既にあれば False。
+        複数のプロセスが同時に呼んでも True になるのは1つだけ（一度だけやればよい作業の担当決め用）
+        """
+        ttl = NAMESPACE_TTL.get(namespace) if ttl is None else ttl
+        now = time.time()
+        data, is_bytes = self._encode(True)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self._conn.execute(
+                    "INSERT OR IGNORE INTO entries (namespace, key, value, is_bytes, size, expires, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (namespace, key, data, is_bytes, len(data), now + ttl if ttl else None, now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cur.rowcount == 1
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def take(self, namespace, prefix=""):
+        """prefix で始まるキーの値を1つ取り出して消す。別プロセスと同じものを取り合わない。無ければ None"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT key FROM entries WHERE namespace = ? AND key >= ? AND key < ? "
+                    "AND (expires IS NULL OR expires >= ?)",
+                    (namespace, prefix, prefix + "￿", now)
+                ).fetchall()
+                if not rows:
+                    self._conn.execute("COMMIT")
+                    self._count(namespace, "misses")
+                    return None
+                key = random.choice(rows)[0]
+                row = self._conn.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ? RETURNING value, is_bytes",
+                    (namespace, key)
+                ).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._count(namespace, "hits")
+        return self._decode(row[0], row[1])
+
+    def count(self, namespace, prefix=""):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE namespace = ? AND key >= ? AND key < ? "
+                "AND (expires IS NULL OR expires >= ?)",
+                (namespace, prefix, prefix + "￿", time.time())
+            ).fetchone()[0]
+
+    def _evict(self):
+        """期限切れを消し、容量を超えていたら最後に使われたのが古いものから消す（ロックを取ってから呼ぶ）"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?", (time.time(),))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                # 上限の9割まで減らしておき、毎回の書き込みで消さずに済むようにする
+                target = total - int(self.max_bytes * 0.9)
+                freed = 0
+                victims = []
+                for namespace, key, size in self._conn.execute(
+                        "SELECT namespace, key, size FROM entries ORDER BY accessed"):
+                    victims.append((namespace, key))
+                    freed += size
+                    if freed >= target:
+                        break
+                self._conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", victims)
+                for namespace, _ in victims:
+                    self._count(namespace, "evictions")
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY namespace"
+            ).fetchall()
+            report = {ns: {"entries": n, "bytes": size} for ns, n, size in rows}
+            for ns, s in self._stats.items():
+                report.setdefault(ns, {"entries": 0, "bytes": 0}).update(s)
+                total = s["hits"] + s["misses"]
+                report[ns]["hit_rate"] = (s["hits"] / total) if total else 0.0
+        return report
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_disk_cache(path=None, max_bytes=None):
+    """プロセス全体で共有するキャッシュ（最初の呼び出しの設定で開く）"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskCache(path or CACHE_DB, max_bytes or MAX_BYTES)
+        return _cache
+
+
+def question_prefix(genre, difficulty):
+    return f"{genre}|{difficulty}|"
+
+
+def warm_from_history(cache, history, make_question):
+    """
+    quiz_history.json（配列）の高評価のお題を、(ジャンル, 難易度) ごとに WARM_PER_BUCKET 個まで
+    すぐ出せるお題として入れておく（出題済みのものは除く）。
+    make_question(entry) は履歴の1件から question_data を作る関数。
+    入れたお題の question_data のリストを返す（読み上げ音声を先に作るのに使う）
+    """
+    buckets = {}
+    for h in history:
+        if not h.get("question") or int(h.get("rating", 0)) < WARM_MIN_RATING:
+            continue
+        if cache.get("served", make_key(h["question"])) is not None:
+            continue
+        genre = h.get("genre") or "ノンジャンル"
+        difficulty = h.get("difficulty") or "中級"
+        buckets.setdefault((genre, difficulty), []).append(h)
+
+    warmed = []
+    for (genre, difficulty), entries in buckets.items():
+        prefix = question_prefix(genre, difficulty)
+        room = WARM_PER_BUCKET - cache.count("questions", prefix)
+        for h in random.sample(entries, max(0, min(room, len(entries)))):
+            q_data = make_question(h)
+            cache.set("questions", prefix + make_key(h["question"]), q_data, replace=False)
+            warmed.append(q_data)
+    return warmed
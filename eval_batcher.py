@@ -0,0 +1,135 @@
+#回答判定のまとめ送り（同じ時間帯に来た判定をセッションをまたいで1回のリクエストにする）
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+
+# --- 設定 ---
+DEFAULT_WINDOW_MS = 200   # 最初の判定が来てから、ほかの判定を待って集める時間（0 でまとめない）
+DEFAULT_MAX_BATCH = 8     # 1回のリクエストに入れる判定の最大数
+SEND_WORKERS = 4          # まとめたリクエストを並行して送る数
+
+
+class _Job:
+    __slots__ = ("question", "answers", "future", "submitted")
+
+    def __init__(self, question, answers):
+        self.question = question
+        self.answers = list(answers)
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+class EvaluationBatcher:
+    """
+    evaluate_answers の呼び出しを window_ms の間だけためて、evaluate_many にまとめて渡す。
+    evaluate_many は [(お題, 回答リスト), ...] を受け取り、同じ順で判定結果のリストを返す関数。
+    呼び出し側は自分の分の結果が返るまで待つだけ（他のセッションの判定とは混ざらない）。
+    """
+
+    def __init__(self, evaluate_many, window_ms=DEFAULT_WINDOW_MS, max_batch=DEFAULT_MAX_BATCH):
+        self._evaluate_many = evaluate_many
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._sender = ThreadPoolExecutor(max_workers=SEND_WORKERS, thread_name_prefix="eval-batch")
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.batches = 0
+        self.failures = 0
+        self._wait_total = 0.0
+        self._latency_total = 0.0
+
+        self._worker = threading.Thread(target=self._run, name="eval-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, question, answers):
+        """判定を頼み、結果（evaluate_answers と同じ形の dict か None）が入る Future を返す"""
+        job = _Job(question, answers)
+        with self._cond:
+            self._queue.append(job)
+            self._cond.notify()
+        return job.future
+
+    def evaluate(self, question, answers):
+        return self.submit(question, answers).result()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                # 最初の判定が来てから window 秒だけ集める（max_batch に届いたらすぐ送る）
+                deadline = self._queue[0].submitted + self.window
+                while len(self._queue) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+            try:
+                self._sender.submit(self._send, batch)
+            except RuntimeError:
+                # 終了処理中で送信スレッドが使えないときは、ここで送って待っている呼び出し側を返す
+                self._send(batch)
+
+    def _send(self, batch):
+        started = time.monotonic()
+        try:
+            results = self._evaluate_many([(job.question, job.answers) for job in batch])
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            for job in batch:
+                job.future.set_exception(e)
+            return
+
+        finished = time.monotonic()
+        with self._lock:
+            self.batches += 1
+            self.jobs += len(batch)
+            for job in batch:
+                self._wait_total += started - job.submitted
+                self._latency_total += finished - job.submitted
+        metrics.inc("eval_batch.batches")
+        metrics.inc("eval_batch.jobs", len(batch))
+        for job, result in zip(batch, results):
+            metrics.registry.observe_duration("eval_batch.queue_wait", started - job.submitted)
+            metrics.registry.observe_duration("eval_batch.job_latency", finished - job.submitted)
+            job.future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            jobs = self.jobs
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "jobs": jobs,
+                "batches": self.batches,
+                "failures": self.failures,
+                "avg_batch_size": (jobs / self.batches) if self.batches else 0.0,
+                "api_calls_saved": jobs - self.batches,
+                "avg_queue_wait": (self._wait_total / jobs) if jobs else 0.0,
+                "avg_job_latency": (self._latency_total / jobs) if jobs else 0.0,
+            }
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_evaluation_batcher(key, evaluate_many, window_ms=DEFAULT_WINDOW_MS, max_batch=DEFAULT_MAX_BATCH):
+    """key（APIキー）ごとにプロセス全体で1つ"""
+    with _batchers_lock:
+        if key not in _batchers:
+            _batchers[key] = EvaluationBatcher(evaluate_many, window_ms, max_batch)
+        return _batchers[key]
+
+
+def batcher_stats():
+    with _batchers_lock:
+        batchers = list(_batchers.values())
+    return [b.stats() for b in batchers]
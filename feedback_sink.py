@@ -0,0 +1,219 @@
+#評価をスプレッドシートへまとめて書き込む（ローカルに先に控えを取る）
+import datetime
+import json
+import os
+import threading
+import time
+
+import history_store
+
+# --- 設定 ---
+SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+SHEET_NAME = "quiz_feedback"
+SPOOL_FILE = "feedback_spool.jsonl"
+OFFSET_FILE = "feedback_spool.offset"
+BATCH_SIZE = 20         # この件数たまったら書き込む
+MAX_DELAY = 10.0        # 最初の1件から、この秒数たったら件数に関係なく書き込む
+RETRY_INTERVAL = 30.0   # 書き込みに失敗したときに次を試すまでの時間
+
+
+def open_gspread_worksheet():
+    """Secretsから認証情報を読み込んでシートを開く（gspread などはここで初めて import する）"""
+    import streamlit as st
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    # st.secrets["gcp_service_account"] の辞書データをそのまま使う
+    creds_dict = dict(st.secrets["gcp_service_account"])
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
+    client = gspread.authorize(creds)
+
+    # シート名 または URL で開く
+    # 名前で開く場合: 分かりやすい名前にしておいてください
+    return client.open(SHEET_NAME).sheet1
+
+
+class LocalWorksheet:
+    """スプレッドシートの代用品（オフライン・テスト用）。append_rows された行をメモリに持つ"""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.rows = []
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    def append_rows(self, rows, value_input_option="RAW"):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("LocalWorksheet: 書き込み失敗（テスト用）")
+        self.rows.extend(rows)
+
+
+class FeedbackSink:
+    """
+    評価を受け取ったらまずローカルの追記専用ファイルに書き、すぐに返す。
+    スプレッドシートへは裏のスレッドが append_rows でまとめて書き込む。
+    どこまで書き込めたかはオフセットで覚えているので、落ちても続きから送り直せる。
+    """
+
+    def __init__(self, worksheet_factory, spool_file=SPOOL_FILE, offset_file=OFFSET_FILE,
+                 batch_size=BATCH_SIZE, max_delay=MAX_DELAY):
+        self._worksheet_factory = worksheet_factory
+        self._worksheet = None
+        self.spool_file = spool_file
+        self.offset_file = offset_file
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+
+        self._cond = threading.Condition()
+        self._pending = []          # (スプール内の終了位置, 行)
+        self._oldest = None
+        self._retry_at = 0.0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_error = None
+
+        # 前回送り切れなかった行を読み直す
+        self._offset = self._read_offset()
+        self._load_unsent()
+
+        self._worker = threading.Thread(target=self._run, name="feedback-sink", daemon=True)
+        self._worker.start()
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_file, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_offset(self, offset):
+        tmp = self.offset_file + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(offset))
+        os.replace(tmp, self.offset_file)
+        self._offset = offset
+
+    def _load_unsent(self):
+        if not os.path.exists(self.spool_file):
+            return
+        # 控えを空にした直後に落ちると、オフセットがファイルより後ろを指していることがある。
+        # そのまま読むと後から追記した行を飛ばしてしまうので、先頭から読み直す
+        if self._offset > os.path.getsize(self.spool_file):
+            self._offset = 0
+        with open(self.spool_file, "rb") as f:
+            f.seek(self._offset)
+            pos = self._offset
+            for line in f:
+                pos += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # 書きかけの行は捨てる
+                self._pending.append((pos, record["row"]))
+        if self._pending:
+            self._oldest = time.time()
+
+    def submit(self, question, example_answers, rating, genre=None, difficulty=None, model=None):
+        """評価を1件受け付ける。ローカルの控えと履歴ストアに書いた時点で返る（model はお題を作ったモデル）"""
+        now_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # [日時, お題, 評価] の順
+        row = [now_str, question, rating]
+        record = {"row": row, "question": question, "examples": list(example_answers or []),
+                  "rating": rating, "genre": genre, "difficulty": difficulty, "model": model}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+        with self._cond:
+            with open(self.spool_file, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+                end = f.tell()
+            self._pending.append((end, row))
+            if self._oldest is None:
+                self._oldest = time.time()
+            self._cond.notify_all()
+
+        # 同じ行を、次のお題生成で使う履歴にも入れる
+        history_store.get_history_store().append(question, example_answers, rating, genre, difficulty, model=model)
+        return row
+
+    def _due(self):
+        if not self._pending or time.time() < self._retry_at:
+            return False
+        return len(self._pending) >= self.batch_size or time.time() - self._oldest >= self.max_delay
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due():
+                    self._cond.wait(timeout=1.0)
+                batch = self._pending[:self.batch_size]
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            if self._worksheet is None:
+                # 認証済みのシートは使い回す（失敗したときだけ作り直す）
+                self._worksheet = self._worksheet_factory()
+            self._worksheet.append_rows([row for _, row in batch], value_input_option="RAW")
+        except Exception as e:
+            with self._cond:
+                self._worksheet = None
+                self.failures += 1
+                self.last_error = str(e)
+                self._retry_at = time.time() + RETRY_INTERVAL
+            print(f"FeedbackSink: 書き込みエラー（後で再送します）: {e}")
+            return
+
+        with self._cond:
+            del self._pending[:len(batch)]
+            self.flushed += len(batch)
+            self.batches += 1
+            self._oldest = time.time() if self._pending else None
+            if self._pending:
+                self._write_offset(batch[-1][0])
+            else:
+                # 全部送れたら控えを空にする（先にオフセットを戻しておけば、間で落ちても行を失わない）
+                self._write_offset(0)
+                open(self.spool_file, "wb").close()
+        print(f"Spreadsheet saved: {len(batch)} rows")
+
+    def flush(self, timeout=10.0):
+        """たまっている行をすぐに書き込ませ、終わるまで待つ（終了時・テスト用）"""
+        deadline = time.time() + timeout
+        with self._cond:
+            self._oldest = 0.0
+            self._retry_at = 0.0
+            self._cond.notify_all()
+        while time.time() < deadline:
+            with self._cond:
+                if not self._pending:
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": len(self._pending),
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "failures": self.failures,
+                "last_error": self.last_error,
+            }
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_feedback_sink(worksheet_factory):
+    """プロセス全体で共有するシンクを返す"""
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = FeedbackSink(worksheet_factory)
+        return _sink
@@ -0,0 +1,252 @@
+#お題履歴の保存先（SQLite）
+import sqlite3
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+# --- 設定 ---
+HISTORY_DB = "quiz_history.db"
+HISTORY_FILE = "quiz_history.json"
+
+
+class HistoryStore:
+    """
+    評価付きのお題履歴を SQLite に保存し、評価・ジャンル・難易度で引けるようにする。
+    評価ごとの id 一覧をメモリに持っているので、ランダム抽出は件数に依存しない。
+    """
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                examples TEXT NOT NULL DEFAULT '[]',
+                rating INTEGER NOT NULL,
+                genre TEXT,
+                difficulty TEXT,
+                timestamp REAL NOT NULL,
+                model TEXT
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_history_unique ON history(question, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_history_rating ON history(rating);
+            CREATE INDEX IF NOT EXISTS idx_history_filter ON history(genre, difficulty, rating);
+        """)
+        # 古い DB には生成したモデルの列が無いので足す
+        columns = [r[1] for r in self._conn.execute("PRAGMA table_info(history)")]
+        if "model" not in columns:
+            self._conn.execute("ALTER TABLE history ADD COLUMN model TEXT")
+        self._conn.commit()
+
+        # (rating, genre, difficulty) -> [id, ...]
+        self._index = {}
+        self._last_id = 0
+        self._sync()
+
+    def _sync(self):
+        """前回以降に追加された行だけを読み込んでメモリ上の索引に反映する（別プロセスの追記も拾う）"""
+        rows = self._conn.execute(
+            "SELECT id, rating, genre, difficulty FROM history WHERE id > ? ORDER BY id",
+            (self._last_id,)
+        ).fetchall()
+        for row_id, rating, genre, difficulty in rows:
+            self._index.setdefault((rating, genre, difficulty), []).append(row_id)
+            self._last_id = row_id
+
+    def _buckets(self, ratings, genre=None, difficulty=None):
+        return [
+            ids for (r, g, d), ids in self._index.items()
+            if r in ratings
+            and (genre is None or g == genre)
+            and (difficulty is None or d == difficulty)
+        ]
+
+    def append(self, question, examples, rating, genre=None, difficulty=None, timestamp=None, model=None):
+        """1件追記する（ファイル全体の書き直しはしない）。model はお題を作ったモデル"""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO history (question, examples, rating, genre, difficulty, timestamp, model) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (question, json.dumps(list(examples or []), ensure_ascii=False), int(rating),
+                 genre, difficulty, timestamp if timestamp is not None else time.time(), model)
+            )
+            self._conn.commit()
+            self._sync()
+            return cur.lastrowid if cur.rowcount else None
+
+    def count(self, ratings, genre=None, difficulty=None):
+        with self._lock:
+            self._sync()
+            return sum(len(ids) for ids in self._buckets(ratings, genre, difficulty))
+
+    def _pick_ids(self, ratings, k, genre=None, difficulty=None):
+        """条件に合う id をランダムに最大 k 個選ぶ（ロックを取ってから呼ぶ）"""
+        self._sync()
+        buckets = self._buckets(ratings, genre, difficulty)
+        total = sum(len(ids) for ids in buckets)
+        if total == 0 or k <= 0:
+            return []
+
+        # 全体での通し番号を k 個選び、どのバケツの何番目かに変換する
+        picked = []
+        for pos in sorted(random.sample(range(total), min(k, total))):
+            for ids in buckets:
+                if pos < len(ids):
+                    picked.append(ids[pos])
+                    break
+                pos -= len(ids)
+        return picked
+
+    def sample(self, ratings, k, genre=None, difficulty=None):
+        """指定した評価のお題をランダムに最大 k 件返す"""
+        return [e["question"] for e in self.sample_entries(ratings, k, genre, difficulty)]
+
+    def sample_entries(self, ratings, k, genre=None, difficulty=None):
+        """sample と同じ選び方で、正解例などを含めた行を返す"""
+        with self._lock:
+            picked = self._pick_ids(ratings, k, genre, difficulty)
+            return self._fetch(picked) if picked else []
+
+    def sample_unseen(self, ratings, genre=None, difficulty=None, exclude=()):
+        """
+        exclude（お題の文章）に含まれないお題の行を1件ランダムに返す。無ければ None。
+        評価を送ると同じお題の行が増えるので、id ではなくお題の文章で見たかどうかを判断する
+        """
+        with self._lock:
+            self._sync()
+            buckets = self._buckets(ratings, genre, difficulty)
+            total = sum(len(ids) for ids in buckets)
+            if total == 0:
+                return None
+
+            # まずは何回かランダムに引いてみる（見たものが少ないうちはこれで足りる）
+            for _ in range(8):
+                pos = random.randrange(total)
+                for ids in buckets:
+                    if pos < len(ids):
+                        row_id = ids[pos]
+                        break
+                    pos -= len(ids)
+                entry = self._fetch([row_id])[0]
+                if entry["question"] not in exclude:
+                    return entry
+
+            # 見たものが多いときは、残っているものを数えてから選ぶ
+            ids = [i for bucket in buckets for i in bucket]
+            remaining = []
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT id, question FROM history WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                remaining.extend(row_id for row_id, question in rows if question not in exclude)
+            return self._fetch([random.choice(remaining)])[0] if remaining else None
+
+    def untagged(self):
+        """ジャンルか難易度が未設定の行"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM history WHERE genre IS NULL OR difficulty IS NULL ORDER BY id"
+            ).fetchall()
+            return self._fetch([r[0] for r in rows]) if rows else []
+
+    def set_tags(self, row_id, genre, difficulty):
+        """ジャンル・難易度を付け直し、メモリ上の索引も移す"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT rating, genre, difficulty FROM history WHERE id = ?", (row_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            self._conn.execute(
+                "UPDATE history SET genre = ?, difficulty = ? WHERE id = ?", (genre, difficulty, row_id)
+            )
+            self._conn.commit()
+            old_bucket = self._index.get(row, [])
+            if row_id in old_bucket:
+                old_bucket.remove(row_id)
+            self._index.setdefault((row[0], genre, difficulty), []).append(row_id)
+            return True
+
+    def _fetch(self, ids):
+        placeholders = ",".join("?" * len(ids))
+        rows = self._conn.execute(
+            f"SELECT id, question, examples, rating, genre, difficulty FROM history WHERE id IN ({placeholders})", ids
+        ).fetchall()
+        entries = [
+            {"id": r[0], "question": r[1], "examples": json.loads(r[2]), "rating": r[3], "genre": r[4], "difficulty": r[5]}
+            for r in rows
+        ]
+        random.shuffle(entries)
+        return entries
+
+    def examples_for(self, question):
+        """お題の文章から、保存されている正解例を返す（無ければ空）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT examples FROM history WHERE question = ? ORDER BY id DESC LIMIT 1", (question,)
+            ).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def model_ratings(self):
+        """お題を作ったモデルごとの {モデル: (件数, 平均評価)}"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT model, COUNT(*), AVG(rating) FROM history WHERE model IS NOT NULL GROUP BY model"
+            ).fetchall()
+        return {model: (count, avg) for model, count, avg in rows}
+
+    def all_questions(self):
+        """保存されているお題の文章（重複なし）"""
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT DISTINCT question FROM history")]
+
+    def import_json(self, path=HISTORY_FILE):
+        """既存の quiz_history.json（配列形式）を取り込む。取り込んだ件数を返す"""
+        with open(path, "r", encoding="utf-8") as f:
+            history = json.load(f)
+
+        rows = [
+            (h["question"], json.dumps(h.get("examples", []), ensure_ascii=False),
+             int(h.get("rating", 0)), h.get("genre"), h.get("difficulty"),
+             h.get("timestamp", 0.0))
+            for h in history if h.get("question")
+        ]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO history (question, examples, rating, genre, difficulty, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._sync()
+            return self._conn.total_changes - before
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_history_store():
+    """プロセス全体で共有するストアを返す。初回で DB が空なら JSON から取り込む"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore(HISTORY_DB)
+            if _store._last_id == 0 and os.path.exists(HISTORY_FILE):
+                _store.import_json(HISTORY_FILE)
+        return _store
+
+
+if __name__ == "__main__":
+    # 使い方: python history_store.py [quiz_history.json]
+    src = sys.argv[1] if len(sys.argv) > 1 else HISTORY_FILE
+    n = HistoryStore(HISTORY_DB).import_json(src)
+    print(f"{src} から {n} 件取り込みました -> {HISTORY_DB}")
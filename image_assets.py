@@ -0,0 +1,135 @@
+#画像の表示サイズ別キャッシュ（爆弾・爆発）
+import base64
+import hashlib
+import io
+import os
+import threading
+
+from PIL import Image
+
+# --- 設定 ---
+# 画面ごとの表示幅 (px)。元画像より大きい幅は元のサイズのまま使う
+LAYOUT_WIDTHS = {
+    "bomb": 480,        # ゲーム画面左の列（wide レイアウトの 2/5 程度）
+    "explosion": 1000,  # 爆発演出（st.image(width=1000)）
+}
+KNOWN_ASSETS = {
+    "bomb": ["bomb_normal.png", "bomb_danger2.png"],
+    "explosion": ["explosion.png"],
+}
+WEBP_QUALITY = 80
+STATIC_IMAGE_DIR = os.path.join("static", "images")
+STATIC_IMAGE_URL = "app/static/images"
+
+
+class ImageAssets:
+    """
+    画像を表示幅に合わせて縮小・再圧縮（WebP / 最適化PNG の小さい方）したものを一度だけ作り、メモリに持つ。
+    static_serving=True のときは static/images に書き出し、URLだけを渡す（ブラウザにキャッシュされる）。
+    """
+
+    def __init__(self, static_serving=False):
+        self.static_serving = static_serving
+        self._lock = threading.Lock()
+        self._variants = {}     # (path, width) -> (bytes, mime, 元のバイト数)
+        self._srcs = {}         # (path, layout) -> src
+        self.sends = 0
+        self.bytes_sent = 0
+        self.bytes_original = 0
+        for layout, paths in KNOWN_ASSETS.items():
+            for path in paths:
+                if os.path.exists(path):
+                    self.src(path, layout)
+
+    def variant(self, path, width):
+        key = (path, width)
+        with self._lock:
+            if key in self._variants:
+                return self._variants[key]
+
+        with open(path, "rb") as f:
+            original = f.read()
+        img = Image.open(io.BytesIO(original))
+        img.load()
+        if img.width > width:
+            img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+
+        candidates = []
+        buf = io.BytesIO()
+        img.save(buf, format="WEBP", quality=WEBP_QUALITY, method=6)
+        candidates.append((buf.getvalue(), "image/webp"))
+        buf = io.BytesIO()
+        img.save(buf, format="PNG", optimize=True)
+        candidates.append((buf.getvalue(), "image/png"))
+        candidates.append((original, "image/png"))
+        data, mime = min(candidates, key=lambda c: len(c[0]))
+
+        entry = (data, mime, len(original))
+        with self._lock:
+            self._variants[key] = entry
+        return entry
+
+    def src(self, path, layout):
+        """画面に合ったサイズの画像の src（data URI または静的ファイルのURL）"""
+        key = (path, layout)
+        with self._lock:
+            if key in self._srcs:
+                return self._srcs[key]
+
+        data, mime, _ = self.variant(path, LAYOUT_WIDTHS[layout])
+        if self.static_serving:
+            ext = "webp" if mime == "image/webp" else "png"
+            name = f"{hashlib.sha1(data).hexdigest()[:16]}.{ext}"
+            os.makedirs(STATIC_IMAGE_DIR, exist_ok=True)
+            dest = os.path.join(STATIC_IMAGE_DIR, name)
+            if not os.path.exists(dest):
+                with open(dest, "wb") as f:
+                    f.write(data)
+            src = f"{STATIC_IMAGE_URL}/{name}"
+        else:
+            src = f"data:{mime};base64," + base64.b64encode(data).decode()
+
+        with self._lock:
+            self._srcs[key] = src
+        return src
+
+    def image(self, path, layout):
+        """st.image に渡すもの（静的配信ならURL、そうでなければ縮小済みのバイト列）"""
+        if self.static_serving:
+            return self.src(path, layout)
+        return self.variant(path, LAYOUT_WIDTHS[layout])[0]
+
+    def record_send(self, path, layout):
+        """1回送ったことを記録する（元画像を base64 で送った場合との差を出すため）"""
+        data, _, original_len = self.variant(path, LAYOUT_WIDTHS[layout])
+        sent = len(self.src(path, layout))
+        with self._lock:
+            self.sends += 1
+            self.bytes_sent += sent
+            self.bytes_original += 4 * ((original_len + 2) // 3)
+
+    def stats(self, rounds=0):
+        with self._lock:
+            saved = self.bytes_original - self.bytes_sent
+            return {
+                "static_serving": self.static_serving,
+                "sends": self.sends,
+                "bytes_sent": self.bytes_sent,
+                "bytes_original": self.bytes_original,
+                "bytes_saved": saved,
+                "bytes_saved_per_round": (saved / rounds) if rounds else None,
+                "variants": {f"{p}@{w}": len(v[0]) for (p, w), v in self._variants.items()},
+            }
+
+
+_assets = None
+_assets_lock = threading.Lock()
+
+
+def get_image_assets(static_serving=False):
+    """プロセス全体で共有するキャッシュを返す（初回に既知の画像の縮小版を作る）"""
+    global _assets
+    with _assets_lock:
+        if _assets is None:
+            _assets = ImageAssets(static_serving=static_serving)
+        return _assets
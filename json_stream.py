@@ -0,0 +1,56 @@
+#途中までしか届いていない JSON から、書き終わった文字列フィールドを取り出す
+import json
+import re
+
+
+class FieldStream:
+    """
+    ストリーミングで届く JSON テキストを少しずつ受け取り、
+    指定したキーの文字列値が閉じた時点で返す（全体が揃うのを待たない）
+    """
+
+    def __init__(self, keys):
+        self._patterns = {k: re.compile(r'"%s"\s*:\s*"' % re.escape(k)) for k in keys}
+        self._buf = ""
+        self._found = {}
+        self._scan_from = {k: 0 for k in keys}  # どこまで調べ終わったか（同じ所を何度も見ない）
+
+    @property
+    def text(self):
+        return self._buf
+
+    def feed(self, chunk):
+        """チャンクを追加し、新しく値が確定した (キー, 値) のリストを返す"""
+        self._buf += chunk
+        done = []
+        for key, pattern in self._patterns.items():
+            if key in self._found:
+                continue
+            m = pattern.search(self._buf, self._scan_from[key])
+            if not m:
+                # キーの途中で切れているかもしれないので、少し手前から探し直す
+                self._scan_from[key] = max(0, len(self._buf) - len(key) - 8)
+                continue
+            end = _string_end(self._buf, m.end())
+            if end is None:
+                self._scan_from[key] = m.start()
+                continue
+            self._found[key] = json.loads(self._buf[m.end() - 1:end + 1])
+            done.append((key, self._found[key]))
+        return done
+
+    def get(self, key):
+        return self._found.get(key)
+
+
+def _string_end(text, i):
+    """i から始まる JSON 文字列の閉じ引用符の位置（まだ届いていなければ None）"""
+    while i < len(text):
+        c = text[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == '"':
+            return i
+        i += 1
+    return None
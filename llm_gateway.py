@@ -0,0 +1,326 @@
+#Gemini への呼び出しをまとめる窓口
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# --- 設定 ---
+DEFAULT_MAX_IN_FLIGHT = 4   # 同時に投げるリクエストの上限
+DEFAULT_RATE_PER_SEC = 2.0  # 1秒あたりに補充されるトークン数
+DEFAULT_BURST = 4           # まとめて投げられる最大数
+STATS_WINDOW = 500          # 統計に使う直近の呼び出し数
+DEFAULT_HEDGE_PERCENTILE = 0.95  # 応答がこの分位点より遅れたら予備のリクエストを投げる（0 で無効）
+HEDGE_MIN_SAMPLES = 20      # 分位点を信用するのに必要な呼び出し数
+HEDGE_MIN_DELAY = 0.5       # 予備を投げるまでの最短の待ち時間（秒）
+DEFAULT_BREAKER_FAILURES = 5     # 連続でこの回数失敗したら回路を開く
+DEFAULT_BREAKER_RESET_SEC = 30.0 # 開いてからこの秒数たったら1回だけ試す
+
+
+class CircuitOpenError(RuntimeError):
+    """API が不調とみなして呼び出しを止めている"""
+
+
+class TokenBucket:
+    """トークンバケット方式のレート制限"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取る。足りなければ補充されるまで待つ"""
+        while True:
+            shortage = self._take()
+            if shortage == 0:
+                return
+            time.sleep(shortage)
+
+    def try_acquire(self):
+        """トークンがあれば1つ取って True。待たない"""
+        return self._take() == 0
+
+    def _take(self):
+        """取れたら 0、足りなければ補充までの秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class CircuitBreaker:
+    """
+    連続で失敗したら回路を開き、しばらくは呼ばずにすぐ CircuitOpenError にする。
+    reset_timeout たったら1回だけ試し（半開）、成功すれば元に戻す。
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_BREAKER_FAILURES, reset_timeout=DEFAULT_BREAKER_RESET_SEC):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opens = 0
+        self.rejected = 0
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError("API が不調なため、しばらく呼び出しを止めています")
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open":
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpenError("API の回復を確認中です")
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self._failures,
+                    "opens": self.opens, "rejected": self.rejected}
+
+
+def gemini_client(api_key):
+    """本物の Gemini クライアント（google.genai はここで初めて import する）"""
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+
+class LLMGateway:
+    """
+    クライアントを使い回し、同時実行数とレートを制御しながら generate_content を呼ぶ。
+    client_factory を差し替えればローカルの偽クライアントでも動く。
+    ・応答が直近の分位点より遅れたら、同じリクエストをもう1本投げて早い方を使う（ヘッジ）
+    ・連続で失敗したら回路を開き、回復するまではすぐ CircuitOpenError を返す（回路はモデルごと。
+      1つのモデルが不調でも、ほかのモデルは呼べる）
+    """
+
+    def __init__(self, api_key, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 rate_per_sec=DEFAULT_RATE_PER_SEC, burst=DEFAULT_BURST, client_factory=None,
+                 hedge_percentile=DEFAULT_HEDGE_PERCENTILE, breaker_failures=DEFAULT_BREAKER_FAILURES,
+                 breaker_reset_sec=DEFAULT_BREAKER_RESET_SEC):
+        self.client = (client_factory or gemini_client)(api_key)
+        self.max_in_flight = max_in_flight
+        self.hedge_percentile = hedge_percentile
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_sec = breaker_reset_sec
+        self._breakers = {}     # モデル名 -> CircuitBreaker
+        self._semaphore = threading.BoundedSemaphore(max_in_flight)
+        self._bucket = TokenBucket(rate_per_sec, burst)
+        # 枠を取ってから投げるので、スレッド数は同時実行数の上限と同じで足りる
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="llm-call")
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=STATS_WINDOW)
+        self._waits = deque(maxlen=STATS_WINDOW)
+        self._first_chunks = deque(maxlen=STATS_WINDOW)
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def breaker_for(self, model):
+        """モデルごとの回路"""
+        with self._lock:
+            if model not in self._breakers:
+                self._breakers[model] = CircuitBreaker(self.breaker_failures, self.breaker_reset_sec)
+            return self._breakers[model]
+
+    def generate_content(self, **kwargs):
+        """client.models.generate_content と同じ引数で呼ぶ（そのモデルの回路が開いていれば CircuitOpenError）"""
+        breaker = self.breaker_for(kwargs.get("model"))
+        breaker.before_call()
+        try:
+            response = self._hedged(kwargs)
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return response
+
+    def hedge_delay(self):
+        """予備のリクエストを投げるまでの待ち時間。データが足りない・無効なら None"""
+        if self.hedge_percentile <= 0:
+            return None
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return max(HEDGE_MIN_DELAY, ordered[int(self.hedge_percentile * (len(ordered) - 1))])
+
+    def _hedged(self, kwargs):
+        queued_at = time.monotonic()
+        self._bucket.acquire()
+        self._semaphore.acquire()
+        primary = self._executor.submit(self._call, kwargs, queued_at)
+        delay = self.hedge_delay()
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        # 予備は空きがあるときだけ（他の人のリクエストを待たせてまでは投げない）
+        if done or not self._reserve_hedge():
+            return primary.result()
+        with self._lock:
+            self.hedges += 1
+        hedge = self._executor.submit(self._call, kwargs, time.monotonic())
+
+        # 先に成功した方を使う（遅れた方の結果は捨てる）
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return f.result()
+                error = f.exception()
+        raise error
+
+    def _reserve_hedge(self):
+        if not self._semaphore.acquire(blocking=False):
+            return False
+        if not self._bucket.try_acquire():
+            self._semaphore.release()
+            return False
+        return True
+
+    def _call(self, kwargs, queued_at):
+        """同時実行数の枠を取った状態で呼ばれ、終わったら枠を返す"""
+        started = time.monotonic()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            return self.client.models.generate_content(**kwargs)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            finished = time.monotonic()
+            with self._lock:
+                self.in_flight -= 1
+                self.calls += 1
+                self._waits.append(started - queued_at)
+                self._latencies.append(finished - started)
+            self._semaphore.release()
+
+    def generate_content_stream(self, **kwargs):
+        """
+        client.models.generate_content_stream と同じ引数で呼び、チャンクを順に返す。
+        同時実行数の枠は最後のチャンクを受け取る（か途中で閉じる）まで持ち続ける。
+        ストリーミングに対応していないクライアントなら、全体を1チャンクとして返す。
+        ヘッジはしない（途中まで受け取ったものを捨てられないため）が、回路の開閉には数える。
+        """
+        breaker = self.breaker_for(kwargs.get("model"))
+        breaker.before_call()
+        queued_at = time.monotonic()
+        self._bucket.acquire()
+        failed = False
+        with self._semaphore:
+            started = time.monotonic()
+            with self._lock:
+                self.in_flight += 1
+            try:
+                models = self.client.models
+                if hasattr(models, "generate_content_stream"):
+                    chunks = models.generate_content_stream(**kwargs)
+                else:
+                    chunks = [models.generate_content(**kwargs)]
+                for i, chunk in enumerate(chunks):
+                    if i == 0:
+                        with self._lock:
+                            self._first_chunks.append(time.monotonic() - started)
+                    yield chunk
+            except Exception:
+                failed = True
+                with self._lock:
+                    self.errors += 1
+                breaker.record_failure()
+                raise
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                    self.calls += 1
+                    self._waits.append(started - queued_at)
+                # 途中で閉じられた場合も失敗ではない（ストリームの長さはヘッジの基準に入れない）
+                if not failed:
+                    breaker.record_success()
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "latency": _summary(self._latencies),
+                "queue_wait": _summary(self._waits),
+                "first_chunk": _summary(self._first_chunks),
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "breakers": {model: b.stats() for model, b in breakers.items()},
+            }
+
+
+def _summary(samples):
+    """平均と p50 / p95 / 最大（秒）"""
+    if not samples:
+        return {"avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    n = len(ordered)
+    return {
+        "avg": sum(ordered) / n,
+        "p50": ordered[int(0.50 * (n - 1))],
+        "p95": ordered[int(0.95 * (n - 1))],
+        "max": ordered[-1],
+    }
+
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+_client_factory = None
+
+
+def set_client_factory(factory):
+    """クライアントの作り方を差し替える（テスト・オフライン用）。作成済みの窓口は作り直す"""
+    global _client_factory
+    with _gateways_lock:
+        _client_factory = factory
+        _gateways.clear()
+
+
+def get_gateway(api_key, client_factory=None, **options):
+    """APIキーごとにプロセス全体で1つの窓口を返す（set_client_factory で差し替えた方を優先）"""
+    with _gateways_lock:
+        if api_key not in _gateways:
+            _gateways[api_key] = LLMGateway(api_key, client_factory=_client_factory or client_factory, **options)
+        return _gateways[api_key]
@@ -0,0 +1,82 @@
+#ネットワーク無しで動く Gemini の代用品（履歴ストアのお題を使う）
+import ast
+import json
+import re
+import types
+
+import history_store
+
+# --- 設定 ---
+STREAM_CHUNK_CHARS = 32  # ストリーミング時に1チャンクで返す文字数
+
+
+def make_hints(answers):
+    """正解例から「頭文字と文字数」のヒントを作る"""
+    return [f"「{a[0]}」から始まる{len(a)}文字の言葉" if a else "ヒントなし" for a in answers]
+
+
+def _judge(store, question, answers):
+    """履歴に保存されている正解例と一致するものだけを正解にする"""
+    import answer_judge
+    examples = {answer_judge.normalize_answer(a) for a in store.examples_for(question)}
+    results = []
+    for a in answers:
+        ok = answer_judge.normalize_answer(a) in examples
+        results.append({"answer": a, "is_correct": ok,
+                        "reason": "OK" if ok else "オフラインのため、保存済みの正解例と一致しませんでした"})
+    return {"score": sum(r["is_correct"] for r in results), "results": results,
+            "comment": "オフラインで判定しました"}
+
+
+class _Models:
+    def generate_content(self, model, contents, config=None):
+        store = history_store.get_history_store()
+
+        # まとめ判定のプロンプト: 判定リストの要素ごとに判定する
+        batch_judge = re.search(r"判定リスト:\s*(\[.*\])\s*\n", contents)
+        if batch_judge:
+            judgments = [dict(_judge(store, job["question"], job["answers"]), id=job["id"])
+                         for job in json.loads(batch_judge.group(1))]
+            text = json.dumps({"judgments": judgments}, ensure_ascii=False)
+            return types.SimpleNamespace(text=text, usage_metadata=None)
+
+        # 判定のプロンプト
+        match = re.search(r"お題:\s*(.+?)\n\s*回答リスト:\s*(\[.*?\])\s*\n", contents, re.S)
+        if match:
+            text = json.dumps(_judge(store, match.group(1).strip(), ast.literal_eval(match.group(2))),
+                              ensure_ascii=False)
+            return types.SimpleNamespace(text=text, usage_metadata=None)
+
+        # お題のプロンプト: 評価の高い保存済みのお題から選ぶ（まとめて頼まれたら その数だけ）
+        batch = re.search(r"お題を(\d+)個作成", contents)
+        n = int(batch.group(1)) if batch else 1
+        # ジャンル・難易度の指示があれば、そのタグが付いたお題を優先する
+        genre = re.search(r"ジャンルは「(.+?)」に限定", contents)
+        difficulty = re.search(r"難易度:\s*(\S+?)。", contents)
+        tags = (genre.group(1) if genre else None, difficulty.group(1) if difficulty else None)
+        entries = (store.sample_entries((4, 5), n, *tags) or store.sample_entries((4, 5), n)
+                   or store.sample_entries((3, 4, 5), n))
+        if not entries:
+            raise RuntimeError("オフライン用のお題がありません（quiz_history.json を取り込んでください）")
+        questions = []
+        for entry in entries:
+            answers = (entry["examples"] + ["-"] * 5)[:5]
+            questions.append({
+                "question": entry["question"],
+                "items": [{"answer": a, "hint": h} for a, h in zip(answers, make_hints(answers))],
+            })
+        text = json.dumps({"questions": questions} if batch else questions[0], ensure_ascii=False)
+        return types.SimpleNamespace(text=text, usage_metadata=None)
+
+    def generate_content_stream(self, model, contents, config=None):
+        """本物と同じように、応答を少しずつ返す"""
+        response = self.generate_content(model, contents, config)
+        for i in range(0, len(response.text), STREAM_CHUNK_CHARS):
+            yield types.SimpleNamespace(text=response.text[i:i + STREAM_CHUNK_CHARS], usage_metadata=None)
+
+
+class LocalLLMClient:
+    """genai.Client(api_key=...) と同じ形で使える代用品"""
+
+    def __init__(self, api_key=None):
+        self.models = _Models()
@@ -1,25 +1,36 @@
 #使用モジュール
+# google.genai / gtts / gspread / oauth2client は backends.py が必要になったときに import する
 import streamlit as st
-from google import genai
-from google.genai import types
 import time
 import json
 import re
 import os
 import random
-import base64
-from streamlit_autorefresh import st_autorefresh
-from tenacity import retry, stop_after_attempt, wait_fixed
-from gtts import gTTS
+import threading
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_random_exponential
 import uuid
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import datetime
+import backends
+import history_store
+import llm_gateway
+import tts_cache
+import sound_assets
+import feedback_sink
+import metrics
+import image_assets
+import dedup
+import json_stream
+import eval_batcher
+import model_router
+import disk_cache
 
 # --- 設定 ---
 DEFAULT_TIME_LIMIT = 60
 HISTORY_FILE = "quiz_history.json"
-SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+DUPLICATE_RETRIES = 2 # 既出とほぼ同じお題が来たときに作り直す回数
+RETRY_ATTEMPTS = 3    # API 呼び出しを試す回数
+RETRY_BASE_SEC = 0.5  # バックオフの基準（0.5, 1, 2, ... 秒を上限にランダムに待つ）
+RETRY_MAX_SEC = 4.0
+LOCAL_MODEL = "local" # ローカルの代用品で作ったお題に付けるモデル名
 
 #AIとテキストでやり取り
 def clean_json_text(text):
@@ -28,230 +39,740 @@ def clean_json_text(text):
     text = re.sub(r'\s*```$', '', text)
     return text.strip()
 
+def get_setting(name, default=None):
+    """設定値を Secrets → 環境変数 の順に探して返す"""
+    try:
+        if name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        pass # secrets.toml が無い場合など
+    return os.environ.get(name, default)
+
+def get_bool_setting(name, default=False):
+    """true/false の設定値（secrets.toml からは bool、環境変数からは文字列で来るので、どちらでも読めるように）"""
+    return str(get_setting(name, default)).lower() == "true"
+
+def backend_name(kind):
+    """使うバックエンドの名前。OFFLINE_MODE=true なら全部ローカルの代用品にする"""
+    if get_bool_setting("OFFLINE_MODE"):
+        return "local"
+    return get_setting(f"{kind.upper()}_BACKEND", backends.DEFAULTS[kind])
+
+def get_llm_gateway(api_key):
+    """Gemini 呼び出し用の共有窓口（同時実行数・レート制限つき）"""
+    return llm_gateway.get_gateway(
+        api_key,
+        client_factory=backends.load("llm", backend_name("llm")),
+        max_in_flight=int(get_setting("LLM_MAX_IN_FLIGHT", llm_gateway.DEFAULT_MAX_IN_FLIGHT)),
+        rate_per_sec=float(get_setting("LLM_RATE_PER_SEC", llm_gateway.DEFAULT_RATE_PER_SEC)),
+        burst=int(get_setting("LLM_BURST", llm_gateway.DEFAULT_BURST)),
+        hedge_percentile=float(get_setting("LLM_HEDGE_PERCENTILE", llm_gateway.DEFAULT_HEDGE_PERCENTILE)),
+        breaker_failures=int(get_setting("LLM_BREAKER_FAILURES", llm_gateway.DEFAULT_BREAKER_FAILURES)),
+        breaker_reset_sec=float(get_setting("LLM_BREAKER_RESET_SEC", llm_gateway.DEFAULT_BREAKER_RESET_SEC)),
+    )
+
+def get_fallback_gateway():
+    """API が使えないときの代わり（保存済みのお題・正解例で動くローカルの代用品）"""
+    global _fallback_gateway
+    with _fallback_lock:
+        if _fallback_gateway is None:
+            _fallback_gateway = llm_gateway.LLMGateway(
+                "local", client_factory=backends.load("llm", "local"), hedge_percentile=0)
+        return _fallback_gateway
+
+_fallback_gateway = None
+_fallback_lock = threading.Lock()
+
+def get_disk_cache():
+    """再起動しても残るキャッシュ（保存先は CACHE_DB、上限は CACHE_MAX_MB）。複数プロセスで同じファイルを使ってよい"""
+    return disk_cache.get_disk_cache(
+        get_setting("CACHE_DB", disk_cache.CACHE_DB),
+        int(float(get_setting("CACHE_MAX_MB", disk_cache.MAX_BYTES // (1024 * 1024))) * 1024 * 1024),
+    )
+
+@st.cache_resource(show_spinner=False)
+def warm_caches():
+    """
+    起動時に1回だけ、quiz_history.json から永続キャッシュを温める。
+    すぐ出せるお題を補充し、正解例を「正解」の判定として入れ、そのお題の読み上げ音声は裏で作っておく
+    """
+    import answer_judge
+    import local_llm
+    if not os.path.exists(HISTORY_FILE):
+        return {}
+    started = time.monotonic()
+    cache = get_disk_cache()
+    with open(HISTORY_FILE, "r", encoding="utf-8") as f:
+        history = json.load(f)
+
+    # 正解例の判定は履歴ファイルが変わったときだけ入れ直す（別プロセスが済ませていれば飛ばす）
+    marker = f"warmed:{os.path.getmtime(HISTORY_FILE)}"
+    judged = 0
+    if cache.get("meta", marker) is None:
+        verdicts = answer_judge.get_verdict_cache()
+        for h in history:
+            for answer in h.get("examples", []):
+                verdicts.put(h["question"], {"answer": answer, "is_correct": True, "reason": "正解例と一致"},
+                             replace=False)
+                judged += 1
+        cache.set("meta", marker, True)
+
+    def make_question(h):
+        answers = h.get("examples", [])[:5]
+        return {"question": h["question"], "example_answers": answers, "hints": local_llm.make_hints(answers)}
+
+    warmed = disk_cache.warm_from_history(cache, history, make_question)
+    threading.Thread(target=lambda: [generate_voice(q["question"]) for q in warmed],
+                     name="warm-voices", daemon=True).start()
+    report = {"questions": len(warmed), "verdicts": judged, "seconds": time.monotonic() - started}
+    print(f"Cache warmed: {report}")
+    return report
+
+def get_model_router():
+    """
+    用途ごとのモデルの選び分け。候補は LLM_MODELS_GENERATE / LLM_MODELS_JUDGE（カンマ区切り・品質の高い順）、
+    応答時間の目標は LLM_SLO_GENERATE_SEC / LLM_SLO_JUDGE_SEC
+    """
+    models, slo_sec = {}, {}
+    for task in model_router.TASKS:
+        names = get_setting(f"LLM_MODELS_{task.upper()}")
+        if names:
+            models[task] = [m.strip() for m in names.split(",") if m.strip()]
+        slo_sec[task] = float(get_setting(f"LLM_SLO_{task.upper()}_SEC", model_router.DEFAULT_SLO_SEC[task]))
+    return model_router.get_model_router(models, slo_sec, ratings=history_store.get_history_store().model_ratings)
+
+def _routed(task, call, items=1):
+    """
+    ルーターが選んだモデルで call(model) を呼び、かかった時間と成否を記録する。
+    そのモデルの回路が開いていたら、ほかの候補で呼び直す（全部開いていたら CircuitOpenError）。
+    items 個まとめて作るときは、1つあたりの時間で記録する
+    """
+    router = get_model_router()
+    tried = []
+    while True:
+        model = router.pick(task, exclude=tried)
+        if model is None:
+            raise llm_gateway.CircuitOpenError(f"{task} の候補のモデルはどれも回路が開いています")
+        started = time.monotonic()
+        try:
+            result = call(model)
+        except llm_gateway.CircuitOpenError:
+            # 呼んでいないのでモデルの成績には入れず、次の候補へ
+            metrics.inc(f"router.{task}.circuit_open")
+            tried.append(model)
+            continue
+        except Exception:
+            router.record(task, model, time.monotonic() - started, ok=False)
+            raise
+        router.record(task, model, (time.monotonic() - started) / items)
+        return result
+
+def _api_retry(name):
+    """
+    一時的な失敗は指数バックオフ＋ジッターを挟んで RETRY_ATTEMPTS 回まで試す。
+    回路が開いているとき（CircuitOpenError）は待っても無駄なのですぐ諦める
+    """
+    return retry(
+        stop=stop_after_attempt(RETRY_ATTEMPTS),
+        wait=wait_random_exponential(multiplier=RETRY_BASE_SEC, max=RETRY_MAX_SEC),
+        retry=retry_if_not_exception_type(llm_gateway.CircuitOpenError),
+        reraise=True,
+        before_sleep=metrics.count_retry(name),
+    )
+
+def get_duplicate_index():
+    """既出のお題の索引。オフライン用の代用品は保存済みのお題をそのまま出すので、そのときは None"""
+    if backend_name("llm") == "local":
+        return None
+    return dedup.get_duplicate_index()
+
+def get_image_assets():
+    """表示サイズ別の画像キャッシュ（IMAGE_STATIC_SERVING=true なら静的ファイルとして配信）"""
+    static_serving = get_bool_setting("IMAGE_STATIC_SERVING")
+    return image_assets.get_image_assets(static_serving)
+
+def open_worksheet():
+    """評価の保存先のシートを開く（失敗したら例外）"""
+    return backends.load("feedback", backend_name("feedback"))()
+
 def connect_to_sheet():
     """Secretsから認証情報を読み込んでシートに接続"""
     try:
-        # st.secrets["gcp_service_account"] の辞書データをそのまま使う
-        creds_dict = dict(st.secrets["gcp_service_account"])
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
-        client = gspread.authorize(creds)
-        
-        # シート名 または URL で開く
-        # 名前で開く場合: 分かりやすい名前にしておいてください
-        sheet = client.open("quiz_feedback").sheet1 
-        return sheet
+        return open_worksheet()
     except Exception as e:
         st.error(f"スプレッドシート接続エラー: {e}")
         return None
 
 #蓄積された過去のデータからAIにいくつか渡すため抽出
-def load_examples_by_rating():
+def load_examples_by_rating(genre=None, difficulty=None):
     """履歴から良い例(5,4)と悪い例(1,2)を抽出して返す"""
-    if not os.path.exists(HISTORY_FILE):
-        return [], []
-    
     try:
-        with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-            
-            # 良い例: 5は優先、4も少し混ぜる
-            good_qs = [h['question'] for h in history if h.get('rating', 0) == 5]
-            okay_qs = [h['question'] for h in history if h.get('rating', 0) == 4]
-            # 悪い例: 1と2
-            bad_qs = [h['question'] for h in history if h.get('rating', 0) <= 2]
-            
-            # 良い例リスト構築
-            final_good = good_qs + random.sample(okay_qs, min(len(okay_qs), 2))
-            return final_good, bad_qs
-    except:
+        store = history_store.get_history_store()
+
+        # ジャンル・難易度が記録された例があればそれを優先し、無ければ全体から選ぶ
+        if genre and store.count((4, 5), genre, difficulty) == 0:
+            genre, difficulty = None, None
+
+        # 良い例: 5は優先、4も少し混ぜる
+        good_qs = store.sample((5,), 5, genre, difficulty)
+        okay_qs = store.sample((4,), 2, genre, difficulty)
+        # 悪い例: 1と2
+        bad_qs = store.sample((1, 2), 3)
+
+        # 良い例リスト構築
+        final_good = good_qs + okay_qs
+        return final_good, bad_qs
+    except Exception as e:
+        print(f"履歴読み込みエラー: {e}")
         return [], []
     
 #問題データと回答例、フィードバックを保存
-def save_feedback(question, example_answers, rating):
+@metrics.traced("save_feedback")
+def save_feedback(question, example_answers, rating, genre=None, difficulty=None, model=None):
     """
-    結果をGoogleスプレッドシートのみに保存する
-    （ローカルのJSON保存機能は削除済み）
+    結果をローカルの控えと履歴ストアに書いてすぐに返す（model はお題を作ったモデル。モデルの選び分けに使う）。
+    Googleスプレッドシートへは裏でまとめて書き込む（シートが遅い・落ちていても待たされない）
     """
     try:
-        # 1. シートに接続
-        sheet = connect_to_sheet()
-        
-        # シートが見つからなかった場合（接続エラーなど）
-        if not sheet:
-            st.error("エラー: スプレッドシートに接続できませんでした。")
-            return False
+        sink = feedback_sink.get_feedback_sink(open_worksheet)
+        row = sink.submit(question, example_answers, rating, genre, difficulty, model)
+        metrics.observe_size("save_feedback", len(json.dumps(row, ensure_ascii=False).encode("utf-8")))
 
-        # 2. 現在時刻を取得
-        now_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        # 3. 保存するデータを作成
-        # [日時, お題, 評価] の順
-        row = [now_str, question, rating]
-        
-        # 4. 書き込み実行
-        sheet.append_row(row)
-        
         # 成功ログ（Manage appの黒い画面で見れる用）
-        print(f"Spreadsheet saved: {row}")
-        
+        print(f"Feedback queued: {row}")
         return True
 
     except Exception as e:
         # エラーが起きたら画面に表示して知らせる
-        st.error(f"スプレッドシート書き込み中にエラーが発生しました: {e}")
+        st.error(f"評価の保存中にエラーが発生しました: {e}")
         return False
 
 #googleの自動音声を再生
-def generate_voice(text, filename="question_voice.mp3"):
+@metrics.traced("generate_voice")
+def generate_voice(text, lang="ja"):
     """
-    Googleのサーバーを使って音声を生成する（オンライン対応）
+    読み上げ音声を用意してファイルのパスを返す（失敗時は None）
+    同じ文章は音声キャッシュから返すので、Googleのサーバーには一度しか問い合わせない
     """
     try:
-        # lang='ja' で日本語を指定
-        tts = gTTS(text=text, lang='ja')
-        tts.save(filename)
-        return True
+        backend = tts_cache.PersistentBackend(backends.load("tts", backend_name("tts"))(), get_disk_cache())
+        path = tts_cache.get_audio_cache(backend).get(text, lang)
+        metrics.observe_size("generate_voice", os.path.getsize(path))
+        return path
     except Exception as e:
+        metrics.inc("generate_voice.errors")
         st.error(f"音声生成エラー: {e}")
-        return False
+        return None
         
 
+def _request_question(gateway, model, contents, config, on_question):
+    """
+    お題のJSONを1つ生成して (文字列, トークン使用量) で返す。
+    LLM_STREAMING=true なら少しずつ受け取り、"question" が書き終わった時点で on_question(お題) を呼ぶ。
+    on_question が False を返したら残りを受け取らずに打ち切って (None, 使用量) を返す。
+    """
+    started = time.monotonic()
+    streaming = get_bool_setting("LLM_STREAMING", True)
+    if not streaming:
+        response = gateway.generate_content(model=model, contents=contents, config=config)
+        metrics.registry.observe_duration("get_ai_question.time_to_question.full", time.monotonic() - started)
+        usage = getattr(response, "usage_metadata", None)
+        data = json.loads(clean_json_text(response.text))
+        if on_question(data["question"]) is False:
+            return None, usage
+        return response.text, usage
+
+    # ★ストリーミング: 正解例・ヒントが届くのを待たずに、お題の文章だけ先に使う
+    fields = json_stream.FieldStream(("question",))
+    usage = None
+    stream = gateway.generate_content_stream(model=model, contents=contents, config=config)
+    try:
+        for chunk in stream:
+            usage = getattr(chunk, "usage_metadata", None) or usage # 使用量は最後のチャンクに付く
+            for _, question in fields.feed(chunk.text or ""):
+                metrics.registry.observe_duration("get_ai_question.time_to_question.stream", time.monotonic() - started)
+                if on_question(question) is False:
+                    return None, usage
+    finally:
+        stream.close()
+    if fields.get("question") is None:
+        # 途中で見つけられなかった（余計な文字が混ざっていた等）ときは全体から読む
+        if on_question(json.loads(clean_json_text(fields.text))["question"]) is False:
+            return None, usage
+    return fields.text, usage
+
+
+def _prompt_conditions(genre, difficulty):
+    """お題生成プロンプトの条件部分 (ジャンル指示, 難易度指示, 履歴の例) を作る"""
+    # --- ここで履歴をロードしてプロンプトに組み込む ---
+    good_examples, bad_examples = load_examples_by_rating(genre, difficulty)
+
+    examples_text = ""
+    if good_examples:
+        picks = random.sample(good_examples, min(len(good_examples), 5))
+        examples_text += "【ユーザーが好むお題の傾向（これらを参考にしてください）】:\n" + "\n".join([f"- {p}" for p in picks]) + "\n"
+
+    if bad_examples:
+        picks = random.sample(bad_examples, min(len(bad_examples), 3))
+        examples_text += "【ユーザーが嫌うお題の傾向（これらは避けてください）】:\n" + "\n".join([f"- {p}" for p in picks]) + "\n"
+
+    # 難易度に応じた指示
+    difficulty_instruction = ""
+    if difficulty == "初級":
+        difficulty_instruction = "小学生でもわかる簡単な、答えやすい内容にしてください。"
+    elif difficulty == "上級":
+        difficulty_instruction = "知識が必要な、少しマニアックでひねった内容にしてください。"
+    else:
+        difficulty_instruction = "一般的で、誰でも思いつくが5つ出すのは少し焦る程度の内容にしてください。"
+
+    # ジャンル指示
+    genre_instruction = f"ジャンルは「{genre}」に限定してください。" if genre != "ノンジャンル" else "ジャンルは問いません（バラエティ豊かに）。"
+    return genre_instruction, difficulty_instruction, examples_text
+
+
+def _validate_question(item):
+    """生成されたお題1つ分の形を確かめ、question_data に整形する（不正なら None）"""
+    if not isinstance(item, dict) or not isinstance(item.get("question"), str) or not item["question"].strip():
+        return None
+    items = item.get("items")
+    if not isinstance(items, list) or len(items) != 5:
+        return None
+    answers, hints = [], []
+    for it in items:
+        if not isinstance(it, dict):
+            return None
+        answer, hint = it.get("answer"), it.get("hint")
+        if not isinstance(answer, str) or not answer.strip() or not isinstance(hint, str):
+            return None
+        answers.append(answer.strip())
+        hints.append(hint.strip() or "ヒントなし")
+    if len(set(answers)) != len(answers):
+        return None # 同じ正解例が重複している
+    # ★重要: 既存のロジックを壊さないようデータを整形する
+    # itemsの中から、answerだけを抜き出して従来の example_answers に入れる
+    return {
+        "question": item["question"].strip(),
+        "example_answers": answers,
+        "hints": hints # ヒントリストを別途保持
+    }
+
+
+# バッチサイズごとの生成コスト（1お題あたりの時間・トークン数を比べるため）
+_generation_stats = {}
+_generation_lock = threading.Lock()
+
+def _record_generation(batch_size, seconds, prompt_tokens, output_tokens, accepted):
+    with _generation_lock:
+        s = _generation_stats.setdefault(batch_size, {
+            "calls": 0, "requested": 0, "accepted": 0, "seconds": 0.0, "prompt_tokens": 0, "output_tokens": 0})
+        s["calls"] += 1
+        s["requested"] += batch_size
+        s["accepted"] += accepted
+        s["seconds"] += seconds
+        s["prompt_tokens"] += prompt_tokens
+        s["output_tokens"] += output_tokens
+    if accepted:
+        metrics.registry.observe_duration(f"generate.batch{batch_size}.per_question", seconds / accepted)
+    metrics.inc("llm.prompt_tokens", prompt_tokens)
+    metrics.inc("llm.output_tokens", output_tokens)
+
+def _token_counts(usage):
+    if usage is None:
+        return 0, 0
+    return (getattr(usage, "prompt_token_count", 0) or 0), (getattr(usage, "candidates_token_count", 0) or 0)
+
+def generation_stats():
+    """バッチサイズごとの 1お題あたりの秒数・トークン数と、使えたお題の割合"""
+    with _generation_lock:
+        report = {}
+        for size, s in sorted(_generation_stats.items()):
+            accepted = max(1, s["accepted"])
+            report[size] = {
+                "calls": s["calls"],
+                "accepted_rate": s["accepted"] / s["requested"],
+                "sec_per_question": s["seconds"] / accepted,
+                "prompt_tokens_per_question": s["prompt_tokens"] / accepted,
+                "output_tokens_per_question": s["output_tokens"] / accepted,
+            }
+        return report
+
 #AIを使っての問題と正解例の生成
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
-def get_ai_question(api_key, genre, difficulty):
-    """履歴を考慮してAIにお題を作らせる"""
+@metrics.traced("get_ai_question")
+def get_ai_question(api_key, genre, difficulty, on_question=None):
+    """
+    履歴を考慮してAIにお題を作らせる。
+    on_question を渡すと、お題の文章が確定した時点で（正解例が揃う前に）呼ばれる。
+    API が失敗し続ける・回路が開いているときは、保存済みのお題（ローカルの代用品）で続ける。
+    永続キャッシュに用意されたお題（起動時に履歴から補充したもの）があれば、それを先に出す
+    """
+    cached = take_cached_question(genre, difficulty)
+    if cached is not None:
+        if on_question:
+            on_question(cached["question"])
+        return cached
+
     try:
-        # 1. クライアントの初期化 (ここでAPIキーを設定)
-        client = genai.Client(api_key=api_key)
-        
-        # --- ここで履歴をロードしてプロンプトに組み込む ---
-        good_examples, bad_examples = load_examples_by_rating()
-        
-        examples_text = ""
-        if good_examples:
-            picks = random.sample(good_examples, min(len(good_examples), 5))
-            examples_text += "【ユーザーが好むお題の傾向（これらを参考にしてください）】:\n" + "\n".join([f"- {p}" for p in picks]) + "\n"
-        
-        if bad_examples:
-            picks = random.sample(bad_examples, min(len(bad_examples), 3))
-            examples_text += "【ユーザーが嫌うお題の傾向（これらは避けてください）】:\n" + "\n".join([f"- {p}" for p in picks]) + "\n"
-        
-        # 難易度に応じた指示
-        difficulty_instruction = ""
-        if difficulty == "初級":
-            difficulty_instruction = "小学生でもわかる簡単な、答えやすい内容にしてください。"
-        elif difficulty == "上級":
-            difficulty_instruction = "知識が必要な、少しマニアックでひねった内容にしてください。"
-        else:
-            difficulty_instruction = "一般的で、誰でも思いつくが5つ出すのは少し焦る程度の内容にしてください。"
-
-        # ジャンル指示
-        genre_instruction = f"ジャンルは「{genre}」に限定してください。" if genre != "ノンジャンル" else "ジャンルは問いません（バラエティ豊かに）。"
+        # 共有クライアントを使う (プロセス全体で使い回す)。モデルはルーターが選ぶ
+        gateway = get_llm_gateway(api_key)
+        return _routed("generate", lambda model: _generate_question(gateway, model, genre, difficulty, on_question))
+    except Exception as e:
+        metrics.inc("get_ai_question.errors")
+        print(f"お題生成エラー（ローカルのお題に切り替えます）: {e}")
+
+    try:
+        metrics.inc("get_ai_question.fallback")
+        return _generate_question(get_fallback_gateway(), LOCAL_MODEL, genre, difficulty, on_question,
+                                  check_duplicates=False)
+    except Exception as e:
+        st.error(f"お題生成エラー: {e}")
+        return None
+
+def take_cached_question(genre, difficulty):
+    """永続キャッシュからすぐ出せるお題を1つ取り出す（別プロセスと同じものは取らない）。無ければ None"""
+    try:
+        cache = get_disk_cache()
+        question_data = cache.take("questions", disk_cache.question_prefix(genre, difficulty))
+        if question_data is not None:
+            metrics.inc("get_ai_question.cache_hits")
+            cache.set("served", disk_cache.make_key(question_data["question"]), True)
+        return question_data
+    except Exception as e:
+        print(f"キャッシュ読み込みエラー: {e}")
+        return None
+
+@_api_retry("get_ai_question")
+def _generate_question(gateway, model, genre, difficulty, on_question=None, check_duplicates=True):
+    """お題を1つ生成する（失敗したら例外）。question_data["model"] に作ったモデルを残す"""
+    genre_instruction, difficulty_instruction, examples_text = _prompt_conditions(genre, difficulty)
+
+    prompt = f"""
+    クイズ番組のような「〇〇なものを5つ答えろ」形式のお題を1つ作成してください。
+    また、その正解例と正解例一つ一つに対する「ヒント（頭文字や文字数など正解を推測するためのもの）」も作成してください。
+
+    条件:
+    1. 「嫌うお題」の要素は避け、「好むお題」に近い雰囲気で作ること。
+    2. {genre_instruction}
+    3. 難易度: {difficulty}。{difficulty_instruction}
+    4. {examples_text}
+    5. 以下のJSON形式のみで出力すること。挨拶不要。
+    {{
+        "question": "お題テキスト",
+        "items": [
+            {{"answer": "正解例1", "hint": "正解例1のヒント"}},
+            {{"answer": "正解例2", "hint": "正解例2のヒント"}},
+            {{"answer": "正解例3", "hint": "正解例3のヒント"}},
+            {{"answer": "正解例4", "hint": "正解例4のヒント"}},
+            {{"answer": "正解例5", "hint": "正解例5のヒント"}}
+        ]
+    }}
+    """
+    metrics.observe_size("get_ai_question.prompt", len(prompt.encode("utf-8")))
+
+    config = {
+        "response_mime_type": "application/json", # ★重要: これで確実にJSONになる
+        "temperature": 0.7 # 創造性の調整もここに書く
+    }
+
+    # ★既に出した・保存済みのお題とほぼ同じものは、音声を作る前にここで弾いて作り直す
+    # （ストリーミングならお題の文章が届いた時点で打ち切るので、残りの生成を待たない）
+    index = get_duplicate_index() if check_duplicates else None
+    avoid = []
+    started = time.monotonic()
+    prompt_tokens = output_tokens = 0
+    for attempt in range(DUPLICATE_RETRIES + 1):
+        last_try = attempt == DUPLICATE_RETRIES
+        avoid_text = ""
+        if avoid:
+            avoid_text = "\n        ※次のお題とは内容が重ならないようにしてください:\n" + "\n".join([f"- {a}" for a in avoid])
+
+        def check(question):
+            dup = index.find(question) if index else None
+            if dup is not None:
+                metrics.inc("get_ai_question.duplicates")
+                print(f"Duplicate question rejected ({dup[1]:.2f}): {question} ~ {dup[0]}")
+                avoid.append(dup[0])
+                # 作り直しても似ていた場合はそのまま出す（お題なしで止まるよりはよい）
+                if not last_try:
+                    return False
+            if on_question:
+                on_question(question)
+            return True
+
+        text, usage = _request_question(gateway, model, prompt + avoid_text, config, check)
+        p_tokens, o_tokens = _token_counts(usage)
+        prompt_tokens += p_tokens
+        output_tokens += o_tokens
+        if text is not None:
+            break
+    metrics.observe_size("get_ai_question.response", len(text.encode("utf-8")))
+    question_data = _validate_question(json.loads(clean_json_text(text)))
+    if question_data is None:
+        raise ValueError("お題の形式が正しくありません")
+    question_data["model"] = model
+    if index:
+        index.add(question_data["question"])
+    _record_generation(1, time.monotonic() - started, prompt_tokens, output_tokens, 1)
+    return question_data
+
+#お題をまとめて生成（先読みプール用）
+@metrics.traced("get_ai_questions")
+def get_ai_questions(api_key, n, genre, difficulty):
+    """
+    1回のリクエストでお題を n 個まとめて作らせる（履歴の例を含むプロンプトを1回分で済ませる）。
+    1つずつ形を確かめ、崩れているもの・既出とほぼ同じものは捨てて、使えるものだけのリストを返す
+    """
+    try:
+        gateway = get_llm_gateway(api_key)
+        genre_instruction, difficulty_instruction, examples_text = _prompt_conditions(genre, difficulty)
 
         prompt = f"""
-        クイズ番組のような「〇〇なものを5つ答えろ」形式のお題を1つ作成してください。
-        また、その正解例と正解例一つ一つに対する「ヒント（頭文字や文字数など正解を推測するためのもの）」も作成してください。
+        クイズ番組のような「〇〇なものを5つ答えろ」形式のお題を{n}個作成してください。
+        お題同士は内容が重ならないようにしてください。
+        また、それぞれの正解例と正解例一つ一つに対する「ヒント（頭文字や文字数など正解を推測するためのもの）」も作成してください。
         
         条件:
         1. 「嫌うお題」の要素は避け、「好むお題」に近い雰囲気で作ること。
         2. {genre_instruction}
         3. 難易度: {difficulty}。{difficulty_instruction}
         4. {examples_text}
-        5. 以下のJSON形式のみで出力すること。挨拶不要。
+        5. 以下のJSON形式のみで出力すること。questions の要素数は{n}個。挨拶不要。
         {{
-            "question": "お題テキスト",
-            "items": [
-                {{"answer": "正解例1", "hint": "正解例1のヒント"}},
-                {{"answer": "正解例2", "hint": "正解例2のヒント"}},
-                {{"answer": "正解例3", "hint": "正解例3のヒント"}},
-                {{"answer": "正解例4", "hint": "正解例4のヒント"}},
-                {{"answer": "正解例5", "hint": "正解例5のヒント"}}
+            "questions": [
+                {{
+                    "question": "お題テキスト",
+                    "items": [
+                        {{"answer": "正解例1", "hint": "正解例1のヒント"}},
+                        {{"answer": "正解例2", "hint": "正解例2のヒント"}},
+                        {{"answer": "正解例3", "hint": "正解例3のヒント"}},
+                        {{"answer": "正解例4", "hint": "正解例4のヒント"}},
+                        {{"answer": "正解例5", "hint": "正解例5のヒント"}}
+                    ]
+                }}
             ]
         }}
         """
-        response = client.models.generate_content(
-            model='gemini-2.5-flash', # 最新モデル指定
+        metrics.observe_size("get_ai_questions.prompt", len(prompt.encode("utf-8")))
+        started = time.monotonic()
+        # 1つずつ作るときと比べられるよう、ルーターには1お題あたりの時間で記録する
+        model, response = _routed("generate", lambda model: (model, gateway.generate_content(
+            model=model,
             contents=prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json", # ★重要: これで確実にJSONになる
-                temperature=0.7 # 創造性の調整もここに書く
-            )
-        )
+            config={
+                "response_mime_type": "application/json",
+                "temperature": 0.8 # まとめて作るので少しばらけさせる
+            }
+        )), items=n)
+        elapsed = time.monotonic() - started
+        metrics.observe_size("get_ai_questions.response", len(response.text.encode("utf-8")))
         data = json.loads(clean_json_text(response.text))
-        
-        # ★重要: 既存のロジックを壊さないようデータを整形する
-        # itemsの中から、answerだけを抜き出して従来の example_answers に入れる
-        question_data = {
-            "question": data["question"],
-            "example_answers": [item["answer"] for item in data["items"]],
-            "hints": [item["hint"] for item in data["items"]] # ヒントリストを別途保持
-        }
-        return question_data
-    
+        items = data.get("questions", []) if isinstance(data, dict) else data
+
+        # ★1つずつ確かめて、使えるものだけ残す（1つ崩れていても全部は捨てない）
+        index = get_duplicate_index()
+        results = []
+        for item in items[:n]:
+            question_data = _validate_question(item)
+            if question_data is None:
+                metrics.inc("get_ai_questions.invalid")
+                continue
+            if index and index.find(question_data["question"]) is not None:
+                metrics.inc("get_ai_questions.duplicates")
+                continue
+            if index:
+                index.add(question_data["question"]) # 同じバッチの中で似たもの同士も弾く
+            question_data["model"] = model
+            results.append(question_data)
+
+        _record_generation(n, elapsed, *_token_counts(getattr(response, "usage_metadata", None)), len(results))
+        return results
 
     except Exception as e:
+        metrics.inc("get_ai_questions.errors")
         st.error(f"お題生成エラー: {e}")
-        return None
+        return []
 
 #ユーザーの入力した答えを判定
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
+@metrics.traced("evaluate_answers")
 def evaluate_answers(api_key, question, user_answers):
-    """回答判定"""
+    """
+    回答判定。EVAL_BATCH_WINDOW_MS > 0 なら、同じ時間帯に来た他のセッションの判定と
+    1回のリクエストにまとめて送り、自分の分の結果だけを受け取る。
+    全部の回答に永続キャッシュの判定があれば API を呼ばない
+    """
+    import answer_judge
+    verdicts = answer_judge.get_verdict_cache()
+    keys = [answer_judge.normalize_answer(a) for a in user_answers]
+    cached = [verdicts.get(question, a) for a in user_answers]
+    if user_answers and all(cached):
+        metrics.inc("evaluate_answers.cache_hits")
+        # キャッシュは回答1つ分の判定なので、重複はここで外す
+        seen = set()
+        for i, key in enumerate(keys):
+            if key in seen and cached[i]["is_correct"]:
+                cached[i] = {"answer": user_answers[i], "is_correct": False, "reason": "同じ回答が重複しています"}
+            seen.add(key)
+        score = sum(v["is_correct"] for v in cached)
+        return {"score": score, "results": cached, "comment": answer_judge.make_comment(score)}
+
+    result = _evaluate_answers_uncached(api_key, question, user_answers)
+    if result and not result.get("offline") and len(result.get("results", [])) == len(user_answers):
+        # ★リスト全体を見た判定なので、その回答だけで決まるもの（1回だけ出てきて、結果の回答と一致するもの）だけを保存する。
+        # 重複や並び順で変わる判定を入れると、別の人の回答まで間違いになってしまう
+        for answer, key, item in zip(user_answers, keys, result["results"]):
+            if keys.count(key) != 1 or answer_judge.normalize_answer(item.get("answer", "")) != key:
+                continue
+            verdicts.put(question, {"answer": answer, "is_correct": bool(item.get("is_correct")),
+                                    "reason": item.get("reason", "")})
+    return result
+
+def _evaluate_answers_uncached(api_key, question, user_answers):
+    window_ms = float(get_setting("EVAL_BATCH_WINDOW_MS", eval_batcher.DEFAULT_WINDOW_MS))
+    if window_ms <= 0:
+        return evaluate_answers_now(api_key, question, user_answers)
+    batcher = eval_batcher.get_evaluation_batcher(
+        api_key, lambda jobs: evaluate_batch(api_key, jobs),
+        window_ms=window_ms,
+        max_batch=int(get_setting("EVAL_BATCH_MAX", eval_batcher.DEFAULT_MAX_BATCH)),
+    )
+    return batcher.evaluate(question, user_answers)
+
+def evaluate_answers_now(api_key, question, user_answers):
+    """回答判定をすぐに1回で行う（API が使えないときは保存済みの正解例との一致で判定する）"""
     try:
-        client = genai.Client(api_key=api_key)
-        
-        prompt = f"""
-        お題: {question}
-        回答リスト: {user_answers}
-        
-        上記回答の正誤判定を行い、以下のJSON形式で返してください。
-        {{
-            "score": 正解数(整数),
-            "results": [
-                {{"answer": "回答1", "is_correct": true, "reason": "OK"}},
-                {{"answer": "回答2", "is_correct": false, "reason": "NG理由"}}
-            ],
-            "comment": "短い総評"
-        }}
-        """
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json" # JSON強制
-            )
-        )
-        return json.loads(clean_json_text(response.text))
+        gateway = get_llm_gateway(api_key)
+        return _routed("judge", lambda model: _evaluate(gateway, model, question, user_answers))
+    except Exception as e:
+        metrics.inc("evaluate_answers.errors")
+        print(f"判定エラー（ローカルの判定に切り替えます）: {e}")
+
+    try:
+        metrics.inc("evaluate_answers.fallback")
+        result = _evaluate(get_fallback_gateway(), LOCAL_MODEL, question, user_answers)
+        result["offline"] = True # 保存済みの正解例との一致だけで決めたので、永続キャッシュには入れない
+        return result
     except Exception as e:
         st.error(f"判定エラー: {e}")
         return None
 
+@_api_retry("evaluate_answers")
+def _evaluate(gateway, model, question, user_answers):
+    """回答リストを判定する（失敗したら例外）"""
+    prompt = f"""
+    お題: {question}
+    回答リスト: {user_answers}
+
+    上記回答の正誤判定を行い、以下のJSON形式で返してください。
+    {{
+        "score": 正解数(整数),
+        "results": [
+            {{"answer": "回答1", "is_correct": true, "reason": "OK"}},
+            {{"answer": "回答2", "is_correct": false, "reason": "NG理由"}}
+        ],
+        "comment": "短い総評"
+    }}
+    """
+    response = gateway.generate_content(
+        model=model,
+        contents=prompt,
+        config={
+            "response_mime_type": "application/json" # JSON強制
+        }
+    )
+    metrics.observe_size("evaluate_answers.prompt", len(prompt.encode("utf-8")))
+    metrics.observe_size("evaluate_answers.response", len(response.text.encode("utf-8")))
+    return json.loads(clean_json_text(response.text))
+
+def evaluate_batch(api_key, jobs):
+    """
+    [(お題, 回答リスト), ...] をまとめて1回で判定し、同じ順で結果のリストを返す。
+    まとめた応答から取り出せなかった分だけ、1つずつ判定し直す
+    """
+    if len(jobs) == 1:
+        return [evaluate_answers_now(api_key, *jobs[0])]
+
+    judged = {}
+    try:
+        gateway = get_llm_gateway(api_key)
+        judged = _routed("judge", lambda model: _evaluate_many(gateway, model, jobs))
+    except Exception as e:
+        metrics.inc("evaluate_batch.errors")
+        print(f"まとめ判定エラー（1つずつ判定します）: {e}")
+
+    results = []
+    for i, (question, answers) in enumerate(jobs):
+        item = judged.get(i)
+        if not item or len(item.get("results", [])) != len(answers):
+            metrics.inc("evaluate_batch.refetched")
+            item = evaluate_answers_now(api_key, question, answers)
+        results.append(item)
+    return results
+
+@_api_retry("evaluate_batch")
+def _evaluate_many(gateway, model, jobs):
+    """複数のお題の判定を1回のリクエストで行い {番号: 結果} を返す（失敗したら例外）"""
+    batch = [{"id": i, "question": q, "answers": list(a)} for i, (q, a) in enumerate(jobs)]
+    prompt = f"""
+    次の判定リストの各要素について、お題に対する回答リストの正誤判定を行ってください。
+    判定リスト: {json.dumps(batch, ensure_ascii=False)}
+
+    以下のJSON形式で返してください。judgments は判定リストと同じ id を持つこと。
+    {{
+        "judgments": [
+            {{
+                "id": 0,
+                "score": 正解数(整数),
+                "results": [
+                    {{"answer": "回答1", "is_correct": true, "reason": "OK"}},
+                    {{"answer": "回答2", "is_correct": false, "reason": "NG理由"}}
+                ],
+                "comment": "短い総評"
+            }}
+        ]
+    }}
+    """
+    response = gateway.generate_content(
+        model=model,
+        contents=prompt,
+        config={
+            "response_mime_type": "application/json" # JSON強制
+        }
+    )
+    metrics.observe_size("evaluate_batch.prompt", len(prompt.encode("utf-8")))
+    metrics.observe_size("evaluate_batch.response", len(response.text.encode("utf-8")))
+    data = json.loads(clean_json_text(response.text))
+    return {item["id"]: item for item in data.get("judgments", []) if isinstance(item, dict) and "id" in item}
+
 #問題文、効果音を再生する
-def play_sound(file_path, visible=False):
+@metrics.traced("play_sound")
+def play_sound(file_path, visible=False, sound_id=None):
     """
     指定した音声ファイルを再生する。
     音量調節機能は削除し、確実に再生されることを優先。
     visible=True の場合のみ、プレイヤーを表示する（手動で音量変更は可能）。
+    エンコード済みの音声はレジストリから使い回す。
+    sound_id を固定すると、再実行されても同じ要素のまま再生が続く。
     """
     try:
-        with open(file_path, "rb") as f:
-            data = f.read()
-            b64 = base64.b64encode(data).decode()
-            
-            # ユニークID生成
-            sound_id = f"audio_{uuid.uuid4()}"
+        static_serving = get_bool_setting("SOUND_STATIC_SERVING")
+        registry = sound_assets.get_sound_registry(static_serving)
+        src, raw_len = registry.src(file_path)
 
-            # プレイヤーの表示・非表示設定
-            display_style = "width: 300px;" if visible else "display:none;"
-            controls_attr = "controls" if visible else ""
-            
-            # シンプルなHTML埋め込み（余計なJSは排除）
-            md = f"""
-                <audio id="{sound_id}" {controls_attr} autoplay style="{display_style}">
-                    <source src="data:audio/mp3;base64,{b64}" type="audio/mp3">
-                </audio>
-                """
-            st.markdown(md, unsafe_allow_html=True)
+        # ユニークID生成
+        sound_id = f"audio_{sound_id or uuid.uuid4()}"
+
+        # プレイヤーの表示・非表示設定
+        display_style = "width: 300px;" if visible else "display:none;"
+        controls_attr = "controls" if visible else ""
+        
+        # シンプルなHTML埋め込み（余計なJSは排除）
+        md = f"""
+            <audio id="{sound_id}" {controls_attr} autoplay style="{display_style}">
+                <source src="{src}" type="audio/mp3">
+            </audio>
+            """
+        st.markdown(md, unsafe_allow_html=True)
+        registry.record(len(md), None if src.startswith("data:") else raw_len)
+        metrics.observe_size("play_sound", len(md))
             
     except FileNotFoundError:
         pass # ファイルがない場合は無視 
@@ -1,38 +1,240 @@
 import streamlit as st
-from google import genai
-from google.genai import types
 import time
-import json
-import re
-import os
-import random
-import base64
 from streamlit_autorefresh import st_autorefresh
-from tenacity import retry, stop_after_attempt, wait_fixed
-from gtts import gTTS
 import uuid
+from contextlib import nullcontext
 import logic
+import question_pool
+import question_bank
+import dedup
+import answer_judge
+import rooms
+import eval_batcher
+import mp3_info
+import bomb_timer
+import metrics
+import profiler
+import model_router
+import tts_cache
+import sound_assets
+import feedback_sink
+import backends
 
 # --- 設定 ---
 DEFAULT_TIME_LIMIT = 60
 HISTORY_FILE = "quiz_history.json"
 
 
+def show_debug_panel(api_key):
+    """?debug=1 のときだけ、サイドバーに計測結果を出す"""
+    if st.query_params.get("debug") != "1" and not logic.get_bool_setting("DEBUG_PANEL"):
+        return
+    with st.sidebar.expander("🔧 デバッグ（計測）", expanded=False):
+        st.json(metrics.registry.snapshot(), expanded=False)
+        st.json({
+            "llm_gateway": logic.get_llm_gateway(api_key).stats(),
+            "question_pool": question_pool.get_question_pool(api_key).stats(),
+            "question_bank": question_bank.bank_stats(),
+            "generation": logic.generation_stats(),
+            "dedup": dedup.get_duplicate_index().stats(),
+            "judge": answer_judge.judge_stats(),
+            "eval_batcher": eval_batcher.batcher_stats(),
+            "model_router": model_router.router_stats(),
+            "disk_cache": logic.get_disk_cache().stats(),
+            "tts_cache": tts_cache.audio_cache_stats(),
+            "sounds": sound_assets.registry_stats(),
+            "images": logic.get_image_assets().stats(bomb_timer.rerun_stats()["rounds"]),
+            "feedback_sink": feedback_sink.get_feedback_sink(logic.open_worksheet).stats(),
+            "game_reruns": bomb_timer.rerun_stats(),
+            "rooms": rooms.get_room_registry().stats(),
+            "lazy_imports": backends.import_times(),
+            "profiles": profiler.stats(),
+        }, expanded=False)
+
+
+def begin_round(api_key, entry, room_round=None):
+    """用意したお題でラウンドを始める（room_round を渡すとルームの共通の開始時刻に合わせる）"""
+    q_data = entry["question_data"]
+    if "bank_id" in q_data:
+        st.session_state.seen_bank_questions.add(q_data["question"])
+    st.session_state.current_question = q_data
+    st.session_state.answers = []
+    st.session_state.revealed_hints = [] # ★リセット
+    st.session_state.result_sound_played = False
+    st.session_state.feedback_submitted = False
+    # ★回答は入力されるたびに裏で判定していく（ルームでは全員分をまとめて判定するので使わない）
+    st.session_state.round_judge = None if room_round else answer_judge.RoundJudge(api_key, q_data['question'], q_data['example_answers'])
+    st.session_state.pop('eval_result', None)
+
+    # 問題文を作成（「お題は、〇〇です」と言わせると自然）
+    speak_text = f"{q_data['question']}"
+
+    # 音声はプール側で生成済み
+    if entry["voice_file"]:
+        # 生成成功したらフラグを立てて、ゲーム画面で再生させる
+        st.session_state.question_voice_file = entry["voice_file"]
+        st.session_state.need_play_question = True
+        # ★読み上げ時間（秒）は生成したMP3のフレームから実際の長さを求める
+        st.session_state.speech_duration = mp3_info.file_duration(
+            entry["voice_file"], default=len(speak_text) * 0.25 + 1.0)
+    else:
+        st.session_state.need_play_question = False
+        st.session_state.speech_duration = 0
+    # 読み上げ終了時刻は、ゲーム画面を最初に表示したときに決める
+    st.session_state.read_at = None
+    st.session_state.read_until = None
+    st.session_state.round_id = uuid.uuid4().hex
+    st.session_state.round_reruns = 0
+
+    # ★ルーム: 全員同じ時刻に読み上げ・回答を始める（ホストが決めた時刻に合わせる）
+    if room_round:
+        st.session_state.round_id = room_round["round_id"]
+        st.session_state.read_at = room_round["read_at"]
+        st.session_state.read_until = room_round["start_at"]
+        st.session_state.question_voice_file = entry["voice_file"]
+        st.session_state.need_play_question = True
+        for k in ("time_limit", "genre", "difficulty"):
+            st.session_state.game_settings[k] = room_round[k]
+
+    # ★重要: まだスタート時間は記録しない（読み終わってから記録する）
+    st.session_state.start_time = None    
+
+    st.session_state.page = 'game'
+
+
+def go_exploding():
+    """時間切れ: 爆発演出へ（画面全体を再実行する）"""
+    st.session_state.page = 'exploding'
+    st.session_state.explode_until = None
+    st.rerun(scope="app")
+
+
+def remaining_sec(limit_sec):
+    return limit_sec - (time.time() - st.session_state.start_time)
+
+
+@st.fragment
+@metrics.traced("render.game.timer")
+def game_timer(limit_sec):
+    """残り時間バーと秒数（色の変化もブラウザ側）。時間切れのときだけ値が返ってきて、ここだけ再実行される"""
+    remaining = remaining_sec(limit_sec)
+    timer_event = bomb_timer.bomb_timer("timer", st.session_state.round_id, remaining, limit_sec,
+                                        key=f"timer_{st.session_state.round_id}")
+    if timer_event and timer_event.get("round") == st.session_state.round_id and remaining <= 1:
+        go_exploding()
+
+
+def submit_answer(limit_sec):
+    """送信ボタンのコールバック（描画の前に呼ばれるので、再実行は1回で済む）"""
+    user_in = st.session_state.input_box
+    if not user_in:
+        return
+    if remaining_sec(limit_sec) <= 0:
+        st.session_state.page = 'exploding'
+        st.session_state.explode_until = None
+        return
+    st.session_state.round_reruns += 1
+    st.session_state.answers.append(user_in)
+    if st.session_state.round_judge:
+        st.session_state.round_judge.submit(user_in)
+    if len(st.session_state.answers) >= 5:
+        st.session_state.page = 'result'
+
+
+def reveal_hint(limit_sec):
+    """ヒントボタンのコールバック"""
+    # ボタンの無効化は fragment が描き直されるまで反映されないので、ここでも残り時間を確かめる
+    if len(st.session_state.revealed_hints) >= 5 or remaining_sec(limit_sec) <= 10:
+        return
+    all_hints = st.session_state.current_question.get("hints", [])
+    idx = len(st.session_state.revealed_hints)
+    if idx < len(all_hints):
+        st.session_state.round_reruns += 1
+        st.session_state.revealed_hints.append(all_hints[idx])
+
+
+@st.fragment
+@metrics.traced("render.game.answers")
+def answer_area(limit_sec):
+    """回答スロット・ヒント行・入力フォーム。送信してもこの中だけ描き直す（ヒント行はさらにその中の fragment）"""
+    # 5つ答えた・時間切れのときは画面ごと切り替える
+    if st.session_state.page != 'game':
+        st.rerun(scope="app")
+
+    # 回答スロット
+    slots_html = '<div class="slot-container">'
+    current_answers = st.session_state.answers
+    for i in range(5):
+        if i < len(current_answers):
+            slots_html += f'<div class="answer-slot slot-filled">{current_answers[i]}</div>'
+        else:
+            slots_html += f'<div class="answer-slot">{i + 1}</div>'
+    slots_html += '</div>'
+    st.markdown(slots_html, unsafe_allow_html=True)
+
+    # ヒント行
+    hint_row(limit_sec)
+
+    # 入力フォーム
+    with st.form(key='ans_form', clear_on_submit=True):
+        c_in, c_sub = st.columns([4, 1], gap="small")
+        with c_in:
+            st.text_input("回答", key="input_box", label_visibility="collapsed", placeholder="答えを入力...")
+        with c_sub:
+            st.form_submit_button("送信", on_click=submit_answer, args=(limit_sec,))
+
+
+@st.fragment
+@metrics.traced("render.game.hints")
+def hint_row(limit_sec):
+    """ヒントボタンと最後に出したヒント。押してもこの行だけ再実行する"""
+    # gap="small" でボタンとテキストの間隔を詰める
+    c_h_btn, c_h_txt = st.columns([1.5, 4.5], gap="small") 
+    
+    with c_h_btn:
+        can_use_hint = (len(st.session_state.revealed_hints) < 5 and remaining_sec(limit_sec) > 10)
+        label = "💡 ヒント" if can_use_hint else "💡 ヒント不可"
+        
+        st.button(label, disabled=not can_use_hint, key="hint_btn", width="stretch", on_click=reveal_hint, args=(limit_sec,))
+    
+    with c_h_txt:
+        if st.session_state.revealed_hints:
+            # 最後のヒントを表示（CSSで高さを抑える）
+            st.info(f"{st.session_state.revealed_hints[-1]}", icon="🕵️")
+        else:
+            # 空白行を入れてレイアウト崩れを防ぐ
+            st.write("") 
+
+
+def show_leaderboard(room):
+    """ルームの参加者と累計スコア"""
+    rows = ["| 順位 | 名前 | 累計 | 今回 |", "|---|---|---|---|"]
+    for i, (name, total, last) in enumerate(room.leaderboard(), start=1):
+        rows.append(f"| {i} | {name} | {total} | {'-' if last is None else last} |")
+    st.markdown("\n".join(rows))
+
+
 def main():
     st.set_page_config(page_title="AIクイズボンバー", page_icon="💣", layout="wide")
 
     logic.load_css()
+    # 画像の縮小版は最初の1回だけ作られ、以降はメモリから使う
+    logic.get_image_assets()
+    # ★再起動直後でも速いよう、永続キャッシュを温める（プロセスごとに最初の1回だけ）
+    logic.warm_caches()
 
     st.title("💣 AI クイズボンバー")
 
-    # SecretsからAPIキー読み込み
-    api_key = None
-    if "GEMINI_API_KEY" in st.secrets:
-        api_key = st.secrets["GEMINI_API_KEY"]
+    # SecretsからAPIキー読み込み（ローカルの代用品で動かすときはキーは要らない）
+    api_key = logic.get_setting("GEMINI_API_KEY")
+    if not api_key and logic.backend_name("llm") == "local":
+        api_key = "local"
     if not api_key:
         st.warning("APIキーが設定されていません。secrets.tomlを確認してください。")
         return
 
+    show_debug_panel(api_key)
+
     # セッション初期化
     if 'page' not in st.session_state: st.session_state.page = 'start'
     if 'answers' not in st.session_state: st.session_state.answers = []
@@ -49,8 +251,14 @@ def main():
         st.session_state.game_settings = {
             "time_limit": DEFAULT_TIME_LIMIT,
             "genre": "ノンジャンル",
-            "difficulty": "中級"
+            "difficulty": "中級",
+            "bank_mode": logic.get_bool_setting("QUESTION_BANK_MODE"),
         }    
+    # ★ストック出題で出したお題（同じプレイヤーに同じお題を出さない）
+    if 'seen_bank_questions' not in st.session_state: st.session_state.seen_bank_questions = set()
+    # ★みんなで遊ぶ（ルーム）用
+    if 'player_id' not in st.session_state: st.session_state.player_id = uuid.uuid4().hex
+    if 'room_code' not in st.session_state: st.session_state.room_code = None
 
     # --- 1. スタート画面 ---
     if st.session_state.page == 'start':
@@ -78,11 +286,54 @@ def main():
                     min_value=20, max_value=100, value=60, step=5
                 )
             
+            bank_mode = st.toggle(
+                "📚 ストックから出題（過去の高評価のお題・待ち時間なし）",
+                value=st.session_state.game_settings["bank_mode"]
+            )
+
             # 設定を保存
+            st.session_state.game_settings["bank_mode"] = bank_mode
             st.session_state.game_settings["genre"] = genre
             st.session_state.game_settings["difficulty"] = diff
             st.session_state.game_settings["time_limit"] = tm
 
+        # ★先読みプール: 設定を選んだ時点で裏でお題を用意し始める
+        # （ストック出題のときは AI を呼ばないので用意しない）
+        pool = question_pool.get_question_pool(api_key)
+        if not bank_mode:
+            pool.warm(genre, diff)
+
+        # ★みんなで遊ぶ: お題・音声・判定はルームで1回分だけ用意して全員で使う
+        with st.expander("👥 みんなで遊ぶ（ルーム）"):
+            player_name = st.text_input("ニックネーム", key="player_name", max_chars=12)
+            c_new, c_code, c_join = st.columns([2, 2, 1], gap="small")
+            with c_new:
+                create_room = st.button("ルームを作る", disabled=not player_name, width="stretch")
+            with c_code:
+                room_code = st.text_input("ルームコード", key="room_code_input", label_visibility="collapsed",
+                                          placeholder="ルームコード")
+            with c_join:
+                join_room = st.button("参加", disabled=not (player_name and room_code), width="stretch")
+
+            registry = rooms.get_room_registry()
+            if create_room:
+                room = registry.create(api_key, st.session_state.player_id, player_name, st.session_state.game_settings)
+                st.session_state.room_code = room.code
+                st.session_state.room_round_no = 0
+                st.session_state.page = 'lobby'
+                st.rerun()
+            if join_room:
+                room = registry.get(room_code)
+                if room is None:
+                    st.error("ルームが見つかりません。コードを確認してください。")
+                else:
+                    room.join(st.session_state.player_id, player_name)
+                    st.session_state.room_code = room.code
+                    # 途中から入った人は次のラウンドから参加する
+                    st.session_state.room_round_no = room.round_no
+                    st.session_state.page = 'lobby'
+                    st.rerun()
+
         st.write("準備ができたらスタートボタンを押してください。")
         if st.button("ゲームスタート", width="stretch"):
             
@@ -92,68 +343,120 @@ def main():
             # ★追加: リザルト音再生済みフラグをリセット
             st.session_state.result_sound_played = False
 
-            with st.spinner("お題を作成中..."):
-                q_data = logic.get_ai_question(
-                    api_key,
-                    st.session_state.game_settings["genre"], 
-                    st.session_state.game_settings["difficulty"])
-                
-                if q_data:
-                    st.session_state.current_question = q_data
-                    st.session_state.answers = []
-                    st.session_state.revealed_hints = [] # ★リセット
-                    st.session_state.result_sound_played = False
-                    st.session_state.feedback_submitted = False
-                    
-                    # 問題文を作成（「お題は、〇〇です」と言わせると自然）
-                    speak_text = f"{q_data['question']}"
-                    
-                    # 音声生成を実行
-                    if logic.generate_voice(speak_text, "question_voice.mp3"):
-                        # 生成成功したらフラグを立てて、ゲーム画面で再生させる
-                        st.session_state.need_play_question = True
-                        # ★追加: 読み上げ時間（秒）を計算
-                        # 日本語は1文字0.2～0.3秒程度。少し余裕を持たせる
-                        st.session_state.speech_duration = len(speak_text) * 0.25 + 1.0
-                    else:
-                        st.session_state.need_play_question = False
-                        st.session_state.speech_duration = 0
-
-                    # ★重要: まだスタート時間は記録しない（読み終わってから記録する）
-                    st.session_state.start_time = None    
-
-                    st.session_state.page = 'game'
+            # ストック出題ならまだ見ていない高評価のお題から選ぶ（出し尽くしたら AI で作る）
+            entry = None
+            if bank_mode:
+                entry = question_bank.draw(genre, diff, st.session_state.seen_bank_questions)
+                if entry is None:
+                    st.info("この条件のストックを出し尽くしたので、AIで新しいお題を作ります。")
+
+            # プールに準備済みのお題があれば即開始、空のときだけその場で生成
+            if entry is None:
+                entry = pool.pop(genre, diff)
+            if entry is None:
+                with st.spinner("お題を作成中..."):
+                    # お題の文章だけ先に届くので、正解例を待つ間に表示しておく
+                    preview = st.empty()
+                    entry = question_pool.prepare_question(
+                        api_key, genre, diff,
+                        on_question=lambda q: preview.markdown(f"**お題:** {q}"))
+
+            if entry:
+                begin_round(api_key, entry)
+                st.rerun()
+
+    # --- ★ルームの待合室 ---
+    elif st.session_state.page == 'lobby':
+        room = rooms.get_room_registry().get(st.session_state.room_code)
+        if room is None:
+            st.warning("ルームが見つかりません（しばらく使われなかったため閉じられた可能性があります）。")
+            if st.button("スタート画面へ"):
+                st.session_state.room_code = None
+                st.session_state.page = 'start'
+                st.rerun()
+            return
+
+        # ホストがラウンドを始めたら、全員そろってゲーム画面へ
+        rnd = room.round
+        if rnd and rnd["no"] > st.session_state.get('room_round_no', 0):
+            st.session_state.room_round_no = rnd["no"]
+            begin_round(api_key, {"question_data": rnd["question_data"], "voice_file": rnd["voice_file"]}, room_round=rnd)
+            st.rerun()
+
+        settings = room.settings
+        st.markdown(f"### 👥 ルーム `{room.code}`")
+        st.caption("ほかの人はスタート画面の「みんなで遊ぶ」でこのコードを入力すると参加できます。")
+        st.write(f"ジャンル: {settings['genre']} ／ 難易度: {settings['difficulty']} ／ 制限時間: {settings['time_limit']}秒")
+        show_leaderboard(room)
+
+        if st.session_state.player_id == room.host_id:
+            pool = question_pool.get_question_pool(api_key)
+            pool.warm(settings["genre"], settings["difficulty"])
+            if st.button("ラウンド開始", width="stretch"):
+                # お題と音声はここで1回だけ用意する（参加者の数だけ作らない）
+                entry = pool.pop(settings["genre"], settings["difficulty"])
+                if entry is None:
+                    with st.spinner("お題を作成中..."):
+                        entry = question_pool.prepare_question(api_key, settings["genre"], settings["difficulty"])
+                if entry:
+                    logic.play_sound("メニューを開く5.mp3")
+                    room.start_round(entry)
                     st.rerun()
+        else:
+            st.info("ホストがラウンドを始めるのを待っています...")
+
+        if st.button("ルームを出る"):
+            st.session_state.room_code = None
+            st.session_state.page = 'start'
+            st.rerun()
+
+        # ラウンドの開始に気付けるよう、待合室だけ1秒ごとに更新する
+        st_autorefresh(interval=1000, limit=None, key=f"lobby_{room.code}")
 
     # --- 2. ゲーム画面（修正版） ---
     elif st.session_state.page == 'game':
         limit_sec = st.session_state.game_settings["time_limit"]
 
         # A. 問題読み上げ
+        # ★sleep で待たずに、終了時刻を覚えておいて時間が来たら再実行で次へ進める
         if st.session_state.get('need_play_question', False):
-            st.info("🔊 お題を読み上げています...")
-            time.sleep(0.5) 
-            logic.play_sound("question_voice.mp3")
-            st.markdown(f'<div class="question-text">お題：{st.session_state.current_question["question"]}</div>', unsafe_allow_html=True)
-            wait_time = st.session_state.get('speech_duration', 3)
-            time.sleep(wait_time)
-            st.session_state.need_play_question = False
-            st.session_state.start_time = time.time()
-            st.rerun()
+            if st.session_state.read_until is None:
+                # 表示が落ち着くまでの0.5秒 + 実際の読み上げ時間
+                st.session_state.read_until = time.time() + 0.5 + st.session_state.get('speech_duration', 3)
+
+            wait_ms = int((st.session_state.read_until - time.time()) * 1000)
+            if wait_ms <= 0:
+                st.session_state.need_play_question = False
+                # ルームでは全員共通の開始時刻から数える
+                st.session_state.start_time = st.session_state.read_until if st.session_state.room_code else time.time()
+                st.rerun()
+
+            read_at = st.session_state.get('read_at')
+            if read_at and time.time() < read_at:
+                # ★ルーム: 全員に行き渡るまで少し待ってから一斉に読み上げる
+                st.info("⏳ まもなく始まります...")
+                st_autorefresh(interval=max(int((read_at - time.time()) * 1000), 100), limit=None,
+                               key=f"ready_{st.session_state.round_id}")
+            else:
+                st.info("🔊 お題を読み上げています...")
+                # idを固定しておけば、途中で再実行されても読み上げが最初からやり直しにならない
+                if st.session_state.get('question_voice_file'):
+                    logic.play_sound(st.session_state.question_voice_file, sound_id=f"question_{st.session_state.round_id}")
+                st.markdown(f'<div class="question-text">お題：{st.session_state.current_question["question"]}</div>', unsafe_allow_html=True)
+                st_autorefresh(interval=max(wait_ms, 100), limit=None, key=f"read_{st.session_state.round_id}")
 
         # B. ゲーム本編
         else:
             if st.session_state.start_time is None:
                 st.session_state.start_time = time.time()
 
-            # タイマー更新
-            st_autorefresh(interval=1000, limit=None, key="game_timer")
+            # ★タイマーはブラウザ側で進めるので、毎秒の再実行はしない
+            st.session_state.round_reruns += 1
             elapsed = time.time() - st.session_state.start_time
             remaining = limit_sec - elapsed
 
             if remaining <= 0:
-                st.session_state.page = 'exploding'
-                st.rerun()
+                go_exploding()
 
             # ---------------------------------------------------------
             # ★ レイアウト構成
@@ -162,109 +465,24 @@ def main():
             col_bomb_visual, col_game_ui = st.columns([2, 3])
 
             # --- 【左】爆弾画像 ---
+            # 残り15秒で画像が切り替わるのもブラウザ側で行う
             with col_bomb_visual:
-                if remaining <= 15:
-                    bomb_img = "bomb_danger2.png"
-                    timer_class = "timer-urgent"
-                else:
-                    bomb_img = "bomb_normal.png"
-                    timer_class = "timer-normal"
-                
-                st.image(bomb_img, width="stretch")
+                bomb_timer.bomb_timer("bomb", st.session_state.round_id, remaining, limit_sec,
+                                      key=f"bomb_{st.session_state.round_id}")
                 
 
             # --- 【右】ゲーム操作エリア ---
-            # ★重要: ここからのコードは全て with col_game_ui: のインデントの中に含めること！
+            # ★タイマー・ヒント・回答はそれぞれ fragment にして、操作したところだけ再実行する
             with col_game_ui:
                 
                 # 1. お題
                 st.markdown(f'<div class="question-text">お題：{st.session_state.current_question["question"]}</div>', unsafe_allow_html=True)
 
-                # 1. パーセントを計算 (0~100)
-                percent = max(0, min(100, (remaining / limit_sec) * 100))
-                
-                # 2. 残り時間で色を決める
-                if remaining <= 15:
-                    bar_color = "#FF4B4B" # 危険：赤色（タイマーと同じ色）
-                elif remaining <= (limit_sec / 2):
-                    bar_color = "#FFC107" # 注意：黄色（少し焦らせる）
-                else:
-                    bar_color = "#4CAF50" # 安全：緑色
-                
-                # 3. HTMLでバーを描画
-                # (transitionを入れているので、色が滑らかに変わります)
-                st.markdown(f"""
-                    <div style="width: 100%; background-color: #333333; border-radius: 5px; height: 20px; margin-bottom: 10px;">
-                        <div style="
-                            width: {percent}%; 
-                            background-color: {bar_color}; 
-                            height: 100%; 
-                            border-radius: 5px; 
-                            transition: width 1s linear, background-color 0.5s;
-                        "></div>
-                    </div>
-                """, unsafe_allow_html=True)
-
-                st.markdown(f'<p class="{timer_class}">{int(remaining)}</p>', unsafe_allow_html=True)
-
-
-                # 2. 回答スロット
-                slots_html = '<div class="slot-container">'
-                current_answers = st.session_state.answers
-                for i in range(5):
-                    if i < len(current_answers):
-                        slots_html += f'<div class="answer-slot slot-filled">{current_answers[i]}</div>'
-                    else:
-                        slots_html += f'<div class="answer-slot">{i + 1}</div>'
-                slots_html += '</div>'
-                st.markdown(slots_html, unsafe_allow_html=True)
-
-                # 3. ヒント & 入力フォームをまとめるコンテナ
-                # （コンテナを使うと要素が散らばりにくくなります）
-                with st.container():
-                    
-                    # --- ヒント行 ---
-                    # gap="small" でボタンとテキストの間隔を詰める
-                    c_h_btn, c_h_txt = st.columns([1.5, 4.5], gap="small") 
-                    
-                    with c_h_btn:
-                        can_use_hint = (len(st.session_state.revealed_hints) < 5 and remaining > 10)
-                        label = "💡 ヒント" if can_use_hint else "💡 ヒント不可"
-                        
-                        if st.button(label, disabled=not can_use_hint, key="hint_btn", width="stretch"):
-                            st.session_state.start_time -= 0
-                            all_hints = st.session_state.current_question.get("hints", [])
-                            idx = len(st.session_state.revealed_hints)
-                            if idx < len(all_hints):
-                                st.session_state.revealed_hints.append(all_hints[idx])
-                                st.rerun()
-                    
-                    with c_h_txt:
-                        if st.session_state.revealed_hints:
-                            # 最後のヒントを表示（CSSで高さを抑える）
-                            st.info(f"{st.session_state.revealed_hints[-1]}", icon="🕵️")
-                        else:
-                            # 空白行を入れてレイアウト崩れを防ぐ
-                            st.write("") 
-
-                    # --- 入力フォーム行 ---
-                    with st.form(key='ans_form', clear_on_submit=True):
-                        c_in, c_sub = st.columns([4, 1], gap="small")
-                        with c_in:
-                            user_in = st.text_input("回答", key="input_box", label_visibility="collapsed", placeholder="答えを入力...")
-                        with c_sub:
-                            sub_btn = st.form_submit_button("送信")
-
-                        if sub_btn and user_in:
-                            current_rem = limit_sec - (time.time() - st.session_state.start_time)
-                            if current_rem <= 0:
-                                st.session_state.page = 'exploding'
-                                st.rerun()
-                            else:
-                                st.session_state.answers.append(user_in)
-                                if len(st.session_state.answers) >= 5:
-                                    st.session_state.page = 'result'
-                                st.rerun()
+                # 残り時間バーと秒数
+                game_timer(limit_sec)
+
+                # 2. 回答スロット・ヒント・入力フォーム
+                answer_area(limit_sec)
 
     # =========================================
     # --- ★新規追加: 爆発演出画面 ---
@@ -273,7 +491,14 @@ def main():
         current_vol = st.session_state.master_volume
         # ★ここでも音量を渡す
         
-        # タイマーの自動更新を止めるために、autorefreshはここでは呼び出さない
+        # ★爆発演出を見せる時間も sleep ではなく終了時刻で管理する
+        if st.session_state.get('explode_until') is None:
+            st.session_state.explode_until = time.time() + 1.0
+        wait_ms = int((st.session_state.explode_until - time.time()) * 1000)
+        if wait_ms <= 0:
+            # 1秒経ったら、自動的に結果画面へ移動
+            st.session_state.page = 'result'
+            st.rerun()
 
         # 画面中央にドカンと表示するためのCSS調整
         st.markdown("""
@@ -302,31 +527,54 @@ def main():
         st.markdown('<p class="time-up-text">TIME UP!! 💣</p>', unsafe_allow_html=True)
         
         # 爆発画像を大きく表示（widthでサイズ調整可能）
-        st.image("explosion.png", width=1000)
+        # 起動時に作っておいた縮小・再圧縮版を使う
+        images = logic.get_image_assets()
+        st.image(images.image("explosion.png", "explosion"), width=1000)
+        images.record_send("explosion.png", "explosion")
         
         st.markdown('</div>', unsafe_allow_html=True)
 
         # ★追加: 画面が切り替わった瞬間に爆音！
-        logic.play_sound("爆発1.mp3")
-
-        # ★ここで動きを止める！
-        # この画面が表示された状態でPython側の処理を2秒止める
-        time.sleep(1)
+        logic.play_sound("爆発1.mp3", sound_id=f"explosion_{st.session_state.get('round_id')}")
 
-        # 2秒経ったら、自動的に結果画面へ移動
-        st.session_state.page = 'result'
-        st.rerun()
+        # 時間が来たら再実行して結果画面へ
+        st_autorefresh(interval=max(wait_ms, 100), limit=None, key=f"explode_{st.session_state.get('round_id')}")
 
     # --- 3. 結果画面 ---
     elif st.session_state.page == 'result':
         current_vol = st.session_state.master_volume
 
         st.subheader("📝 結果発表")
-        if 'eval_result' not in st.session_state or st.session_state.get('last_q') != st.session_state.current_question['question']:
+        room = rooms.get_room_registry().get(st.session_state.room_code) if st.session_state.room_code else None
+        if st.session_state.room_code and room is None:
+            # ルームが閉じられていたら1人用に戻す。まだ結果が無ければ自分の回答だけをここで判定する
+            st.warning("ルームが閉じられたため、あなたの回答だけを判定します。")
+            st.session_state.room_code = None
+            if st.session_state.get('room_result_round') != st.session_state.round_id:
+                q_data = st.session_state.current_question
+                st.session_state.round_judge = answer_judge.RoundJudge(api_key, q_data['question'], q_data['example_answers'])
+                st.session_state.last_q = None
+        if room is not None:
+            # ★ルーム: 自分の回答を渡し、全員分がまとめて判定されるのを待つ
+            if st.session_state.get('room_result_round') != st.session_state.round_id:
+                room.submit(st.session_state.player_id, st.session_state.round_id, st.session_state.answers)
+                results = room.results(st.session_state.round_id)
+                if results is None:
+                    st.info("⏳ ほかのプレイヤーの回答を待っています...")
+                    st_autorefresh(interval=1000, limit=None, key=f"room_wait_{st.session_state.round_id}")
+                    return
+                st.session_state.eval_result = results.get(st.session_state.player_id) or {
+                    "score": 0, "results": [], "comment": "締め切りに間に合わなかったため判定されませんでした。"}
+                st.session_state.room_result_round = st.session_state.round_id
+                st.session_state.last_q = st.session_state.current_question['question']
+                bomb_timer.record_round(st.session_state.get('round_reruns', 0))
+        elif 'eval_result' not in st.session_state or st.session_state.get('last_q') != st.session_state.current_question['question']:
+            # 入力中に判定が済んでいれば待たずに表示できる
             with st.spinner("AI判定中..."):
-                res = logic.evaluate_answers(api_key, st.session_state.current_question['question'], st.session_state.answers)
+                res = st.session_state.round_judge.collect(st.session_state.answers)
                 st.session_state.eval_result = res
                 st.session_state.last_q = st.session_state.current_question['question']
+                bomb_timer.record_round(st.session_state.get('round_reruns', 0))
 
         res = st.session_state.eval_result
         if res:
@@ -354,23 +602,41 @@ def main():
                 # これにより、次にスライダーを動かしても if not ... の条件に引っかかり、音は鳴らない
                 st.session_state.result_sound_played = True    
 
+        if room is not None:
+            st.markdown("### 🏆 ランキング")
+            show_leaderboard(room)
+
         st.markdown("---")
         st.subheader("🎓 AIを育てる")
         if not st.session_state.feedback_submitted:
             rating = st.slider("評価", 1, 5, 3, key="rating_slider")
             if st.button("評価を送信"):
-                logic.save_feedback(st.session_state.current_question['question'], st.session_state.current_question['example_answers'], rating)
+                logic.save_feedback(
+                    st.session_state.current_question['question'],
+                    st.session_state.current_question['example_answers'],
+                    rating,
+                    st.session_state.game_settings["genre"],
+                    st.session_state.game_settings["difficulty"],
+                    st.session_state.current_question.get('model'))
                 st.session_state.feedback_submitted = True
-                st.success("学習しました！")
-                time.sleep(1)
                 st.rerun()
         else:
-            st.success("✅ 送信済み")
+            st.success("✅ 学習しました！（送信済み）")
 
         if st.button("次の問題へ"):
-            st.session_state.page = 'start'
+            st.session_state.page = 'lobby' if room is not None else 'start'
             st.rerun()
         
 if __name__ == "__main__":
 
-    main()        
+    # ★画面ごとの1回分の描画時間を記録する
+    # PROFILE_MODE=true のときは、CPU とメモリのプロファイルも profiles/ に書き出す。
+    # ?profile=1 で1つのセッションだけ計測できるのは PROFILE_ALLOW_QUERY=true のときだけ（誰でも重くできないように）
+    page = st.session_state.get('page', 'start')
+    profiling = (logic.get_bool_setting("PROFILE_MODE")
+                 or (st.query_params.get("profile") == "1" and logic.get_bool_setting("PROFILE_ALLOW_QUERY")))
+    try:
+        with metrics.span(f"render.{page}"), (profiler.profile_run(page) if profiling else nullcontext()):
+            main()
+    finally:
+        metrics.registry.export()        
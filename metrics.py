@@ -0,0 +1,165 @@
+#処理時間・サイズの計測と書き出し
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# --- 設定 ---
+METRICS_DIR = "metrics"
+EXPORT_INTERVAL = 10.0  # ファイルへ書き出す最短間隔（秒）
+# ヒストグラムの区切り
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# st.rerun() / st.stop() は例外で抜けるが、エラーではないので数えない
+_CONTROL_FLOW = ("RerunException", "StopException")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """区切りの上端で近似した分位点"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "avg": (self.total / self.count) if self.count else 0.0,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+        }
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = {}     # name -> Histogram（秒）
+        self.sizes = {}         # name -> Histogram（バイト）
+        self.counters = {}      # name -> 回数（エラー・リトライなど）
+        self._last_export = 0.0
+
+    def observe_duration(self, name, seconds):
+        with self._lock:
+            self.durations.setdefault(name, Histogram(SECONDS_BUCKETS)).observe(seconds)
+
+    def observe_size(self, name, size):
+        with self._lock:
+            self.sizes.setdefault(name, Histogram(BYTES_BUCKETS)).observe(size)
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "durations": {k: h.snapshot() for k, h in sorted(self.durations.items())},
+                "sizes": {k: h.snapshot() for k, h in sorted(self.sizes.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            for metric, table in (("quiz_span_seconds", self.durations), ("quiz_payload_bytes", self.sizes)):
+                lines.append(f"# TYPE {metric} histogram")
+                for name, h in sorted(table.items()):
+                    cumulative = 0
+                    for bound, n in zip(h.buckets, h.counts):
+                        cumulative += n
+                        lines.append(f'{metric}_bucket{{name="{name}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_bucket{{name="{name}",le="+Inf"}} {h.count}')
+                    lines.append(f'{metric}_sum{{name="{name}"}} {h.total}')
+                    lines.append(f'{metric}_count{{name="{name}"}} {h.count}')
+            lines.append("# TYPE quiz_events_total counter")
+            for name, n in sorted(self.counters.items()):
+                lines.append(f'quiz_events_total{{name="{name}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, directory=METRICS_DIR, force=False):
+        """metrics.prom と metrics.json を書き出す。前回から EXPORT_INTERVAL 経っていなければ何もしない"""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_export < EXPORT_INTERVAL:
+                return False
+            self._last_export = now
+        os.makedirs(directory, exist_ok=True)
+        for name, text in (("metrics.prom", self.to_prometheus()),
+                           ("metrics.json", json.dumps(self.snapshot(), ensure_ascii=False, indent=2))):
+            tmp = os.path.join(directory, name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, os.path.join(directory, name))
+        return True
+
+
+registry = Registry()
+
+
+@contextmanager
+def span(name):
+    """with metrics.span("名前"): で囲んだ処理の時間を記録する"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if type(e).__name__ not in _CONTROL_FLOW:
+            registry.inc(f"{name}.errors")
+        raise
+    finally:
+        registry.observe_duration(name, time.perf_counter() - started)
+
+
+def traced(name):
+    """関数の実行時間を記録するデコレータ"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_retry(name):
+    """tenacity の before_sleep に渡して、リトライ回数を数える"""
+    def hook(retry_state):
+        registry.inc(f"{name}.retries")
+    return hook
+
+
+def observe_size(name, size):
+    registry.observe_size(name, size)
+
+
+def inc(name, n=1):
+    registry.inc(name, n)
@@ -0,0 +1,171 @@
+#用途ごとのモデルの選び分け（直近の応答時間・エラー率・お題の評価で決める）
+import random
+import threading
+import time
+from collections import deque
+
+import metrics
+
+# --- 設定 ---
+TASKS = ("generate", "judge")
+# 用途ごとの候補（品質の高い順。最後のものを一番速い段として使う）
+DEFAULT_MODELS = {
+    "generate": ("gemini-2.5-flash", "gemini-2.5-flash-lite"),
+    "judge": ("gemini-2.5-flash", "gemini-2.5-flash-lite"),
+}
+# 用途ごとの応答時間の目標（p95 の秒数）
+DEFAULT_SLO_SEC = {"generate": 8.0, "judge": 4.0}
+WINDOW = 50                 # 直近何回分の呼び出しで判断するか
+MIN_SAMPLES = 5             # これより少ない間は様子見として目標を満たしている扱いにする
+MAX_ERROR_RATE = 0.2        # これを超えたモデルは候補から外す
+EXPLORE_RATE = 0.05         # たまに他の候補も使って、評価・時間のデータを集める
+PROBE_AFTER_SEC = 60        # エラーで外したモデルも、最後の呼び出しからこれだけ経ったらまた試す
+RATING_PRIOR = (3.0, 5)     # 評価の事前値（平均, 件数）。件数の少ないモデルが極端な値にならないように
+RATING_TTL_SEC = 60         # 評価の集計を読み直す間隔
+
+
+class _ModelStats:
+    """1つのモデルの直近 WINDOW 回分の (秒数, 成功したか)"""
+
+    def __init__(self):
+        self.calls = deque(maxlen=WINDOW)
+        self.total = 0
+        self.last_at = 0.0
+
+    def record(self, seconds, ok):
+        self.calls.append((seconds, ok))
+        self.total += 1
+        self.last_at = time.monotonic()
+
+    def healthy(self):
+        if len(self.calls) < MIN_SAMPLES or self.error_rate() <= MAX_ERROR_RATE:
+            return True
+        # 外したままだと回復に気付けないので、しばらく呼んでいなければもう一度試す
+        return time.monotonic() - self.last_at > PROBE_AFTER_SEC
+
+    def error_rate(self):
+        return sum(not ok for _, ok in self.calls) / len(self.calls) if self.calls else 0.0
+
+    def quantile(self, q):
+        latencies = sorted(s for s, ok in self.calls if ok)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+class ModelRouter:
+    """
+    用途（generate / judge）ごとに、候補のモデルから1つ選ぶ。
+    - エラーが多いモデルは外す
+    - 残りの中で、お題生成はプレイヤーの評価の平均が高いもの、判定は候補の並び順で上のもの
+    - 選んだモデルの直近 p95 が目標を超えていたら、一番速い段（候補の最後）に切り替える
+    ratings は {モデル: (件数, 平均評価)} を返す関数（履歴ストアの集計）。
+    """
+
+    def __init__(self, models=None, slo_sec=None, ratings=None):
+        self.models = {task: tuple(models.get(task, DEFAULT_MODELS[task]) if models else DEFAULT_MODELS[task])
+                       for task in TASKS}
+        self.slo_sec = dict(DEFAULT_SLO_SEC, **(slo_sec or {}))
+        self._ratings_source = ratings
+        self._ratings = {}
+        self._ratings_at = 0.0
+        self._lock = threading.Lock()
+        self._stats = {(task, m): _ModelStats() for task in TASKS for m in self.models[task]}
+        self._decisions = {}    # (用途, モデル, 理由) -> 回数
+
+    def _ratings_now(self):
+        if self._ratings_source is None:
+            return {}
+        if time.monotonic() - self._ratings_at > RATING_TTL_SEC:
+            try:
+                self._ratings = self._ratings_source()
+            except Exception as e:
+                print(f"モデル別の評価を読めませんでした: {e}")
+            self._ratings_at = time.monotonic()
+        return self._ratings
+
+    def _rating(self, model):
+        count, avg = self._ratings_now().get(model, (0, 0.0))
+        prior_avg, prior_count = RATING_PRIOR
+        return (prior_avg * prior_count + avg * count) / (prior_count + count)
+
+    def _meets_slo(self, task, stats):
+        return len(stats.calls) < MIN_SAMPLES or stats.quantile(0.95) <= self.slo_sec[task]
+
+    def pick(self, task, exclude=()):
+        """使うモデル名を返す。exclude のモデル（回路が開いているもの等）は選ばない。候補が無ければ None"""
+        models = [m for m in self.models[task] if m not in exclude]
+        if not models:
+            return None
+        with self._lock:
+            healthy = [m for m in models if self._stats[(task, m)].healthy()]
+            candidates = healthy or list(models)
+            if len(candidates) > 1 and random.random() < EXPLORE_RATE:
+                model, reason = random.choice(candidates), "explore"
+            else:
+                if task == "generate":
+                    model = max(candidates, key=lambda m: (self._rating(m), -models.index(m)))
+                    reason = "rating"
+                else:
+                    model, reason = candidates[0], "preferred"
+                if not healthy:
+                    reason = "all_unhealthy"
+                # ★目標の応答時間を守れていないときは、一番速い段に落とす
+                fast = candidates[-1]
+                if model != fast and not self._meets_slo(task, self._stats[(task, model)]):
+                    model, reason = fast, "slo_fallback"
+            key = (task, model, reason)
+            self._decisions[key] = self._decisions.get(key, 0) + 1
+        metrics.inc(f"router.{task}.{reason}")
+        return model
+
+    def record(self, task, model, seconds, ok=True):
+        """呼び出し1回分の結果を記録する（候補にないモデルは無視）"""
+        with self._lock:
+            stats = self._stats.get((task, model))
+            if stats is None:
+                return
+            stats.record(seconds, ok)
+        if ok:
+            metrics.registry.observe_duration(f"llm.{task}.{model}", seconds)
+        else:
+            metrics.inc(f"llm.{task}.{model}.errors")
+
+    def stats(self):
+        with self._lock:
+            report = {}
+            for task in TASKS:
+                report[task] = {"slo_p95_sec": self.slo_sec[task], "models": {}}
+                for m in self.models[task]:
+                    s = self._stats[(task, m)]
+                    report[task]["models"][m] = {
+                        "calls": s.total,
+                        "window": len(s.calls),
+                        "error_rate": s.error_rate(),
+                        "p50": s.quantile(0.5),
+                        "p95": s.quantile(0.95),
+                        "meets_slo": self._meets_slo(task, s),
+                        "decisions": {r: n for (t, mm, r), n in self._decisions.items() if t == task and mm == m},
+                    }
+                    if task == "generate":
+                        count, avg = self._ratings.get(m, (0, 0.0))
+                        report[task]["models"][m].update({"ratings": count, "avg_rating": avg})
+            return report
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router(models=None, slo_sec=None, ratings=None):
+    """プロセス全体で1つのルーター（最初の呼び出しの設定で作られる）"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter(models, slo_sec, ratings)
+        return _router
+
+
+def router_stats():
+    with _router_lock:
+        return _router.stats() if _router is not None else {}
@@ -0,0 +1,89 @@
+#MP3の再生時間をフレームヘッダから求める
+import os
+import threading
+
+# ビットレート表 (kbps): [MPEG1/MPEG2系][レイヤー] -> index
+_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],   # MPEG1
+    2: [22050, 24000, 16000],   # MPEG2
+    0: [11025, 12000, 8000],    # MPEG2.5
+}
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _parse_header(b0, b1, b2, b3):
+    """フレームヘッダ4バイトを (フレーム長, サンプル数, サンプルレート) にする。不正なら None"""
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version_bits = (b1 >> 3) & 0x03
+    layer_bits = (b1 >> 1) & 0x03
+    bitrate_idx = (b2 >> 4) & 0x0F
+    rate_idx = (b2 >> 2) & 0x03
+    padding = (b2 >> 1) & 0x01
+    if version_bits == 1 or layer_bits == 0 or bitrate_idx in (0, 15) or rate_idx == 3:
+        return None
+
+    layer = 4 - layer_bits
+    family = 1 if version_bits == 3 else 2
+    bitrate = _BITRATES[(family, layer)][bitrate_idx] * 1000
+    sample_rate = _SAMPLE_RATES[version_bits][rate_idx]
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or family == 1) else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return length, samples, sample_rate
+
+
+def _skip_id3(data):
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        return 10 + size
+    return 0
+
+
+def mp3_duration(data):
+    """MP3データの再生時間（秒）。フレームを一つずつたどって合計する"""
+    pos = _skip_id3(data)
+    total = 0.0
+    end = len(data) - 4
+    while pos <= end:
+        header = _parse_header(data[pos], data[pos + 1], data[pos + 2], data[pos + 3])
+        if header is None or header[0] <= 0:
+            # 同期が外れたら次のフレーム先頭を探す
+            pos += 1
+            continue
+        length, samples, sample_rate = header
+        total += samples / sample_rate
+        pos += length
+    return total
+
+
+def file_duration(path, default=3.0):
+    """ファイルの再生時間（秒）。読めなければ default を返す。結果はパスと更新日時で覚えておく"""
+    try:
+        key = (path, os.path.getmtime(path))
+        with _cache_lock:
+            if key in _cache:
+                return _cache[key]
+        with open(path, "rb") as f:
+            duration = mp3_duration(f.read())
+    except OSError:
+        return default
+    if duration <= 0:
+        return default
+    with _cache_lock:
+        _cache[key] = duration
+    return duration
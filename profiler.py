@@ -0,0 +1,226 @@
+#再実行ごとの CPU・メモリのプロファイル（PROFILE_MODE=true か、PROFILE_ALLOW_QUERY=true で ?profile=1 のときだけ動かす）
+#
+# 1回の main() ごとに profiles/<画面>/ に次のファイルを書き出す（1画面 MAX_RUNS_PER_PAGE 回分まで。古いものから消す）:
+#   <時刻>.json    … 実時間・CPU時間・よく出た関数・確保したメモリの上位
+#   <時刻>.folded  … スタックの畳み込み形式（flamegraph.pl や speedscope でそのまま開ける）
+#   summary.json   … その画面の累計（リリース間の比較に使う）
+#
+# 2つのリリースの累計を比べる:
+#   python profiler.py diff profiles_old profiles_new
+import argparse
+import collections
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# --- 設定 ---
+PROFILE_DIR = "profiles"
+SAMPLE_INTERVAL = 0.002     # スタックを覗く間隔（秒）
+TOP_FUNCTIONS = 30          # レポートに載せる関数の数
+TOP_ALLOCATIONS = 25        # レポートに載せるメモリ確保の行数
+TRACEMALLOC_FRAMES = 1      # 確保した場所として覚えるフレーム数
+MAX_RUNS_PER_PAGE = 200     # 画面ごとに残す1回分のファイルの数（summary.json は累計なので残る）
+
+_lock = threading.Lock()
+_tracing_runs = 0           # tracemalloc を使っている実行中のプロファイルの数
+_summaries = {}             # 画面 -> 累計
+
+
+class SamplingProfiler:
+    """指定したスレッドのスタックを一定間隔で覗いて、関数ごとの出現回数を数える"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()     # "a.py:f;b.py:g" -> 回数
+        self.leaves = collections.Counter()     # 一番内側の "b.py:g:行" -> 回数
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            leaf = f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}:{frame.f_lineno}"
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.leaves[leaf] += 1
+            self.samples += 1
+
+    def functions(self):
+        """関数ごとの (そこで止まっていた回数, スタックに含まれていた回数)"""
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, n in self.stacks.items():
+            names = stack.split(";")
+            own[names[-1]] += n
+            for name in set(names):
+                total[name] += n
+        return own, total
+
+
+def _start_tracing():
+    global _tracing_runs
+    with _lock:
+        if _tracing_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        _tracing_runs += 1
+    tracemalloc.reset_peak()
+
+
+def _stop_tracing():
+    global _tracing_runs
+    with _lock:
+        _tracing_runs -= 1
+        if _tracing_runs == 0:
+            tracemalloc.stop()
+
+
+def _top_allocations(snapshot):
+    """実行中に確保されて、まだ残っているメモリの多い行"""
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    return [{"where": f"{os.path.relpath(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+             "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]]
+
+
+@contextmanager
+def profile_run(page, directory=PROFILE_DIR):
+    """with の中（main() 1回分）を計測して、画面ごとのディレクトリに書き出す"""
+    sampler = SamplingProfiler(threading.get_ident())
+    _start_tracing()
+    started_wall = time.perf_counter()
+    started_cpu = time.thread_time()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        wall = time.perf_counter() - started_wall
+        cpu = time.thread_time() - started_cpu
+        current, peak = tracemalloc.get_traced_memory()
+        allocations = _top_allocations(tracemalloc.take_snapshot())
+        _stop_tracing()
+        try:
+            _write(page, directory, sampler, wall, cpu, current, peak, allocations)
+        except OSError as e:
+            print(f"プロファイル書き出しエラー: {e}")
+
+
+def _write(page, directory, sampler, wall, cpu, current, peak, allocations):
+    own, total = sampler.functions()
+    samples = max(1, sampler.samples)
+    report = {
+        "page": page,
+        "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+        "wall_sec": wall,
+        "cpu_sec": cpu,
+        "samples": sampler.samples,
+        "sample_interval": sampler.interval,
+        "top_self": [{"function": f, "share": n / samples} for f, n in own.most_common(TOP_FUNCTIONS)],
+        "top_total": [{"function": f, "share": n / samples} for f, n in total.most_common(TOP_FUNCTIONS)],
+        "top_lines": [{"line": f, "share": n / samples} for f, n in sampler.leaves.most_common(TOP_FUNCTIONS)],
+        "memory": {"retained_kb": round(current / 1024, 1), "peak_kb": round(peak / 1024, 1),
+                   "top_allocations": allocations},
+    }
+
+    page_dir = os.path.join(directory, page)
+    os.makedirs(page_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    with open(os.path.join(page_dir, f"{stamp}.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(page_dir, f"{stamp}.folded"), "w", encoding="utf-8") as f:
+        f.writelines(f"{stack} {n}\n" for stack, n in sampler.stacks.items())
+    _rotate(page_dir)
+
+    with _lock:
+        summary = _summaries.setdefault(page, {"runs": 0, "wall_sec": 0.0, "cpu_sec": 0.0, "peak_kb": 0.0,
+                                               "samples": 0, "self": collections.Counter()})
+        summary["runs"] += 1
+        summary["wall_sec"] += wall
+        summary["cpu_sec"] += cpu
+        summary["peak_kb"] = max(summary["peak_kb"], peak / 1024)
+        summary["samples"] += sampler.samples
+        summary["self"].update(own)
+        data = _summary_json(summary)
+    tmp = os.path.join(page_dir, "summary.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(page_dir, "summary.json"))
+
+
+def _rotate(page_dir, keep=MAX_RUNS_PER_PAGE):
+    """1回分のファイルが keep 回分を超えたら、古いものから消す（ファイル名は時刻なので名前順が古い順）"""
+    stamps = sorted(name[:-len(".json")] for name in os.listdir(page_dir)
+                    if name.endswith(".json") and name != "summary.json")
+    for stamp in stamps[:max(0, len(stamps) - keep)]:
+        for ext in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(page_dir, stamp + ext))
+            except FileNotFoundError:
+                pass # 別のプロセスが先に消した
+
+
+def _summary_json(summary):
+    runs, samples = summary["runs"], max(1, summary["samples"])
+    return {
+        "runs": runs,
+        "avg_wall_sec": summary["wall_sec"] / runs,
+        "avg_cpu_sec": summary["cpu_sec"] / runs,
+        "max_peak_kb": round(summary["peak_kb"], 1),
+        "self_share": {f: n / samples for f, n in summary["self"].most_common(TOP_FUNCTIONS)},
+    }
+
+
+def stats():
+    with _lock:
+        return {page: {k: v for k, v in _summary_json(s).items() if k != "self_share"}
+                for page, s in _summaries.items()}
+
+
+def diff(old_dir, new_dir):
+    """2つの profiles ディレクトリの summary.json を画面ごとに比べて表示する"""
+    for page in sorted(set(os.listdir(old_dir)) & set(os.listdir(new_dir))):
+        paths = [os.path.join(d, page, "summary.json") for d in (old_dir, new_dir)]
+        if not all(os.path.exists(p) for p in paths):
+            continue
+        old, new = (json.load(open(p, encoding="utf-8")) for p in paths)
+        print(f"== {page} (runs {old['runs']} -> {new['runs']})")
+        for key in ("avg_wall_sec", "avg_cpu_sec", "max_peak_kb"):
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            print(f"  {key:14s} {old[key]:10.4f} -> {new[key]:10.4f} ({change:+.1f}%)")
+        functions = set(old["self_share"]) | set(new["self_share"])
+        moved = sorted(functions, key=lambda f: -abs(new["self_share"].get(f, 0) - old["self_share"].get(f, 0)))
+        for f in moved[:10]:
+            a, b = old["self_share"].get(f, 0), new["self_share"].get(f, 0)
+            print(f"  {f:50s} {a * 100:5.1f}% -> {b * 100:5.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="プロファイルの比較")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_diff = sub.add_parser("diff", help="2つの profiles ディレクトリを比べる")
+    p_diff.add_argument("old")
+    p_diff.add_argument("new")
+    args = parser.parse_args()
+    diff(args.old, args.new)
@@ -0,0 +1,49 @@
+#保存済みのお題から出題する（AIを呼ばないので待ち時間なし）
+import threading
+
+import history_store
+import local_llm
+import logic
+
+# --- 設定 ---
+MIN_RATING = 4          # この評価以上のお題だけを出す
+ANY_GENRE = "ノンジャンル"
+
+_stats_lock = threading.Lock()
+_stats = {"served": 0, "exhausted": 0}
+
+
+def draw(genre, difficulty, seen_questions):
+    """
+    まだ見ていない高評価のお題を1つ選び、プールと同じ形のエントリで返す。
+    条件に合うものを出し尽くしていたら None（呼び出し側で AI 生成に切り替える）
+    """
+    store = history_store.get_history_store()
+    ratings = tuple(range(MIN_RATING, 6))
+    if genre == ANY_GENRE:
+        # ノンジャンルは難易度が合うものを優先し、無ければ未分類のものも含めて選ぶ
+        entry = (store.sample_unseen(ratings, difficulty=difficulty, exclude=seen_questions)
+                 or store.sample_unseen(ratings, exclude=seen_questions))
+    else:
+        entry = store.sample_unseen(ratings, genre=genre, difficulty=difficulty, exclude=seen_questions)
+    if entry is None:
+        with _stats_lock:
+            _stats["exhausted"] += 1
+        return None
+
+    answers = entry["examples"][:5]
+    q_data = {
+        "question": entry["question"],
+        "example_answers": answers,
+        "hints": local_llm.make_hints(answers),
+        "bank_id": entry["id"],
+    }
+    with _stats_lock:
+        _stats["served"] += 1
+    # 同じお題の音声はキャッシュにあるので、2回目以降はすぐ返る
+    return {"question_data": q_data, "voice_file": logic.generate_voice(q_data["question"])}
+
+
+def bank_stats():
+    with _stats_lock:
+        return dict(_stats)
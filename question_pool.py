@@ -0,0 +1,156 @@
+#お題の先読みプール
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+import logic
+
+# --- 設定 ---
+POOL_DEPTH = 2          # (ジャンル, 難易度) ごとに常に用意しておくお題の数
+RETRY_INTERVAL = 5.0    # 生成に失敗したときに次を試すまでの待ち時間（秒）
+BATCH_SIZE = 2          # 補充するときに1回のリクエストでまとめて作るお題の数
+
+# お題の文章が届いた時点で読み上げ音声を作り始めるためのスレッド
+_voice_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="question-voice")
+
+
+def prepare_question(api_key, genre, difficulty, on_question=None):
+    """
+    お題を生成し、読み上げ音声まで作った状態のエントリを返す。
+    音声は正解例・ヒントの生成を待たずに作り始める（on_question も同じタイミングで呼ぶ）
+    """
+    voice = {}
+
+    def start_voice(question):
+        # 音声は文章ごとのキャッシュファイルなので、セッション同士で上書きし合わない
+        # 出来上がったお題は前後の空白を外してあるので、同じ文章で引けるよう揃える
+        question = question.strip()
+        voice[question] = _voice_executor.submit(logic.generate_voice, question)
+        if on_question:
+            on_question(question)
+
+    q_data = logic.get_ai_question(api_key, genre, difficulty, on_question=start_voice)
+    if not q_data:
+        return None
+
+    future = voice.get(q_data["question"])
+    voice_file = future.result() if future else logic.generate_voice(q_data["question"])
+    return {"question_data": q_data, "voice_file": voice_file}
+
+
+def prepare_questions(api_key, genre, difficulty, n):
+    """お題を n 個まとめて生成し、読み上げ音声は並行して作る。作れた分だけのエントリのリストを返す"""
+    if n <= 1:
+        entry = prepare_question(api_key, genre, difficulty)
+        return [entry] if entry else []
+    q_list = logic.get_ai_questions(api_key, n, genre, difficulty)
+    voices = [_voice_executor.submit(logic.generate_voice, q["question"]) for q in q_list]
+    return [{"question_data": q, "voice_file": v.result()} for q, v in zip(q_list, voices)]
+
+
+class QuestionPool:
+    """
+    (ジャンル, 難易度) ごとに準備済みのお題をためておくプール。
+    バックグラウンドのワーカーが depth 個になるまで補充し続ける。
+    """
+
+    def __init__(self, api_key, depth=POOL_DEPTH, producer=None, batch_size=BATCH_SIZE):
+        self.api_key = api_key
+        self.depth = depth
+        self.batch_size = batch_size
+        # テスト用に差し替え可能（引数: genre, difficulty, 個数。エントリのリストを返す）
+        self._producer = producer or (lambda g, d, n: prepare_questions(self.api_key, g, d, n))
+        self._queues = {}
+        self._cond = threading.Condition()
+        self._retry_at = {}
+        self.hits = 0
+        self.misses = 0
+        self.produced = 0
+        self.failures = 0
+
+        self._worker = threading.Thread(target=self._run, name="question-pool", daemon=True)
+        self._worker.start()
+
+    def warm(self, genre, difficulty):
+        """このキーの補充を始めてもらう（スタート画面で設定を選んだ時点で呼ぶ）"""
+        with self._cond:
+            if (genre, difficulty) not in self._queues:
+                self._queues[(genre, difficulty)] = deque()
+                self._cond.notify_all()
+
+    def pop(self, genre, difficulty):
+        """準備済みのお題を1つ取り出す。空なら None（呼び出し側で同期生成する）"""
+        key = (genre, difficulty)
+        with self._cond:
+            queue = self._queues.setdefault(key, deque())
+            if queue:
+                self.hits += 1
+                entry = queue.popleft()
+            else:
+                self.misses += 1
+                entry = None
+            # 取り出した分をすぐに補充させる
+            self._cond.notify_all()
+        return entry
+
+    def stats(self):
+        with self._cond:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "produced": self.produced,
+                "failures": self.failures,
+                "depth": self.depth,
+                "batch_size": self.batch_size,
+                "ready": {f"{g}/{d}": len(q) for (g, d), q in self._queues.items()},
+            }
+
+    def _next_key(self):
+        """補充が必要なキーのうち、一番在庫が少ないものを選び (キー, 足りない数) を返す"""
+        now = time.time()
+        candidates = [
+            (len(q), key) for key, q in self._queues.items()
+            if len(q) < self.depth and self._retry_at.get(key, 0) <= now
+        ]
+        if not candidates:
+            return None
+        size, key = min(candidates)
+        return key, min(self.batch_size, self.depth - size)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                task = self._next_key()
+                while task is None:
+                    self._cond.wait(timeout=RETRY_INTERVAL)
+                    task = self._next_key()
+            key, count = task
+
+            # 生成は時間がかかるのでロックの外で行う
+            try:
+                entries = self._producer(*key, count)
+            except Exception as e:
+                print(f"QuestionPool: 生成エラー {key}: {e}")
+                entries = []
+
+            with self._cond:
+                if entries:
+                    self._queues[key].extend(entries)
+                    self.produced += len(entries)
+                    self._retry_at.pop(key, None)
+                else:
+                    self.failures += 1
+                    self._retry_at[key] = time.time() + RETRY_INTERVAL
+
+
+@st.cache_resource
+def get_question_pool(api_key):
+    """プロセス全体で1つだけのプールを返す（全セッションで共有）"""
+    depth = int(logic.get_setting("QUESTION_POOL_DEPTH", POOL_DEPTH))
+    batch_size = int(logic.get_setting("QUESTION_BATCH_SIZE", BATCH_SIZE))
+    return QuestionPool(api_key, depth=depth, batch_size=batch_size)
@@ -0,0 +1,227 @@
+#みんなで遊ぶルーム（お題・読み上げ音声・判定をルーム全員で1回分にまとめる）
+import random
+import threading
+import time
+import uuid
+
+import streamlit as st
+
+import answer_judge
+import mp3_info
+
+# --- 設定 ---
+CODE_CHARS = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"  # 見間違えやすい文字(0, O, 1, I)は使わない
+CODE_LENGTH = 4
+START_LEAD_SEC = 2.0    # ラウンド開始を全員が受け取るまでの余裕（ロビーの更新間隔より長く）
+JUDGE_GRACE_SEC = 5.0   # 制限時間が過ぎてから、遅れた回答を待つ時間
+ROOM_TTL_SEC = 3600     # 誰も触らなくなったルームを片付けるまでの時間
+JUDGE_ATTEMPTS = 3      # 判定が失敗したときに試す回数（使い切ったら「判定できませんでした」で締める）
+
+
+class Room:
+    """
+    1つのルームの状態。お題と音声はホストがラウンドを始めたときに1回だけ用意し、
+    全員に同じ開始時刻を配る。判定は全員の回答が揃ってから1回のAI呼び出しで行う。
+    """
+
+    def __init__(self, code, api_key, host_id, host_name, settings):
+        self.code = code
+        self.api_key = api_key
+        self.host_id = host_id
+        self.settings = dict(settings)
+        self.players = {host_id: host_name}   # 参加順
+        self.totals = {host_id: 0}            # 累計スコア
+        self.round = None
+        self.round_no = 0
+        self._submissions = {}
+        self._results = None
+        self._judging = False
+        self._judge_failures = 0
+        self._lock = threading.Lock()
+        self.touched = time.time()
+
+    def join(self, player_id, name):
+        with self._lock:
+            self.players[player_id] = name
+            self.totals.setdefault(player_id, 0)
+            self.touched = time.time()
+
+    def start_round(self, entry):
+        """用意済みのお題（プールのエントリと同じ形）でラウンドを始める"""
+        q_data = entry["question_data"]
+        duration = 0.0
+        if entry["voice_file"]:
+            duration = mp3_info.file_duration(entry["voice_file"], default=len(q_data["question"]) * 0.25 + 1.0)
+        read_at = time.time() + START_LEAD_SEC
+        with self._lock:
+            self.round_no += 1
+            self.round = {
+                "no": self.round_no,
+                "round_id": uuid.uuid4().hex,
+                "question_data": q_data,
+                "voice_file": entry["voice_file"],
+                "speech_duration": duration,
+                "read_at": read_at,                        # 全員がこの時刻に読み上げを始める
+                "start_at": read_at + 0.5 + duration,      # 全員がこの時刻に回答を始める
+                "time_limit": self.settings["time_limit"],
+                "genre": self.settings["genre"],
+                "difficulty": self.settings["difficulty"],
+                "players": list(self.players),             # 開始時点の参加者（この人数の回答を待つ）
+            }
+            self._submissions = {}
+            self._results = None
+            self._judging = False
+            self._judge_failures = 0
+            self.touched = time.time()
+            _count(rounds=1, player_rounds=len(self.players))
+        return self.round
+
+    def submit(self, player_id, round_id, answers):
+        """プレイヤーの回答（最大5つ）を受け取る。違うラウンドのものは捨てる"""
+        with self._lock:
+            if self.round and self.round["round_id"] == round_id and player_id not in self._submissions:
+                self._submissions[player_id] = list(answers)
+                self.touched = time.time()
+
+    def results(self, round_id):
+        """
+        判定結果 {player_id: 結果} を返す。まだなら None。
+        全員の回答が揃うか締め切りを過ぎたら、最初に呼んだ人のスレッドで判定する
+        """
+        with self._lock:
+            if not self.round or self.round["round_id"] != round_id:
+                return None
+            if self._results is not None or self._judging:
+                return self._results
+            deadline = self.round["start_at"] + self.round["time_limit"] + JUDGE_GRACE_SEC
+            waiting = [pid for pid in self.round["players"] if pid not in self._submissions]
+            if waiting and time.time() < deadline:
+                return None
+            self._judging = True
+            rnd, submissions = self.round, dict(self._submissions)
+
+        try:
+            results = self._judge(rnd, submissions)
+        except Exception as e:
+            print(f"ルーム {self.code} の判定エラー: {e}")
+            with self._lock:
+                if self.round is not rnd:
+                    return None
+                # ★判定中のまま残すと誰も結果を受け取れないので、次に呼んだ人がやり直せるようにする
+                self._judging = False
+                self._judge_failures += 1
+                if self._judge_failures < JUDGE_ATTEMPTS:
+                    return None
+            results = self._unjudged(submissions)
+        with self._lock:
+            if self.round is rnd:
+                self._results = results
+                for pid, res in results.items():
+                    self.totals[pid] = self.totals.get(pid, 0) + res["score"]
+            return results
+
+    def _judge(self, rnd, submissions):
+        """全員の回答から重複を除いた一覧を1回でまとめて判定し、各プレイヤーの結果に配り直す"""
+        q_data = rnd["question_data"]
+        judge = answer_judge.RoundJudge(self.api_key, q_data["question"], q_data["example_answers"], mode="batch")
+        unique = {}
+        for answers in submissions.values():
+            for a in answers:
+                unique.setdefault(answer_judge.normalize_answer(a), a)
+        judged = judge.collect(list(unique.values()))
+        verdicts = {answer_judge.normalize_answer(v["answer"]): v for v in judged["results"]}
+
+        results = {}
+        for pid, answers in submissions.items():
+            items, seen = [], set()
+            for a in answers:
+                key = answer_judge.normalize_answer(a)
+                v = verdicts.get(key, {"is_correct": False, "reason": "判定できませんでした"})
+                if key in seen and v["is_correct"]:
+                    v = {"is_correct": False, "reason": "同じ回答が重複しています"}
+                seen.add(key)
+                items.append({"answer": a, "is_correct": v["is_correct"], "reason": v["reason"]})
+            score = sum(1 for v in items if v["is_correct"])
+            results[pid] = {"score": score, "results": items, "comment": answer_judge.make_comment(score)}
+        return results
+
+    @staticmethod
+    def _unjudged(submissions):
+        """判定を諦めたときに配る結果（全員0点）"""
+        results = {}
+        for pid, answers in submissions.items():
+            items = [{"answer": a, "is_correct": False, "reason": "判定できませんでした"} for a in answers]
+            results[pid] = {"score": 0, "results": items, "comment": "判定できませんでした。もう一度遊んでみてください。"}
+        return results
+
+    def leaderboard(self):
+        """[(名前, 累計, 直近のスコア)] を累計の高い順に"""
+        with self._lock:
+            last = self._results or {}
+            rows = [(name, self.totals.get(pid, 0), last[pid]["score"] if pid in last else None)
+                    for pid, name in self.players.items()]
+        return sorted(rows, key=lambda r: -r[1])
+
+    def status(self):
+        with self._lock:
+            return {
+                "players": len(self.players),
+                "round_no": self.round_no,
+                "submitted": len(self._submissions),
+                "judged": self._results is not None,
+            }
+
+
+class RoomRegistry:
+    """プロセス全体のルーム一覧（全セッションで共有）"""
+
+    def __init__(self):
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def create(self, api_key, host_id, host_name, settings):
+        with self._lock:
+            self._expire()
+            code = "".join(random.choices(CODE_CHARS, k=CODE_LENGTH))
+            while code in self._rooms:
+                code = "".join(random.choices(CODE_CHARS, k=CODE_LENGTH))
+            room = Room(code, api_key, host_id, host_name, settings)
+            self._rooms[code] = room
+            return room
+
+    def get(self, code):
+        with self._lock:
+            return self._rooms.get((code or "").strip().upper())
+
+    def _expire(self):
+        now = time.time()
+        for code in [c for c, r in self._rooms.items() if now - r.touched > ROOM_TTL_SEC]:
+            del self._rooms[code]
+
+    def stats(self):
+        with self._lock:
+            rooms = len(self._rooms)
+        with _stats_lock:
+            rounds, player_rounds = _stats["rounds"], _stats["player_rounds"]
+        return {
+            "rooms": rooms,
+            "rounds": rounds,
+            "player_rounds": player_rounds,
+            # ルーム内では お題・音声・判定がそれぞれ1ラウンド1回なので、1人あたりの呼び出しはこの割合になる
+            "llm_calls_per_player_round": (rounds / player_rounds) if player_rounds else 0.0,
+        }
+
+
+_stats_lock = threading.Lock()
+_stats = {"rounds": 0, "player_rounds": 0}
+
+
+def _count(**counts):
+    with _stats_lock:
+        for name, n in counts.items():
+            _stats[name] += n
+
+
+@st.cache_resource
+def get_room_registry():
+    return RoomRegistry()
@@ -0,0 +1,109 @@
+#効果音のエンコード済みキャッシュ
+import base64
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+# --- 設定 ---
+# 起動時に読み込んでおく効果音
+EFFECT_SOUNDS = [
+    "メニューを開く5.mp3",
+    "爆発1.mp3",
+    "歓声と拍手.mp3",
+    "シャキーン3.mp3",
+    "間抜け7.mp3",
+]
+STATIC_SOUND_DIR = os.path.join("static", "sounds")
+STATIC_SOUND_URL = "app/static/sounds"
+MAX_DYNAMIC_ENTRIES = 64    # お題の読み上げ音声など、後から増える音声を覚えておく数
+
+
+class SoundRegistry:
+    """
+    音声ファイルを一度だけ読み込んで base64 にしたものをメモリに持っておく。
+    static_serving=True のときは効果音を Streamlit の静的ファイル配信に置き、
+    再生のたびに送るのは短いURLだけにする（ブラウザ側でもキャッシュされる）。
+    """
+
+    def __init__(self, static_serving=False, preload=EFFECT_SOUNDS):
+        self.static_serving = static_serving
+        self._lock = threading.Lock()
+        self._fixed = {}                # 効果音: path -> src
+        self._dynamic = OrderedDict()   # 読み上げ音声など: (path, mtime) -> src
+        self.plays = 0
+        self.bytes_sent = 0
+        self.bytes_inline = 0
+        for path in preload:
+            if os.path.exists(path):
+                self._fixed[path] = self._load(path, static=static_serving)
+
+    def _load(self, path, static):
+        with open(path, "rb") as f:
+            data = f.read()
+        if static:
+            # 日本語のファイル名をURLに載せないよう、中身のハッシュで名前を付ける
+            name = hashlib.sha1(data).hexdigest()[:16] + ".mp3"
+            os.makedirs(STATIC_SOUND_DIR, exist_ok=True)
+            dest = os.path.join(STATIC_SOUND_DIR, name)
+            if not os.path.exists(dest):
+                shutil.copyfile(path, dest)
+            return f"{STATIC_SOUND_URL}/{name}", len(data)
+        return "data:audio/mp3;base64," + base64.b64encode(data).decode(), len(data)
+
+    def src(self, path):
+        """<audio> に渡す src と、元のファイルサイズを返す"""
+        with self._lock:
+            if path in self._fixed:
+                return self._fixed[path]
+            key = (path, os.path.getmtime(path))
+            if key in self._dynamic:
+                self._dynamic.move_to_end(key)
+                return self._dynamic[key]
+
+        entry = self._load(path, static=False)
+        with self._lock:
+            self._dynamic[key] = entry
+            while len(self._dynamic) > MAX_DYNAMIC_ENTRIES:
+                self._dynamic.popitem(last=False)
+        return entry
+
+    def record(self, html_len, raw_len):
+        """1回の再生で実際に送った量と、毎回 base64 で埋め込んだ場合の量を記録する"""
+        with self._lock:
+            self.plays += 1
+            self.bytes_sent += html_len
+            # URL配信のときは、その分 base64 のデータ部分を送らずに済んでいる
+            self.bytes_inline += html_len + (4 * ((raw_len + 2) // 3) if raw_len else 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "static_serving": self.static_serving,
+                "plays": self.plays,
+                "bytes_sent": self.bytes_sent,
+                "bytes_inline": self.bytes_inline,
+                "bytes_saved": self.bytes_inline - self.bytes_sent,
+                "cached": len(self._fixed) + len(self._dynamic),
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_sound_registry(static_serving=False):
+    """プロセス全体で共有するレジストリを返す"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = SoundRegistry(static_serving=static_serving)
+        return _registry
+
+
+def registry_stats():
+    """まだレジストリが無ければ {}（ここで作ると、SOUND_STATIC_SERVING を見ないまま固定されてしまう）"""
+    with _registry_lock:
+        registry = _registry
+    return registry.stats() if registry is not None else {}
@@ -0,0 +1,101 @@
+#履歴のお題にジャンル・難易度を付けるツール
+#
+# 使い方:
+#   python tag_history.py              # キーワードで推定して quiz_history.db に書き込む
+#   python tag_history.py --write-json # quiz_history.json にも書き戻す
+#   python tag_history.py --llm        # Gemini に分類させる（環境変数 GEMINI_API_KEY が必要）
+#   python tag_history.py --dry-run    # 書き込まずに結果だけ表示
+import argparse
+import json
+import os
+
+import history_store
+
+GENRES = ["アニメ・漫画", "歴史・地理", "科学・IT", "グルメ・料理", "スポーツ", "国語・広辞苑"]
+DIFFICULTIES = ["初級", "中級", "上級"]
+
+# ジャンルごとの手がかりになる言葉
+GENRE_KEYWORDS = {
+    "アニメ・漫画": ["アニメ", "漫画", "マンガ", "ジブリ", "ポケモン", "ジャンプ", "キャラクター", "声優"],
+    "歴史・地理": ["都道府県", "県", "国", "首都", "世界遺産", "時代", "武将", "戦国", "旧国名", "山", "川", "島", "海", "歴史"],
+    "科学・IT": ["元素", "惑星", "星座", "プログラミング", "IT", "コンピュータ", "化学", "物理", "生物", "単位"],
+    "グルメ・料理": ["料理", "食べ", "野菜", "果物", "寿司", "ネタ", "パスタ", "調味料", "お菓子", "発酵", "味", "麺"],
+    "スポーツ": ["スポーツ", "野球", "サッカー", "オリンピック", "競技", "球技", "選手"],
+    "国語・広辞苑": ["広辞苑", "言葉", "慣用句", "ことわざ", "四字熟語", "漢字", "カタカナ", "文字", "読み", "英語"],
+}
+# 難しめのお題に出てくる言葉
+HARD_KEYWORDS = ["マニアック", "旧国名", "世界遺産", "元素", "行政区画", "五節句", "かつて", "正式名称"]
+
+
+def guess_tags(question):
+    """キーワードからジャンル・難易度を推定する"""
+    scores = {g: sum(question.count(k) for k in words) for g, words in GENRE_KEYWORDS.items()}
+    genre = max(scores, key=scores.get)
+    if scores[genre] == 0:
+        genre = "ノンジャンル"
+
+    if any(k in question for k in HARD_KEYWORDS) or len(question) > 50:
+        difficulty = "上級"
+    elif len(question) < 22:
+        difficulty = "初級"
+    else:
+        difficulty = "中級"
+    return genre, difficulty
+
+
+def llm_tags(api_key, questions):
+    """Gemini にまとめて分類させる。返り値は question -> (genre, difficulty)"""
+    from google import genai
+
+    client = genai.Client(api_key=api_key)
+    prompt = f"""
+    次のクイズのお題それぞれに、ジャンルと難易度を付けてください。
+    ジャンル: {GENRES + ["ノンジャンル"]} のどれか
+    難易度: {DIFFICULTIES} のどれか
+    お題リスト: {json.dumps(questions, ensure_ascii=False)}
+    以下のJSON形式のみで出力すること。
+    [{{"question": "お題", "genre": "ジャンル", "difficulty": "難易度"}}]
+    """
+    response = client.models.generate_content(
+        model="gemini-2.5-flash", contents=prompt, config={"response_mime_type": "application/json"}
+    )
+    return {item["question"]: (item["genre"], item["difficulty"]) for item in json.loads(response.text)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="履歴のお題にジャンル・難易度を付ける")
+    parser.add_argument("--llm", action="store_true", help="Gemini に分類させる")
+    parser.add_argument("--write-json", action="store_true", help="quiz_history.json にも書き戻す")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    store = history_store.get_history_store()
+    entries = store.untagged()
+    if not entries:
+        print("未設定のお題はありません。")
+        return
+
+    tags = {}
+    if args.llm:
+        tags = llm_tags(os.environ["GEMINI_API_KEY"], [e["question"] for e in entries])
+
+    for e in entries:
+        genre, difficulty = tags.get(e["question"]) or guess_tags(e["question"])
+        print(f"[{genre} / {difficulty}] {e['question']}")
+        if not args.dry_run:
+            store.set_tags(e["id"], genre, difficulty)
+        tags[e["question"]] = (genre, difficulty)
+
+    if args.write_json and not args.dry_run:
+        with open(history_store.HISTORY_FILE, "r", encoding="utf-8") as f:
+            history = json.load(f)
+        for h in history:
+            if h.get("question") in tags and not (h.get("genre") and h.get("difficulty")):
+                h["genre"], h["difficulty"] = tags[h["question"]]
+        with open(history_store.HISTORY_FILE, "w", encoding="utf-8") as f:
+            json.dump(history, f, ensure_ascii=False, indent=4)
+    print(f"{len(entries)} 件にジャンル・難易度を付けました。")
+
+
+if __name__ == "__main__":
+    main()
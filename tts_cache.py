@@ -0,0 +1,193 @@
+#読み上げ音声のキャッシュ
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# --- 設定 ---
+VOICE_CACHE_DIR = "voice_cache"
+MAX_ENTRIES = 500
+MAX_BYTES = 100 * 1024 * 1024
+
+
+class GTTSBackend:
+    """Googleの自動音声（gTTS）"""
+
+    def synthesize(self, text, lang, path):
+        from gtts import gTTS
+        gTTS(text=text, lang=lang).save(path)
+
+
+# MPEG1 Layer3 / 128kbps / 44.1kHz / ステレオ のフレームヘッダ（1フレーム = 417バイト, 約26ms）
+_SILENT_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+_FRAME_SEC = 1152 / 44100
+
+
+class LocalTTSBackend:
+    """
+    ネットワーク不要の代用品。文字数に応じた長さの無音MP3を書き出す。
+    （オフラインでの動作確認や負荷試験用）
+    """
+
+    def __init__(self, sec_per_char=0.15):
+        self.sec_per_char = sec_per_char
+
+    def synthesize(self, text, lang, path):
+        frames = max(1, int(len(text) * self.sec_per_char / _FRAME_SEC))
+        with open(path, "wb") as f:
+            f.write(_SILENT_FRAME * frames)
+
+
+class PersistentBackend:
+    """
+    合成した音声を永続キャッシュの "tts" 名前空間にも保存しておく包み。
+    再起動・別プロセスで voice_cache/ に無くても、保存済みのバイト列を書き出すだけで済む
+    """
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+
+    def synthesize(self, text, lang, path):
+        key = AudioCache.make_key(text, lang)
+        data = self.cache.get("tts", key)
+        if data is None:
+            self.backend.synthesize(text, lang, path)
+            with open(path, "rb") as f:
+                self.cache.set("tts", key, f.read())
+            return
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+class AudioCache:
+    """
+    (テキスト, 言語) のハッシュをファイル名にした音声キャッシュ。
+    同じ文章は一度しか合成せず、件数・容量の上限を超えたら古いものから消す（LRU）。
+    """
+
+    def __init__(self, directory=VOICE_CACHE_DIR, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, backend=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend or GTTSBackend()
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = OrderedDict()   # key -> バイト数（先頭ほど古い）
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # 再起動後も既存のファイルを使えるよう、更新日時の古い順に読み込む
+        files = []
+        for name in os.listdir(directory):
+            if name.endswith(".mp3"):
+                path = os.path.join(directory, name)
+                files.append((os.path.getmtime(path), name[:-4], os.path.getsize(path)))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def make_key(text, lang):
+        return hashlib.sha256(f"{lang}\0{text}".encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get(self, text, lang="ja"):
+        """音声ファイルのパスを返す。無ければ合成する"""
+        key = self.make_key(text, lang)
+        path = self.path_for(key)
+
+        with self._lock:
+            if key in self._entries and os.path.exists(path):
+                self._touch(key, path)
+                self.hits += 1
+                return path
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # 同じ文章を同時に合成しないよう、キーごとに待ち合わせる
+        with key_lock:
+            with self._lock:
+                if key in self._entries and os.path.exists(path):
+                    self._touch(key, path)
+                    self.hits += 1
+                    return path
+                self.misses += 1
+
+            # 一時ファイルに書いてから置き換えるので、読み手が書きかけのファイルを見ることはない
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            os.close(fd)
+            try:
+                self.backend.synthesize(text, lang, tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            with self._lock:
+                size = os.path.getsize(path)
+                self._bytes += size - self._entries.pop(key, 0)
+                self._entries[key] = size
+                self._evict(keep=key)
+                self._key_locks.pop(key, None)
+        return path
+
+    def _touch(self, key, path):
+        self._entries.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self, keep=None):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key, size = next(iter(self._entries.items()))
+            if key == keep:
+                break
+            del self._entries[key]
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_audio_cache(backend=None):
+    """プロセス全体で共有するキャッシュを返す"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AudioCache(backend=backend)
+        return _cache
+
+
+def audio_cache_stats():
+    """まだキャッシュが無ければ {}（ここで作ると、設定を見ない既定のバックエンドで固定されてしまう）"""
+    with _cache_lock:
+        cache = _cache
+    return cache.stats() if cache is not None else {}